@@ -3,7 +3,6 @@ from meshtastic.tcp_interface import TCPInterface
 from meshtastic.serial_interface import SerialInterface
 from pprint import pprint
 from pubsub import pub
-from escpos.printer import Network, Usb
 import time
 import os
 import sys
@@ -17,14 +16,23 @@ from meshtastic import mqtt_pb2, mesh_pb2
 from meshtastic import protocols
 import meshtastic.protobuf.portnums_pb2 as portnums_pb2
 import traceback
+import signal
 
 from database.connection import setup_database
-from database.repository import NodeRepository
-from common.common import printThis2
+from database.repository import NodeRepository, PrintHistoryRepository, ReceiptRepository
+from common.common import printThis2, printDigest, parse_node_ids
+from common.printqueue import PrintJob, PrintQueue, PrintScheduler, parse_class_config, SHED_POLICIES
+from common.printers import PrinterTarget, send_receipt
+from common.governor import PrintGovernor
+from common.raster import RasterRenderer
+from common.history import PrintHistory
+from common.receipts import ReceiptStore
+from common.reload import ConfigReloader
 
 load_dotenv()
 PRINTER_TYPE = os.getenv("PRINTER_TYPE", "network").lower()
 PRINTER_IP = os.getenv("PRINTER_IP")
+PRINTER_PORT = int(os.getenv("PRINTER_PORT", 9100))
 PRINTER_USB_VENDOR_ID = os.getenv("PRINTER_USB_VENDOR_ID")
 PRINTER_USB_PRODUCT_ID = os.getenv("PRINTER_USB_PRODUCT_ID")
 PRINTER_USB_DEVICE = os.getenv("PRINTER_USB_DEVICE")
@@ -35,8 +43,27 @@ MQTT_PASS = os.getenv("MQTT_PASS")
 MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))  # Default to 1883 if not set
 MQTT_TOPICS = os.getenv("MQTT_TOPICS")
 CHANNEL_KEY = os.getenv("CHANNEL_KEY")
-ADMIN_IDS = os.getenv("ADMIN_IDS", "").split(",") if os.getenv("ADMIN_IDS") else []
+ADMIN_IDS = parse_node_ids(os.getenv("ADMIN_IDS"))
+PRINT_DIGEST_THRESHOLD = int(os.getenv("PRINT_DIGEST_THRESHOLD", 5))  # 0 disables digest printing
+PRINT_DIGEST_MAX = int(os.getenv("PRINT_DIGEST_MAX", 8))
+PRINT_CLASS_WEIGHTS = os.getenv("PRINT_CLASS_WEIGHTS", "admin=8,dm=4,channel=1")  # Highest priority first
+PRINT_CLASS_CAPS = os.getenv("PRINT_CLASS_CAPS", "admin=50,dm=100,channel=200")
+PRINT_SHED_POLICY = os.getenv("PRINT_SHED_POLICY", "drop-oldest")  # drop-oldest, drop-lowest-priority or defer
+PRINT_SPOOL_PATH = os.getenv("PRINT_SPOOL_PATH", "data/print-spool.ndjson")
+PRINT_MODE = os.getenv("PRINT_MODE", "text").lower()  # "text" or "raster"
+PRINTER_WIDTH_PX = int(os.getenv("PRINTER_WIDTH_PX", 512))
+RASTER_FONT_PATH = os.getenv("RASTER_FONT_PATH")
+RASTER_FONT_SIZE = int(os.getenv("RASTER_FONT_SIZE", 24))
 BROADCAST_ID = 4294967295
+CONFIG_FILE = os.getenv("CONFIG_FILE", ".env")  # Reloaded on SIGHUP or when it changes
+CONFIG_WATCH_INTERVAL = float(os.getenv("CONFIG_WATCH_INTERVAL", 2))  # 0 reloads on SIGHUP only
+PRINT_HISTORY = os.getenv("PRINT_HISTORY", "true").lower() == "true"  # Keep printed telegrams for search
+REPRINT_STORE_MB = float(os.getenv("REPRINT_STORE_MB", 32))  # Printed receipts kept for reprint.py; 0 keeps none
+PRINT_PAPER_MM_PER_HOUR = float(os.getenv("PRINT_PAPER_MM_PER_HOUR", 0))  # 0 = no limit
+PRINT_DUTY_CYCLE = float(os.getenv("PRINT_DUTY_CYCLE", 1))  # 1 = no limit
+PRINT_DUTY_WINDOW = int(os.getenv("PRINT_DUTY_WINDOW", 600))
+PRINTER_SPEED_MM_S = float(os.getenv("PRINTER_SPEED_MM_S", 150))
+PRINTER_CUT_SECONDS = float(os.getenv("PRINTER_CUT_SECONDS", 0.5))
 LOG_LEVEL = logging.DEBUG
 
 # LOGGER SETUP
@@ -50,7 +77,7 @@ logger = logging.getLogger('telegramtastic-dm')
 logger.setLevel(LOG_LEVEL)  # Set only this logger to DEBUG
 logger.info(f"Logging level set to {logging.getLevelName(logger.getEffectiveLevel())}")
 logger.debug(f"Logger running to {logging.getLevelName(logger.getEffectiveLevel())}")
-logger.info(f"Admin IDs configured: {ADMIN_IDS if ADMIN_IDS else 'None'}")
+logger.info(f"Admin IDs configured: {sorted(ADMIN_IDS) if ADMIN_IDS else 'None'}")
 
 # DB SETUP
 db_session_factory = setup_database()
@@ -68,46 +95,85 @@ interface = SerialInterface()
 # PRINTER SETUP
 def setup_printer():
     """Setup printer connection based on configuration"""
-    if PRINTER_TYPE == "network":
-        if not PRINTER_IP:
-            logger.error("PRINTER_IP not set for network printer")
-            sys.exit(1)
-        try:
-            logger.info(f"Connecting to network printer at {PRINTER_IP}...")
-            printer = Network(PRINTER_IP, timeout=5)
-            printer.set_with_default()
-            return printer
-        except Exception as e:
-            logger.error(f"Error connecting to network printer: {e}")
-            sys.exit(1)
-    
-    elif PRINTER_TYPE == "usb":
-        try:
-            if PRINTER_USB_DEVICE:
-                logger.info(f"Connecting to USB printer at device {PRINTER_USB_DEVICE}...")
-                printer = Usb(PRINTER_USB_DEVICE)
-            elif PRINTER_USB_VENDOR_ID and PRINTER_USB_PRODUCT_ID:
-                # Convert hex strings to integers
-                vendor_id = int(PRINTER_USB_VENDOR_ID, 16)
-                product_id = int(PRINTER_USB_PRODUCT_ID, 16)
-                logger.info(f"Connecting to USB printer (VID: {hex(vendor_id)}, PID: {hex(product_id)})...")
-                printer = Usb(vendor_id, product_id)
-            else:
-                logger.error("USB printer requires either PRINTER_USB_DEVICE or both PRINTER_USB_VENDOR_ID and PRINTER_USB_PRODUCT_ID")
-                sys.exit(1)
-            
-            printer.set_with_default()
-            return printer
-        except Exception as e:
-            logger.error(f"Error connecting to USB printer: {e}")
-            sys.exit(1)
-    
-    else:
-        logger.error(f"Invalid PRINTER_TYPE: {PRINTER_TYPE}. Must be 'network' or 'usb'")
+    try:
+        return PrinterTarget.from_env(
+            PRINTER_TYPE, PRINTER_IP, PRINTER_PORT,
+            PRINTER_USB_DEVICE, PRINTER_USB_VENDOR_ID, PRINTER_USB_PRODUCT_ID
+        ).open()
+    except Exception as e:
+        logger.error(f"Error connecting to {PRINTER_TYPE} printer: {e}")
         sys.exit(1)
 
 printer = setup_printer()
 
+if PRINT_MODE == "raster":
+    raster = RasterRenderer(width=PRINTER_WIDTH_PX, font_path=RASTER_FONT_PATH, font_size=RASTER_FONT_SIZE)
+    logger.info(f"Raster printing enabled ({PRINTER_WIDTH_PX}px wide)")
+
+    def printJob(job, printer):
+        raster.print_jobs(printer, "MESHTASTIC TELEGRAM\nOPENSAUCE 2025\n", [job], sep=" aka ")
+
+    def printJobDigest(jobs, printer):
+        raster.print_jobs(printer, "MESHTASTIC TELEGRAM\nOPENSAUCE 2025\n", jobs, sep=" aka ")
+else:
+    def printJob(job, printer):
+        printThis2(job.frm, job.text, printer, received=job.received)
+
+    def printJobDigest(jobs, printer):
+        printDigest(jobs, printer, title="MESHTASTIC TELEGRAM\nOPENSAUCE 2025\n", sep=" aka ")
+
+receipt_store = None
+if REPRINT_STORE_MB > 0:
+    receipt_store = ReceiptStore(
+        ReceiptRepository(db_session_factory),
+        max_bytes=int(REPRINT_STORE_MB * 1024 * 1024)
+    ).load().register_title("MESHTASTIC TELEGRAM\nOPENSAUCE 2025\n").start()
+
+try:
+    print_governor = PrintGovernor(
+        paper_mm_per_hour=PRINT_PAPER_MM_PER_HOUR,
+        duty_cycle=PRINT_DUTY_CYCLE,
+        duty_window=PRINT_DUTY_WINDOW,
+        speed_mm_s=PRINTER_SPEED_MM_S,
+        cut_seconds=PRINTER_CUT_SECONDS
+    )
+except ValueError as e:
+    logger.error(f"Invalid PRINT_DUTY_CYCLE: {e}")
+    sys.exit(1)
+
+def governedPrintJob(job, printer):
+    """Print a telegram within the paper and duty budget, keeping its receipt for reprints"""
+    send_receipt(printer, lambda buffer: printJob(job, buffer), [job], print_governor, receipt_store)
+
+def governedPrintDigest(jobs, printer):
+    send_receipt(printer, lambda buffer: printJobDigest(jobs, buffer), jobs, print_governor, receipt_store)
+
+if PRINT_SHED_POLICY not in SHED_POLICIES:
+    logger.error(f"Invalid PRINT_SHED_POLICY: {PRINT_SHED_POLICY}. Must be one of {', '.join(SHED_POLICIES)}")
+    sys.exit(1)
+
+print_history = PrintHistory(PrintHistoryRepository(db_session_factory), "dm").start() if PRINT_HISTORY else None
+
+def recordPrintState(job, state, error=None):
+    """Add each telegram to the print history once it is on paper"""
+    if state == "printed":
+        print_history.record(job)
+
+print_queue = PrintQueue(
+    printer,
+    governedPrintJob,
+    print_digest=governedPrintDigest,
+    digest_threshold=PRINT_DIGEST_THRESHOLD,
+    digest_max=PRINT_DIGEST_MAX,
+    scheduler=PrintScheduler(
+        parse_class_config(PRINT_CLASS_WEIGHTS, PRINT_CLASS_CAPS),
+        policy=PRINT_SHED_POLICY,
+        spool_path=PRINT_SPOOL_PATH
+    ),
+    on_state=recordPrintState if print_history is not None else None,
+    governor=print_governor
+).start()
+
 def lookupNode(id) -> object:
     """
     Look up a node ID and return a descriptive name if available.
@@ -212,22 +278,22 @@ def getPreset(val):
 
 def initialize_users():
     logger.debug("Initializing users from current nodes")
-    nodes = interface.nodes
-    for node in nodes.values():
+    rows = []
+    for node in interface.nodes.values():
         try:
-            # Store in database
-            success = node_repo.save_or_update_node(
-                node_id=node["num"],
-                short_name=node["user"]["shortName"],
-                long_name=node["user"]["longName"],
-                hw_model_name=node["user"]["hwModel"]
-            )
-            if not success:
-                logger.warning(f"Failed to save node {node} to database")
-            # else:
-            #     logger.debug("Updated!")
+            rows.append({
+                "node_id": node["num"],
+                "short_name": node["user"]["shortName"],
+                "long_name": node["user"]["longName"],
+                "hw_model_name": node["user"]["hwModel"]
+            })
         except Exception as e:
-            logger.warning(f"Error updating node on start: {e}")
+            logger.warning(f"Error reading node {node.get('num')} on start: {e}")
+    # One transaction for the whole node list rather than one per node
+    if node_repo.save_nodes(rows):
+        logger.info(f"Saved {len(rows)} nodes from the radio to the database")
+    else:
+        logger.warning(f"Failed to save {len(rows)} nodes from the radio to the database")
 
 def wakeUpAndSayHello(interface):
     me = interface.nodesByNum[interface.localNode.nodeNum]["user"]
@@ -269,20 +335,20 @@ def handleDM(packet, interface):
         # Get the sender node ID for rate limiting
         sender_node_id = packet["from"]
         
-        # Check if sender is an admin (convert to string for comparison)
-        if str(sender_node_id) in ADMIN_IDS:
+        # Check if sender is an admin
+        if sender_node_id in ADMIN_IDS:
             # Admin path - bypass rate limits
             logger.info(f"Admin printing message from node {sender_node_id} ({sender.short_name}): {payload}")
-            printThis2(sender, payload, printer)
-            interface.sendText("Message Printed", destinationId=packet['fromId'])
+            if not print_queue.submit(PrintJob(sender, payload, priority="admin", from_id=sender_node_id, packet_id=packet.get("id"), on_printed=lambda job: interface.sendText("Message Printed", destinationId=packet['fromId']))):
+                logger.warning(f"Print backlog full, dropped admin message from node {sender_node_id} ({sender.short_name})")
         else:
             # Regular user path - check rate limits
             if node_repo.can_print_message(sender_node_id, MESSAGE_RATE_LIMIT_SECONDS):
                 # Update the last print timestamp in database
                 if node_repo.update_last_print(sender_node_id):
                     logger.info(f"Printing message from node {sender_node_id} ({sender.short_name}): {payload}")
-                    printThis2(sender, payload, printer)
-                    interface.sendText("Your telegram has been printed. Stop by the Meshtastic booth to pick it up! Main Hall E12 (Right in the middle)",destinationId=packet['fromId'])
+                    if not print_queue.submit(PrintJob(sender, payload, priority="dm", from_id=sender_node_id, packet_id=packet.get("id"), on_printed=lambda job: interface.sendText("Your telegram has been printed. Stop by the Meshtastic booth to pick it up! Main Hall E12 (Right in the middle)",destinationId=packet['fromId']))):
+                        logger.warning(f"Print backlog full, dropped dm message from node {sender_node_id} ({sender.short_name})")
                 else:
                     logger.warning(f"Failed to update last_print for node {sender_node_id}, skipping print")
             else:
@@ -345,6 +411,14 @@ def onReceive(packet, interface):
     else:
         handleOther(packet, interface)
 
+def applyConfig(changes):
+    """Apply reloaded admin IDs and rate limit in place"""
+    global ADMIN_IDS, MESSAGE_RATE_LIMIT_SECONDS
+    admin_ids = parse_node_ids(changes["ADMIN_IDS"][1]) if "ADMIN_IDS" in changes else ADMIN_IDS
+    rate_limit = int(changes["MESSAGE_RATE_LIMIT_SECONDS"][1] or 60) if "MESSAGE_RATE_LIMIT_SECONDS" in changes else MESSAGE_RATE_LIMIT_SECONDS
+    ADMIN_IDS, MESSAGE_RATE_LIMIT_SECONDS = admin_ids, rate_limit
+    logger.info(f"Admin IDs: {sorted(ADMIN_IDS) if ADMIN_IDS else 'None'}, rate limit: {MESSAGE_RATE_LIMIT_SECONDS}s")
+
 def onConnection(interface, topic=pub.AUTO_TOPIC):
     """called when we (re)connect to the radio"""
     logger.info("Connected to radio!")
@@ -353,7 +427,28 @@ if __name__ == "__main__":
     logger.info("Starting up")
     # initialize_config()
     initialize_users()
+    config_reloader = ConfigReloader(
+        CONFIG_FILE,
+        ["MESSAGE_RATE_LIMIT_SECONDS", "ADMIN_IDS"],
+        applyConfig,
+        poll_interval=CONFIG_WATCH_INTERVAL
+    ).start()
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: config_reloader.trigger())
     pub.subscribe(onConnection, "meshtastic.connection.established")
     pub.subscribe(onReceive, "meshtastic.receive")
     #pub.subscribe(onText, "meshtastic.receive.text")
-    main()
\ No newline at end of file
+    # Exit through SystemExit on SIGTERM so the shutdown below runs
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Telegrams already queued have used up their sender's cooldown, so print them before exiting
+        if not print_queue.drain():
+            logger.warning(f"Exiting with {print_queue.depth()} telegram(s) still queued for printing")
+        if print_history is not None:
+            print_history.flush()
+        if receipt_store is not None:
+            receipt_store.flush()
\ No newline at end of file
@@ -1,40 +1,136 @@
 #!/usr/bin/env python
-from escpos.printer import Network, Usb
 import time
 import os
 import sys
 import logging
 from dotenv import load_dotenv
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 import base64
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
-from meshtastic import mqtt_pb2, mesh_pb2
-from meshtastic import protocols
+from cryptography.hazmat.primitives.ciphers import algorithms
+from meshtastic import mesh_pb2
 import meshtastic.protobuf.portnums_pb2 as portnums_pb2
 import traceback
+import json
+import threading
+import signal
+import queue
+import random
+import socket
+import gc
+from datetime import datetime
+from types import SimpleNamespace
 
 #sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from database.connection import setup_database
-from database.repository import NodeRepository
+from database.connection import setup_database, get_db_path, schema_stats
+from database.maintenance import DatabaseMaintenance
+from database.repository import NodeRepository, RxStatRepository, PrintHandoffRepository, PrintLedgerRepository, PrintHistoryRepository, ReceiptRepository
 
-from common.common import printThis
+from common.common import printThis, printDigest, parse_node_ids
+from common.printqueue import PrintJob, PrintQueue, PrintScheduler, parse_class_config, SHED_POLICIES
+from common.printers import PrinterTarget, send_receipt
+from common.governor import PrintGovernor
+from common.routing import Route, PrintRouter, parse_routes
+from common.raster import RasterRenderer
+from common.metrics import IngestMeter
+from common.dedup import RecentPackets
+from common.soak import SoakMonitor, format_report
+from common.tracing import Tracer, SamplingProfiler
+from common.status import StatusServer
+from common.nodecache import NodeCache
+from common.nodesnapshot import NodeSnapshotter
+from common.ratelimit import PrintRateLimiter
+from common.rxstats import RxStatsAggregator
+from common.reload import ConfigReloader
+from common.cluster import PrintCoordinator
+from common.ledger import PrintLedger
+from common.history import PrintHistory
+from common.receipts import ReceiptStore
+from common.packet import PacketView
+from common.archive import TrafficArchive
+from common.transports import RadioMessage, RadioTransport, TransportMeter
 
 # ENVVAR Setup
 load_dotenv()
 PRINTER_TYPE = os.getenv("PRINTER_TYPE", "network").lower()
 PRINTER_IP = os.getenv("PRINTER_IP")
+PRINTER_PORT = int(os.getenv("PRINTER_PORT", 9100))
 PRINTER_USB_VENDOR_ID = os.getenv("PRINTER_USB_VENDOR_ID")
 PRINTER_USB_PRODUCT_ID = os.getenv("PRINTER_USB_PRODUCT_ID")
 PRINTER_USB_DEVICE = os.getenv("PRINTER_USB_DEVICE")
+PRINT_ROUTES = os.getenv("PRINT_ROUTES")  # Print channels, DMs or senders at different printers
 MESSAGE_RATE_LIMIT_SECONDS = int(os.getenv("MESSAGE_RATE_LIMIT_SECONDS", 60))
+TRANSPORTS = os.getenv("TRANSPORTS", "mqtt")  # Packet sources: mqtt, serial[:DEVICE] and tcp:HOST[:PORT], comma-separated
 MQTT_SRV = os.getenv("MQTT_SRV")
 MQTT_USER = os.getenv("MQTT_USER")
 MQTT_PASS = os.getenv("MQTT_PASS")
 MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))  # Default to 1883 if not set
+MQTT_CLIENT_ID = os.getenv("MQTT_CLIENT_ID") or f"telegramtastic-{socket.gethostname()}"  # Must stay the same across restarts
+MQTT_CLEAN_SESSION = os.getenv("MQTT_CLEAN_SESSION", "false").lower() == "true"
+MQTT_QOS = int(os.getenv("MQTT_QOS", 1))
+MQTT_RECONNECT_MIN = float(os.getenv("MQTT_RECONNECT_MIN", 1))
+MQTT_RECONNECT_MAX = float(os.getenv("MQTT_RECONNECT_MAX", 120))
+MQTT_INBOX_SIZE = int(os.getenv("MQTT_INBOX_SIZE", 1000))  # 0 handles messages on the network thread
+MQTT_PROTOCOL = os.getenv("MQTT_PROTOCOL", "3.1.1")  # "3.1.1" or "5"
+MQTT_SESSION_EXPIRY = int(os.getenv("MQTT_SESSION_EXPIRY", 86400))  # MQTT 5 only: seconds the broker keeps our session
+MQTT_SHARE_GROUP = os.getenv("MQTT_SHARE_GROUP")  # Instances in the same group split the topics' messages
 MQTT_TOPICS = os.getenv("MQTT_TOPICS")
 CHANNEL_KEY = os.getenv("CHANNEL_KEY")
+MQTT_STATS_TOPIC = os.getenv("MQTT_STATS_TOPIC")  # Publish ingest stats here when set
+MQTT_STATS_INTERVAL = int(os.getenv("MQTT_STATS_INTERVAL", 5))
+PRINT_DIGEST_THRESHOLD = int(os.getenv("PRINT_DIGEST_THRESHOLD", 5))  # 0 disables digest printing
+PRINT_DIGEST_MAX = int(os.getenv("PRINT_DIGEST_MAX", 8))
+ADMIN_IDS = parse_node_ids(os.getenv("ADMIN_IDS"))  # Printed ahead of other telegrams
+PRINT_CLASS_WEIGHTS = os.getenv("PRINT_CLASS_WEIGHTS", "admin=8,dm=4,channel=1")  # Highest priority first
+PRINT_CLASS_CAPS = os.getenv("PRINT_CLASS_CAPS", "admin=50,dm=100,channel=200")
+PRINT_SHED_POLICY = os.getenv("PRINT_SHED_POLICY", "drop-oldest")  # drop-oldest, drop-lowest-priority or defer
+PRINT_SPOOL_PATH = os.getenv("PRINT_SPOOL_PATH", "data/print-spool.ndjson")
+PRINT_MODE = os.getenv("PRINT_MODE", "text").lower()  # "text" or "raster"
+PRINTER_WIDTH_PX = int(os.getenv("PRINTER_WIDTH_PX", 512))
+RASTER_FONT_PATH = os.getenv("RASTER_FONT_PATH")
+RASTER_FONT_SIZE = int(os.getenv("RASTER_FONT_SIZE", 24))
 BROADCAST_ID = 4294967295
+STATUS_HOST = os.getenv("STATUS_HOST", "127.0.0.1")
+STATUS_PORT = int(os.getenv("STATUS_PORT", 8080))  # 0 disables the status server
+STATUS_MAX_DISCONNECTED_SECONDS = int(os.getenv("STATUS_MAX_DISCONNECTED_SECONDS", 300))
+NODE_CACHE_SIZE = int(os.getenv("NODE_CACHE_SIZE", 10000))
+NODE_SNAPSHOT_PATH = os.getenv("NODE_SNAPSHOT_PATH", "data/node-snapshot.bin")  # Empty disables the snapshot
+NODE_SNAPSHOT_INTERVAL = int(os.getenv("NODE_SNAPSHOT_INTERVAL", 600))  # Seconds between snapshot writes; 0 writes at shutdown only
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "false").lower() == "true"
+TRACE_MAX_EVENTS = int(os.getenv("TRACE_MAX_EVENTS", 50000))
+TRACE_DIR = os.getenv("TRACE_DIR", "data")
+SOAK_INTERVAL = int(os.getenv("SOAK_INTERVAL", 0))  # Seconds between soak test samples; 0 disables soak mode
+SOAK_TOP_SITES = int(os.getenv("SOAK_TOP_SITES", 25))  # Allocation sites sampled with tracemalloc; 0 leaves it off
+DEDUP_SIZE = int(os.getenv("DEDUP_SIZE", 10000))  # Recent packet IDs remembered to drop duplicate uplinks
+PROFILE_SECONDS = int(os.getenv("PROFILE_SECONDS", 30))
+PROFILE_INTERVAL_MS = int(os.getenv("PROFILE_INTERVAL_MS", 5))
+DB_MAINTENANCE_INTERVAL = int(os.getenv("DB_MAINTENANCE_INTERVAL", 3600))  # 0 disables maintenance
+NODE_RETENTION_DAYS = int(os.getenv("NODE_RETENTION_DAYS", 90))  # 0 keeps every node
+NODE_KEEP_PRINTED_DAYS = int(os.getenv("NODE_KEEP_PRINTED_DAYS", 30))
+RX_STATS_WINDOW = int(os.getenv("RX_STATS_WINDOW", 256))  # Signal samples kept per gateway and node
+RX_STATS_FLUSH_INTERVAL = int(os.getenv("RX_STATS_FLUSH_INTERVAL", 300))  # 0 keeps stats in memory only
+RX_STATS_RETENTION_DAYS = int(os.getenv("RX_STATS_RETENTION_DAYS", 30))
+CONFIG_FILE = os.getenv("CONFIG_FILE", ".env")  # Reloaded on SIGHUP or when it changes
+CONFIG_WATCH_INTERVAL = float(os.getenv("CONFIG_WATCH_INTERVAL", 2))  # 0 reloads on SIGHUP only
+# Hand telegrams to whichever instance holds the printer lease; needed when several instances run
+PRINT_HANDOFF = os.getenv("PRINT_HANDOFF", "true" if MQTT_SHARE_GROUP else "false").lower() == "true"
+PRINTER_NAME = os.getenv("PRINTER_NAME", "default")  # Lease name, shared by the instances driving one printer
+PRINT_LEASE_TTL = float(os.getenv("PRINT_LEASE_TTL", 15))
+PRINT_JOBS_RETENTION_DAYS = int(os.getenv("PRINT_JOBS_RETENTION_DAYS", 7))  # Finished handoff jobs and ledger entries kept this long
+PRINT_LEDGER = os.getenv("PRINT_LEDGER", "true").lower() == "true"  # Without PRINT_HANDOFF, whose print_jobs table does the same
+PRINT_LEDGER_FLUSH_MS = int(os.getenv("PRINT_LEDGER_FLUSH_MS", 200))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR")  # Archive decoded traffic here when set
+ARCHIVE_SEGMENT_MINUTES = float(os.getenv("ARCHIVE_SEGMENT_MINUTES", 60))
+ARCHIVE_SEGMENT_MB = float(os.getenv("ARCHIVE_SEGMENT_MB", 64))
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", 0))  # 0 keeps every segment
+PRINT_HISTORY = os.getenv("PRINT_HISTORY", "true").lower() == "true"  # Keep printed telegrams for search
+REPRINT_STORE_MB = float(os.getenv("REPRINT_STORE_MB", 32))  # Printed receipts kept for reprint.py; 0 keeps none
+PRINT_PAPER_MM_PER_HOUR = float(os.getenv("PRINT_PAPER_MM_PER_HOUR", 0))  # Paper per printer in any hour; 0 = no limit
+PRINT_DUTY_CYCLE = float(os.getenv("PRINT_DUTY_CYCLE", 1))  # Share of time a printer may spend printing; 1 = no limit
+PRINT_DUTY_WINDOW = int(os.getenv("PRINT_DUTY_WINDOW", 600))  # Seconds the duty cycle is averaged over
+PRINTER_SPEED_MM_S = float(os.getenv("PRINTER_SPEED_MM_S", 150))  # Used to estimate print time
+PRINTER_CUT_SECONDS = float(os.getenv("PRINTER_CUT_SECONDS", 0.5))
 LOG_LEVEL = logging.DEBUG
 
 # LOGGER SETUP
@@ -49,60 +145,303 @@ logger = logging.getLogger('telegramtastic')
 logger.info(f"Logging level set to {logging.getLevelName(logger.getEffectiveLevel())}")
 logger.debug(f"Logger running to {logging.getLevelName(logger.getEffectiveLevel())}")
 
+# TRACING SETUP
+# Soak mode reads per-stage latency from the trace spans
+tracer = Tracer(enabled=TRACE_ENABLED or SOAK_INTERVAL > 0, max_events=TRACE_MAX_EVENTS)
+profiler = SamplingProfiler(interval=PROFILE_INTERVAL_MS / 1000)
+
+def dump_trace(signum, frame):
+    """SIGUSR1: write the recorded packet spans as Chrome trace JSON"""
+    path = os.path.join(TRACE_DIR, f"trace-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    try:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        count = tracer.export(path)
+        logger.info(f"Wrote {count} trace events to {path}")
+    except OSError as e:
+        logger.error(f"Unable to write trace: {e}")
+
+def start_profile(signum, frame):
+    """SIGUSR2: sample all threads for PROFILE_SECONDS and write folded stacks"""
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    path = os.path.join(TRACE_DIR, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+    if profiler.start(PROFILE_SECONDS, path):
+        logger.info(f"Profiling for {PROFILE_SECONDS}s, writing to {path}")
+    else:
+        logger.info("Profiler already running")
+
+if hasattr(signal, "SIGUSR1"):
+    signal.signal(signal.SIGUSR1, dump_trace)
+    signal.signal(signal.SIGUSR2, start_profile)
+if TRACE_ENABLED:
+    logger.info(f"Packet tracing enabled, send SIGUSR1 to write a trace to {TRACE_DIR}")
+
 # DB SETUP
 db_session_factory = setup_database()
 if db_session_factory:
-    node_repo = NodeRepository(db_session_factory)
+    node_repo = tracer.instrument(
+        NodeRepository(db_session_factory),
+        "repository",
+        ["get_node_by_id", "save_or_update_node", "can_print_message", "update_last_print"]
+    )
     logger.info("Database repositories initialized")
+    db_maintenance = DatabaseMaintenance(
+        get_db_path(),
+        node_retention_days=NODE_RETENTION_DAYS,
+        keep_printed_days=NODE_KEEP_PRINTED_DAYS,
+        rx_stats_retention_days=RX_STATS_RETENTION_DAYS,
+        print_jobs_retention_days=PRINT_JOBS_RETENTION_DAYS,
+        interval=DB_MAINTENANCE_INTERVAL
+    ).start()
 else:
     logger.error("Database connection failed - exiting")
     sys.exit(1)
 
 # PRINTER SETUP
+def connectPrinter(target=None):
+    """Connect to a printer, by default the one set by PRINTER_*, raising an exception if that fails"""
+    if target is None:
+        target = PrinterTarget.from_env(
+            PRINTER_TYPE, PRINTER_IP, PRINTER_PORT,
+            PRINTER_USB_DEVICE, PRINTER_USB_VENDOR_ID, PRINTER_USB_PRODUCT_ID
+        )
+    return target.open()
+
 def setup_printer():
     """Setup printer connection based on configuration"""
-    if PRINTER_TYPE == "network":
-        if not PRINTER_IP:
-            logger.error("PRINTER_IP not set for network printer")
-            sys.exit(1)
-        try:
-            logger.info(f"Connecting to network printer at {PRINTER_IP}...")
-            printer = Network(PRINTER_IP, timeout=5)
-            printer.set_with_default()
-            return printer
-        except Exception as e:
-            logger.error(f"Error connecting to network printer: {e}")
-            sys.exit(1)
-    
-    elif PRINTER_TYPE == "usb":
-        try:
-            if PRINTER_USB_DEVICE:
-                logger.info(f"Connecting to USB printer at device {PRINTER_USB_DEVICE}...")
-                printer = Usb(PRINTER_USB_DEVICE)
-            elif PRINTER_USB_VENDOR_ID and PRINTER_USB_PRODUCT_ID:
-                # Convert hex strings to integers
-                vendor_id = int(PRINTER_USB_VENDOR_ID, 16)
-                product_id = int(PRINTER_USB_PRODUCT_ID, 16)
-                logger.info(f"Connecting to USB printer (VID: {hex(vendor_id)}, PID: {hex(product_id)})...")
-                printer = Usb(vendor_id, product_id)
-            else:
-                logger.error("USB printer requires either PRINTER_USB_DEVICE or both PRINTER_USB_VENDOR_ID and PRINTER_USB_PRODUCT_ID")
-                sys.exit(1)
-            
-            printer.set_with_default()
-            return printer
-        except Exception as e:
-            logger.error(f"Error connecting to USB printer: {e}")
-            sys.exit(1)
-    
-    else:
-        logger.error(f"Invalid PRINTER_TYPE: {PRINTER_TYPE}. Must be 'network' or 'usb'")
+    try:
+        return connectPrinter()
+    except Exception as e:
+        logger.error(f"Error connecting to {PRINTER_TYPE} printer: {e}")
+        sys.exit(1)
+
+print_routes = None
+if PRINT_ROUTES:
+    if PRINT_HANDOFF:
+        logger.error("PRINT_ROUTES cannot be used with PRINT_HANDOFF, whose lease covers a single printer")
         sys.exit(1)
+    try:
+        print_routes = parse_routes(PRINT_ROUTES)
+    except ValueError as e:
+        logger.error(f"Invalid PRINT_ROUTES: {e}")
+        sys.exit(1)
+
+# With handoff, the printer is opened by whichever instance wins its lease,
+# and with routes, by each route's print worker
+printer = None if PRINT_HANDOFF or print_routes else setup_printer()
 
-printer = setup_printer()
+if PRINT_MODE == "raster":
+    raster = RasterRenderer(width=PRINTER_WIDTH_PX, font_path=RASTER_FONT_PATH, font_size=RASTER_FONT_SIZE)
+    logger.info(f"Raster printing enabled ({PRINTER_WIDTH_PX}px wide)")
 
-# Keep packets we've seen in memory.
-seenPackets = list()
+    def printJob(job, printer):
+        raster.print_jobs(printer, "MESHTASTIC TELEGRAM\n", [job])
+
+    def printJobDigest(jobs, printer):
+        raster.print_jobs(printer, "MESHTASTIC TELEGRAM\n", jobs)
+else:
+    def printJob(job, printer):
+        printThis(job.to, job.frm, job.text, printer, received=job.received)
+
+    printJobDigest = printDigest
+
+receipt_store = None
+if REPRINT_STORE_MB > 0:
+    receipt_store = ReceiptStore(
+        ReceiptRepository(db_session_factory),
+        max_bytes=int(REPRINT_STORE_MB * 1024 * 1024)
+    ).load().register_title("MESHTASTIC TELEGRAM\n").start()
+
+def tracedPrintJob(job, printer, governor=None):
+    with tracer.span("printThis", job.packet_id):
+        send_receipt(printer, lambda buffer: printJob(job, buffer), [job], governor, receipt_store)
+
+def tracedPrintDigest(jobs, printer, governor=None):
+    with tracer.span("printDigest"):
+        send_receipt(printer, lambda buffer: printJobDigest(jobs, buffer), jobs, governor, receipt_store)
+
+if PRINT_SHED_POLICY not in SHED_POLICIES:
+    logger.error(f"Invalid PRINT_SHED_POLICY: {PRINT_SHED_POLICY}. Must be one of {', '.join(SHED_POLICIES)}")
+    sys.exit(1)
+
+if not 0 < PRINT_DUTY_CYCLE <= 1:
+    logger.error(f"Invalid PRINT_DUTY_CYCLE: {PRINT_DUTY_CYCLE}. Must be above 0 and at most 1")
+    sys.exit(1)
+
+def jobPayload(job, route=None):
+    """Everything needed to print a job again later, as stored in print_jobs and print_ledger"""
+    payload = {
+        "frm": [job.frm.short_name, job.frm.long_name],
+        "to": [job.to.short_name, job.to.long_name],
+        "text": job.text,
+        "received": job.received.isoformat(),
+        "packet_id": job.packet_id,
+    }
+    if route is not None:
+        payload["route"] = route
+    return payload
+
+def jobFromPayload(payload, priority, **kwargs):
+    """Rebuild a PrintJob from jobPayload()"""
+    return PrintJob(
+        SimpleNamespace(short_name=payload["frm"][0], long_name=payload["frm"][1]),
+        payload["text"],
+        to=SimpleNamespace(short_name=payload["to"][0], long_name=payload["to"][1]),
+        received=datetime.fromisoformat(payload["received"]),
+        packet_id=payload["packet_id"],
+        priority=priority,
+        **kwargs
+    )
+
+print_ledger = None
+if PRINT_LEDGER and not PRINT_HANDOFF:
+    print_ledger = PrintLedger(
+        PrintLedgerRepository(db_session_factory),
+        flush_interval=PRINT_LEDGER_FLUSH_MS / 1000
+    ).load().start()
+
+print_history = PrintHistory(PrintHistoryRepository(db_session_factory), "mqtt").start() if PRINT_HISTORY else None
+
+def recordPrintState(job, state, error=None):
+    """Keep the print ledger and history up to date as the print worker handles each job"""
+    if print_ledger is not None and job.from_id is not None and job.packet_id is not None:
+        print_ledger.mark(job.from_id, job.packet_id, state, error)
+    if print_history is not None and state == "printed":
+        print_history.record(job)
+
+def startPrintQueue(printer, spool_path, **kwargs):
+    # Each printer has its own paper and duty budget
+    governor = PrintGovernor(
+        paper_mm_per_hour=PRINT_PAPER_MM_PER_HOUR,
+        duty_cycle=PRINT_DUTY_CYCLE,
+        duty_window=PRINT_DUTY_WINDOW,
+        speed_mm_s=PRINTER_SPEED_MM_S,
+        cut_seconds=PRINTER_CUT_SECONDS
+    )
+    return PrintQueue(
+        printer,
+        lambda job, printer: tracedPrintJob(job, printer, governor),
+        print_digest=lambda jobs, printer: tracedPrintDigest(jobs, printer, governor),
+        digest_threshold=PRINT_DIGEST_THRESHOLD,
+        digest_max=PRINT_DIGEST_MAX,
+        scheduler=PrintScheduler(
+            parse_class_config(PRINT_CLASS_WEIGHTS, PRINT_CLASS_CAPS),
+            policy=PRINT_SHED_POLICY,
+            spool_path=spool_path,
+            # Deferred telegrams are still queued in the ledger, which prints them again itself
+            resume_spool=print_ledger is None
+        ),
+        on_state=recordPrintState if print_ledger is not None or print_history is not None else None,
+        governor=governor,
+        **kwargs
+    ).start()
+
+def startStation(name, target):
+    """Start the print worker for a printer in PRINT_ROUTES"""
+    try:
+        station_printer = connectPrinter(target)
+    except Exception as e:
+        # The worker keeps trying, so the other stations can print meanwhile
+        logger.error(f"Error connecting to printer for route {name}: {e}")
+        station_printer = None
+    root, ext = os.path.splitext(PRINT_SPOOL_PATH)
+    return startPrintQueue(
+        station_printer,
+        f"{root}-{name}{ext}",
+        connect=lambda: connectPrinter(target),
+        name=name
+    )
+
+if print_routes is None:
+    # One printer: every telegram takes the default route
+    print_queue = startPrintQueue(printer, PRINT_SPOOL_PATH, connect=None if PRINT_HANDOFF else connectPrinter)
+    print_router = PrintRouter([Route("default")]).start(lambda name, target: print_queue)
+else:
+    print_queue = None
+    print_router = PrintRouter(print_routes).start(startStation)
+    for route in print_routes:
+        logger.info(f"Print route {route.name}: {route.describe() or 'everything'} at station {route.station}")
+
+if print_ledger is not None:
+    # Telegrams that were queued or mid-print when the last run stopped
+    unfinished = print_ledger.unfinished()
+    for entry in unfinished:
+        print_router.by_name(entry["payload"].get("route")).queue.submit(
+            jobFromPayload(entry["payload"], entry["priority"], from_id=entry["from_node"])
+        )
+    if unfinished:
+        logger.info(f"Printing {len(unfinished)} telegram(s) left unfinished by the last run")
+
+# Keep recently seen packets in memory.
+seenPackets = RecentPackets(DEDUP_SIZE)
+
+traffic_archive = None
+if ARCHIVE_DIR:
+    traffic_archive = TrafficArchive(
+        ARCHIVE_DIR,
+        segment_seconds=ARCHIVE_SEGMENT_MINUTES * 60,
+        segment_bytes=int(ARCHIVE_SEGMENT_MB * 1024 * 1024),
+        retention_days=ARCHIVE_RETENTION_DAYS
+    ).start()
+
+ingest_meter = IngestMeter()
+
+def openSharedPrinter():
+    """Called when this instance wins the printer lease"""
+    print_queue.printer = connectPrinter()
+
+def closeSharedPrinter():
+    """Called when this instance loses the printer lease"""
+    shared, print_queue.printer = print_queue.printer, None
+    if shared is not None:
+        shared.close()
+
+def submitHandoffJob(job):
+    """Queue a telegram claimed from the shared print_jobs table"""
+    print_queue.submit(jobFromPayload(
+        job["payload"],
+        job["priority"],
+        from_id=job["from_node"],
+        on_printed=lambda printed: print_coordinator.printed_job(job["id"]),
+        on_failed=lambda failed, error: print_coordinator.failed_job(job["id"], error)
+    ))
+
+print_coordinator = None
+if PRINT_HANDOFF:
+    print_coordinator = PrintCoordinator(
+        PrintHandoffRepository(db_session_factory),
+        PRINTER_NAME,
+        MQTT_CLIENT_ID,
+        submitHandoffJob,
+        print_queue.depth,
+        on_acquire=openSharedPrinter,
+        on_release=closeSharedPrinter,
+        counters=lambda: (ingest_meter.received, ingest_meter.processed),
+        ttl=PRINT_LEASE_TTL
+    ).start()
+rate_limiter = PrintRateLimiter(node_repo, MESSAGE_RATE_LIMIT_SECONDS, max_nodes=NODE_CACHE_SIZE)
+rx_stats = RxStatsAggregator(
+    window=RX_STATS_WINDOW,
+    save_rows=RxStatRepository(db_session_factory).save_rows,
+    flush_interval=RX_STATS_FLUSH_INTERVAL
+).start()
+mqtt_state = {"connected": False, "since": time.time(), "disconnects": 0, "attempt": 0}
+
+node_snapshot = None
+if NODE_SNAPSHOT_PATH:
+    node_snapshot = NodeSnapshotter(NODE_SNAPSHOT_PATH, node_repo.node_names, interval=NODE_SNAPSHOT_INTERVAL).start()
+
+def loadNodeNames(node_id):
+    """Load a node's names for the node cache, from the snapshot or else the database"""
+    if node_snapshot is not None:
+        names = node_snapshot.get(node_id)
+        if names is not None:
+            return names
+    db_node = node_repo.get_node_by_id(node_id)
+    if db_node is None:
+        return None
+    return (db_node.short_name, db_node.long_name)
+
+node_cache = NodeCache(loadNodeNames, max_size=NODE_CACHE_SIZE)
 
 def lookupNode(id) -> object:
     """
@@ -121,16 +460,16 @@ def lookupNode(id) -> object:
         node.short_name = "ALL"
         node.long_name = "BROADCAST"
     else:    
-        # Try to get node info from database
+        # Try to get node info from the cache, falling back to the database
         try:
-            db_node = node_repo.get_node_by_id(id)
-            if db_node is not None:
-                # Check if short_name exists and is not None
-                if hasattr(db_node, 'short_name') and db_node.short_name is not None:
-                    node.short_name = db_node.short_name
-                # Check if long_name exists and is not None
-                if hasattr(db_node, 'long_name') and db_node.long_name is not None:
-                    node.long_name = db_node.long_name
+            with tracer.span("lookupNode"):
+                names = node_cache.get(id)
+            if names is not None:
+                short_name, long_name = names
+                if short_name is not None:
+                    node.short_name = short_name
+                if long_name is not None:
+                    node.long_name = long_name
         except Exception as e:
             logger.debug(f"Error looking up node in database: {e}")
     return node
@@ -161,10 +500,11 @@ else:
             except Exception:
                 continue
 
-def decode_nodeinfo_app(decoded_mp, pb):
+def decode_nodeinfo_app(packet):
     """Proccess NODEINFO_APP packets and update the database"""
     try:
-        node_id = getattr(decoded_mp, 'from')
+        node_id = packet.from_id
+        pb = packet.app
         short_name = pb.short_name
         long_name = pb.long_name
         hw_model_id = pb.hw_model
@@ -183,14 +523,19 @@ def decode_nodeinfo_app(decoded_mp, pb):
             hw_model_name=hw_model_name,
             hw_model_id=hw_model_id
         )
-        if not success:
+        if success:
+            node_cache.put(node_id, short_name, long_name)
+            if node_snapshot is not None:
+                node_snapshot.invalidate(node_id, (short_name, long_name))
+        else:
             logger.warning(f"Failed to save node {node_id} to database")
     except Exception as e:
-        logger.warning(f"Error processing NODEINFO_APP packet ({decoded_mp.id}): {e}")
+        logger.warning(f"Error processing NODEINFO_APP packet ({packet.id}): {e}")
     return True
 
-def decode_position_app(decoded_mp, pb):
+def decode_position_app(packet):
     try:
+        pb = packet.app
         latitude = pb.latitude_i / 1e7
         longitude = pb.longitude_i / 1e7
         altitude = pb.altitude
@@ -198,165 +543,506 @@ def decode_position_app(decoded_mp, pb):
         for k, v in pb.ListFields():
             logger.debug(f"** {k.name} = {v}")
     except Exception as e:
-        logger.warning(f"Error proccessing POSITION_APP packet ({decoded_mp.id}): {e}")
+        logger.warning(f"Error proccessing POSITION_APP packet ({packet.id}): {e}")
 
-def decode_telemetry_app(decoded_mp, pb):
+def decode_telemetry_app(packet):
     try:
         # Decode telemetry data
+        pb = packet.app
         logger.debug(f"Telemetry Data: {pb}")
         for k, v in pb.device_metrics.ListFields():
             logger.debug(f"** {k.name} = {v}")
     except Exception as e:
-        logger.warning(f"Error processing TELEMETRY_APP packet ({decoded_mp.id}): {e}")
+        logger.warning(f"Error processing TELEMETRY_APP packet ({packet.id}): {e}")
 
-def decode_message_app(decoded_mp, pb, to, frm):
+def decode_message_app(packet, to, frm):
     try:
-        payload = decoded_mp.decoded.payload.decode("utf-8")
+        payload = packet.payload.decode("utf-8")
         logger.debug(f"Text Message: {payload}")
         
         # Get the sender node ID for rate limiting
-        sender_node_id = getattr(decoded_mp, 'from')
+        sender_node_id = packet.from_id
+
+        route = print_router.route(packet.channel_id, packet.to, sender_node_id, packet.gateway_id)
+        if route is None:
+            logger.debug(f"No print route for packet {packet.id} on channel {packet.channel_id}, skipping")
+            return
+
+        # A duplicate or broker replay of a telegram queued before a restart
+        if print_ledger is not None and print_ledger.state(sender_node_id, packet.id) is not None:
+            logger.debug(f"Packet {packet.id} from node {sender_node_id} is already in the print ledger, skipping")
+            return
         
-        # Check if this node can print a message (rate limiting)
-        if node_repo.can_print_message(sender_node_id, MESSAGE_RATE_LIMIT_SECONDS):
-            # Update the last print timestamp in database
-            if node_repo.update_last_print(sender_node_id):
-                logger.info(f"Printing message from node {sender_node_id} ({frm.short_name}): {payload}")
-                printThis(to, frm, payload, printer)
+        # Check if this node can print a message (rate limiting) and record the print.
+        # With the ledger, the cooldown is stored only once the ledger entry is, so
+        # a crash in between leaves the broker's redelivery free to print it
+        if rate_limiter.allow(sender_node_id, save=print_ledger is None):
+            logger.info(f"Printing message from node {sender_node_id} ({frm.short_name}): {payload}")
+            if sender_node_id in ADMIN_IDS:
+                priority = "admin"
+            elif packet.to != BROADCAST_ID:
+                priority = "dm"
             else:
-                logger.warning(f"Failed to update last_print for node {sender_node_id}, skipping print")
+                priority = "channel"
+            job = PrintJob(frm, payload, to=to, packet_id=packet.id, priority=priority, from_id=sender_node_id)
+            if print_coordinator is not None:
+                if not print_coordinator.handoff(sender_node_id, packet.id, priority, jobPayload(job)):
+                    logger.debug(f"Packet {packet.id} from node {sender_node_id} already handed off")
+                return
+            if print_ledger is not None:
+                print_ledger.add(sender_node_id, packet.id, priority, jobPayload(job, route.name if print_routes else None))
+                print_ledger.when_durable(lambda: rate_limiter.save(sender_node_id))
+            if not route.queue.submit(job):
+                logger.warning(f"Print backlog full at {route.station}, dropped {priority} message from node {sender_node_id} ({frm.short_name})")
         else:
-            logger.info(f"Rate limiting: Skipping message from node {sender_node_id} ({frm.short_name}) - {MESSAGE_RATE_LIMIT_SECONDS}s cooldown active")
+            logger.info(f"Rate limiting: Skipping message from node {sender_node_id} ({frm.short_name}) - {rate_limiter.rate_limit_seconds}s cooldown active")
             
     except Exception as e:
-        logger.warning(f"Error processing MESSAGE_APP packet ({decoded_mp.id}): {e}")
+        logger.warning(f"Error processing MESSAGE_APP packet ({packet.id}): {e}")
 
-def proccessPacket(decoded_mp, handler, decrypted, portNumInt):
-    packetID = decoded_mp.id
-    if packetID in seenPackets:
+def proccessPacket(packet):
+    packetID = packet.id
+    if not seenPackets.add(packetID):
         logger.debug("Duplicate packet, skipping...")
+        ingest_meter.record_duplicate()
         return
     else:
-        seenPackets.append(packetID)
+        ingest_meter.record_processed()
+        # Duplicates stop above, so only the first copy of a packet is decrypted
+        if packet.encrypted:
+            with tracer.span("decrypt_packet"):
+                packet.data
+            if not packet.decrypted:
+                logger.debug("Decryption failed; retaining original encrypted payload")
+                ingest_meter.record_decrypt_failure()
+        portNumInt = packet.portnum
         try:
             logger.debug(f"Port Int: {portnumLookup[portNumInt] if portNumInt in portnumLookup else 'Unknown'} ({portNumInt})")
-            frm = lookupNode(getattr(decoded_mp, 'from')) #This is why you don't use "from" as a variable name
-            to = lookupNode(decoded_mp.to)
+            frm = lookupNode(packet.from_id)
+            to = lookupNode(packet.to)
             logger.debug(f"From: {frm.short_name} ({frm.long_name})")
             logger.debug(f"To: {to.short_name} ({to.long_name})")
-            logger.debug(f"Channel: {decoded_mp.channel}")
-            logger.debug(f"ID: {decoded_mp.id}")
-            logger.debug(f"RX Time: {decoded_mp.rx_time}")
-            logger.debug(f"RX SNR: {decoded_mp.rx_snr}")
-            logger.debug(f"RX RSSI: {decoded_mp.rx_rssi}")
-            logger.debug(f"Hop Limit: {decoded_mp.hop_limit}")
-
-            pb = None
-            if handler is not None and handler.protobufFactory is not None:
-                pb = handler.protobufFactory()
-                pb.ParseFromString(decoded_mp.decoded.payload)
-            else:
+            logger.debug(f"Channel: {packet.packet.channel}")
+            logger.debug(f"ID: {packet.id}")
+            logger.debug(f"RX Time: {packet.packet.rx_time}")
+            logger.debug(f"RX SNR: {packet.packet.rx_snr}")
+            logger.debug(f"RX RSSI: {packet.packet.rx_rssi}")
+            logger.debug(f"Hop Limit: {packet.packet.hop_limit}")
+
+            # The app payload is parsed by whichever handler first reads packet.app
+            handler = packet.handler
+            if handler is None or handler.protobufFactory is None:
                 logger.debug("No handler found for this port number")
 
-            if decoded_mp.decoded.portnum == 1:
-                # TEXT_MESSAGE_APP
-                decode_message_app(decoded_mp, pb, to, frm)
-            elif decoded_mp.decoded.portnum == 3:
-                # POSITION_APP
-                decode_position_app(decoded_mp, pb)
-            elif decoded_mp.decoded.portnum == 4:
-                # NODEINFO_APP
-                decode_nodeinfo_app(decoded_mp, pb)
-            elif decoded_mp.decoded.portnum == 67:
-                # TELEMETRY_APP
-                decode_telemetry_app(decoded_mp, pb)
-            elif decrypted == False:
-                logger.debug("Encrypted Payload")
-            else:
-                # Other applications
-                try:
-                    logger.debug("Other App - Generic Payload Decode")
-                    for k, v in pb.ListFields():
-                        logger.debug(f"** {k.name} = {v}")
-                except Exception as e:
-                    logger.warning(f"Error decoding other app packet ({decoded_mp.id}): {e}")
+            with tracer.span(portnumLookup.get(portNumInt, "UNKNOWN_APP")):
+                if portNumInt == 1:
+                    # TEXT_MESSAGE_APP
+                    decode_message_app(packet, to, frm)
+                elif portNumInt == 3:
+                    # POSITION_APP
+                    decode_position_app(packet)
+                elif portNumInt == 4:
+                    # NODEINFO_APP
+                    decode_nodeinfo_app(packet)
+                elif portNumInt == 67:
+                    # TELEMETRY_APP
+                    decode_telemetry_app(packet)
+                elif not packet.decrypted:
+                    logger.debug("Encrypted Payload")
+                else:
+                    # Other applications
+                    try:
+                        logger.debug("Other App - Generic Payload Decode")
+                        for k, v in packet.app.ListFields():
+                            logger.debug(f"** {k.name} = {v}")
+                    except Exception as e:
+                        logger.warning(f"Error decoding other app packet ({packet.id}): {e}")
             logger.debug("--------\n")
         except Exception as e:
             logger.debug(f"Error processing packet: {e}", exc_info=True)
             
             tb = traceback.extract_tb(e.__traceback__)[-1]
             logger.error(f"Error in {tb.filename} at line {tb.lineno}: {e}")
-        
+        if traffic_archive is not None:
+            traffic_archive.add(packet)
+
+def parseTopics(value):
+    """Turn a comma-separated MQTT_TOPICS value into the list of wildcard topics to subscribe to"""
+    topics = []
+    for topic in (value or "").split(","):
+        if len(topic)>1:
+            if not topic.endswith("/#"):
+                topic += "/#"
+            if topic not in topics:
+                topics.append(topic)
+        else:
+            logger.debug(f"Invalid topic length: |{topic}|")
+    return topics
+
+def buildKeyTable(value):
+    """
+    Decode CHANNEL_KEY into AES keys by channel name.
+
+    CHANNEL_KEY is either one base64 key used for every channel, or a
+    comma-separated list of channel:key pairs, where "*" is the default.
+    """
+    table = {}
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        channel, _, key = item.rpartition(":")
+        table[channel or "*"] = algorithms.AES(base64.b64decode(key.encode('ascii'), validate=True))
+    return table
+
+# Live settings that can change on reload
+mqtt_topics = parseTopics(MQTT_TOPICS)
+pending_unsubscribe = set()
+try:
+    channel_keys = buildKeyTable(CHANNEL_KEY)
+except ValueError as e:
+    logger.error(f"Invalid CHANNEL_KEY: {e}")
+    sys.exit(1)
+
+def subscription(topic):
+    """The topic filter to subscribe with; a shared subscription when MQTT_SHARE_GROUP is set"""
+    return f"$share/{MQTT_SHARE_GROUP}/{topic}" if MQTT_SHARE_GROUP else topic
 
 # Callback when the client connects to the broker
-def on_connect(client, userdata, flags, rc):
+def on_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
-        logger.debug("Connected to MQTT broker!")
-        for topic in MQTT_TOPICS.split(","):
-            if len(topic)>1:
-                if not topic.endswith("/#"):
-                    topic += "/#"
-                client.subscribe(topic)
-                logger.debug(f"Subscribed to topic: {topic}")
-            else:
-                logger.debug(f"Invalid topic length: |{topic}|")
+        logger.info(f"Connected to MQTT broker as {MQTT_CLIENT_ID} (session present: {bool(flags.get('session present'))})")
+        mqtt_state.update(connected=True, since=time.time(), attempt=0)
+        if pending_unsubscribe:
+            # Topics dropped by a reload while we were offline are still in the persistent session
+            client.unsubscribe([subscription(topic) for topic in pending_unsubscribe])
+            pending_unsubscribe.clear()
+        for topic in mqtt_topics:
+            client.subscribe(subscription(topic), qos=MQTT_QOS)
+            logger.debug(f"Subscribed to topic: {subscription(topic)}")
     else:
+        # The network loop sees the connection close and retries with backoff
         logger.error(f"MQTT Failed to connect, return code: {rc}")
-        sys.exit(1)
+
+def on_disconnect(client, userdata, rc, properties=None):
+    logger.warning(f"Disconnected from MQTT broker, return code: {rc}")
+    mqtt_state.update(connected=False, since=time.time())
+    mqtt_state["disconnects"] += 1
 
 # Callback when a message is received
 def on_message(client, userdata, msg):
-    se = mqtt_pb2.ServiceEnvelope()
-    se.ParseFromString(msg.payload)
-    decoded_mp = se.packet
-
-    decrypted = False
-    # Try to decrypt the payload if it is encrypted
-    if decoded_mp.HasField("encrypted") and not decoded_mp.HasField("decoded"):
-        decoded_data = decrypt_packet(decoded_mp, CHANNEL_KEY)
-        if decoded_data is None:
-            logger.debug("Decryption failed; retaining original encrypted payload")
-            pass
-        else:
-            decoded_mp.decoded.CopyFrom(decoded_data)
-            decrypted = True
+    if inbox is None:
+        with ingest_lock:
+            handleMessage(msg.payload)
+    else:
+        # Blocks the network thread when full; un-acked QoS 1 messages then wait at the broker
+        inbox.put(msg)
+        mqtt_state["inbox_high_water"] = max(mqtt_state.get("inbox_high_water", 0), inbox.qsize())
 
-    # Attempt to process the decrypted or encrypted payload
-    portNumInt = decoded_mp.decoded.portnum if decoded_mp.HasField("decoded") else None
-    handler = protocols.get(portNumInt) if portNumInt else None
+def drainInbox():
+    """Handle queued messages and acknowledge them once they have been processed"""
+    while True:
+        msg = inbox.get()
+        if isinstance(msg, RadioMessage):
+            try:
+                handleMessage(msg.payload, msg.transport)
+            except Exception as e:
+                logger.error(f"Error handling packet from {msg.transport}: {e}")
+            continue
+        try:
+            handleMessage(msg.payload)
+        except Exception as e:
+            logger.error(f"Error handling MQTT message: {e}")
+        finally:
+            if msg.qos > 0 and print_ledger is not None:
+                # Acknowledge once the ledger entries this message created are on disk,
+                # so a crash before then gets the message redelivered
+                print_ledger.when_durable(lambda mid=msg.mid, qos=msg.qos: client.ack(mid, qos))
+            elif msg.qos > 0:
+                client.ack(msg.mid, msg.qos)
 
-    proccessPacket(decoded_mp, handler, decrypted, portNumInt)
+def handleMessage(payload, transport="mqtt"):
+    """Handle one ServiceEnvelope, from the broker or wrapped by a radio transport"""
+    started = time.perf_counter_ns()
+    # Look up the key table once; a reload swaps in a new dict rather than editing this one
+    packet = PacketView(payload, channel_keys)
+    tracer.record("parse_envelope", started, time.perf_counter_ns(), packet.id)
+    transport_meter.record(transport, packet.from_id, packet.id, packet.packet.rx_time)
+    rx_stats.record(
+        packet.gateway_id, packet.channel_id, packet.from_id, packet.id,
+        packet.packet.rx_snr, packet.packet.rx_rssi, packet.packet.hop_limit, packet.packet.hop_start
+    )
 
+    with tracer.span("on_message", packet.id):
+        with tracer.span("proccessPacket"):
+            proccessPacket(packet)
+    ingest_meter.record_received(rx_time=packet.packet.rx_time, handle_time=(time.perf_counter_ns() - started) / 1e9)
 
-def decrypt_packet(mp, key):
-    try:
-        key_bytes = base64.b64decode(key.encode('ascii'))
+def radioPacket(payload, transport):
+    """Pass a packet from a radio transport to the thread handling MQTT messages"""
+    if inbox is None:
+        with ingest_lock:
+            handleMessage(payload, transport)
+    else:
+        inbox.put(RadioMessage(payload, transport))
+
+def parseTransports(value):
+    """Split TRANSPORTS into whether to use MQTT and the radio transports, raising ValueError if invalid"""
+    use_mqtt = False
+    radios = []
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        if item.lower() == "mqtt":
+            use_mqtt = True
+        else:
+            radios.append(RadioTransport.parse(item))
+    if not use_mqtt and not radios:
+        raise ValueError("No transports given")
+    return use_mqtt, radios
 
-        # Build the nonce from message ID and sender
-        nonce_packet_id = getattr(mp, "id").to_bytes(8, "little")
-        nonce_from_node = getattr(mp, "from").to_bytes(8, "little")
-        nonce = nonce_packet_id + nonce_from_node
+try:
+    use_mqtt, radio_transports = parseTransports(TRANSPORTS)
+except ValueError as e:
+    logger.error(f"Invalid TRANSPORTS: {e}")
+    sys.exit(1)
+transport_meter = TransportMeter()
+# Without an inbox, messages are handled on each transport's own thread
+ingest_lock = threading.Lock()
 
-        # Decrypt the encrypted payload
-        cipher = Cipher(algorithms.AES(key_bytes), modes.CTR(nonce), backend=default_backend())
-        decryptor = cipher.decryptor()
-        decrypted_bytes = decryptor.update(getattr(mp, "encrypted")) + decryptor.finalize()
+def publish_stats(client):
+    """Periodically publish ingest stats so load tests can tell when we fall behind"""
+    while True:
+        time.sleep(MQTT_STATS_INTERVAL)
+        stats = ingest_meter.snapshot()
+        stats["print_queue"] = print_router.depth()
+        logger.debug(f"Ingest stats: {stats}")
+        client.publish(MQTT_STATS_TOPIC, json.dumps(stats))
 
-        # Parse the decrypted bytes into a Data object
-        data = mesh_pb2.Data()
-        data.ParseFromString(decrypted_bytes)
-        return data
+inbox = queue.Queue(maxsize=MQTT_INBOX_SIZE) if MQTT_INBOX_SIZE else None
 
-    except Exception as e:
-        return None
+if MQTT_PROTOCOL not in ("3.1.1", "5"):
+    logger.error(f"Invalid MQTT_PROTOCOL: {MQTT_PROTOCOL}. Must be '3.1.1' or '5'")
+    sys.exit(1)
 
-client = mqtt.Client()
+# MQTT 5 sets the session behaviour when connecting rather than on the client
+client = mqtt.Client(
+    mqtt.CallbackAPIVersion.VERSION1,
+    client_id=MQTT_CLIENT_ID,
+    protocol=mqtt.MQTTv5 if MQTT_PROTOCOL == "5" else mqtt.MQTTv311,
+    clean_session=None if MQTT_PROTOCOL == "5" else MQTT_CLEAN_SESSION,
+    # With an inbox, QoS 1 messages are acknowledged only after they are handled
+    manual_ack=inbox is not None
+)
 client.on_connect = on_connect
 client.on_message = on_message
+client.on_disconnect = on_disconnect
 client.username_pw_set(MQTT_USER, MQTT_PASS)
+
+def mqttStatus():
+    stats = ingest_meter.snapshot(reset=False)
+    return {
+        "connected": mqtt_state["connected"],
+        "state_age": round(time.time() - mqtt_state["since"], 1),
+        "disconnects": mqtt_state["disconnects"],
+        "last_message_age": stats["last_message_age"],
+        "received": stats["received"],
+        "processed": stats["processed"],
+        "duplicates": stats["duplicates"],
+        "decrypt_failures": stats["decrypt_failures"],
+        "client_id": MQTT_CLIENT_ID,
+        "reconnect_attempt": mqtt_state["attempt"],
+        "inbox": inbox.qsize() if inbox is not None else None,
+        "inbox_high_water": mqtt_state.get("inbox_high_water"),
+    }
+
+def transportStatus():
+    """Arrivals and latency per transport, with each radio transport's connection"""
+    stats = transport_meter.snapshot()
+    if use_mqtt:
+        stats.setdefault("mqtt", {})["connected"] = mqtt_state["connected"]
+    for transport in radio_transports:
+        stats.setdefault(transport.name, {}).update(transport.stats())
+    return stats
+
+def nodeStats():
+    stats = node_cache.stats()
+    stats["snapshot"] = node_snapshot.stats() if node_snapshot is not None else None
+    return stats
+
+def mqttHealthy():
+    """Live while connected, or while a disconnect is recent enough to be a blip"""
+    return mqtt_state["connected"] or time.time() - mqtt_state["since"] < STATUS_MAX_DISCONNECTED_SECONDS
+
+def applyConfig(changes):
+    """Apply reloaded settings in place, without reconnecting or losing state"""
+    global mqtt_topics, channel_keys, ADMIN_IDS
+    # Parse everything first so a bad value leaves all settings untouched
+    topics = parseTopics(changes["MQTT_TOPICS"][1]) if "MQTT_TOPICS" in changes else mqtt_topics
+    keys = buildKeyTable(changes["CHANNEL_KEY"][1]) if "CHANNEL_KEY" in changes else channel_keys
+    rate_limit = int(changes["MESSAGE_RATE_LIMIT_SECONDS"][1] or 60) if "MESSAGE_RATE_LIMIT_SECONDS" in changes else None
+    admin_ids = parse_node_ids(changes["ADMIN_IDS"][1]) if "ADMIN_IDS" in changes else ADMIN_IDS
+
+    if topics != mqtt_topics:
+        removed = [topic for topic in mqtt_topics if topic not in topics]
+        added = [topic for topic in topics if topic not in mqtt_topics]
+        mqtt_topics = topics
+        # While disconnected, on_connect subscribes to the new list
+        if mqtt_state["connected"]:
+            if removed:
+                client.unsubscribe([subscription(topic) for topic in removed])
+            for topic in added:
+                client.subscribe(subscription(topic), qos=MQTT_QOS)
+        else:
+            pending_unsubscribe.update(removed)
+        logger.info(f"MQTT topics: subscribed {added or 'none'}, unsubscribed {removed or 'none'}")
+    channel_keys = keys
+    if rate_limit is not None:
+        rate_limiter.rate_limit_seconds = rate_limit
+    ADMIN_IDS = admin_ids
+
+config_reloader = ConfigReloader(
+    CONFIG_FILE,
+    ["MQTT_TOPICS", "CHANNEL_KEY", "MESSAGE_RATE_LIMIT_SECONDS", "ADMIN_IDS"],
+    applyConfig,
+    poll_interval=CONFIG_WATCH_INTERVAL
+).start()
+if hasattr(signal, "SIGHUP"):
+    signal.signal(signal.SIGHUP, lambda signum, frame: config_reloader.trigger())
+
+def soakGauges():
+    """Levels sampled in soak mode; any that keeps rising over a long run is a leak or a backlog"""
+    gauges = {
+        "dedup": lambda: len(seenPackets),
+        "print_queue": print_router.depth,
+        "oldest_job_age": lambda: max((queue.oldest_age() or 0 for queue in print_router.queues()), default=0),
+        "node_cache": lambda: node_cache.stats()["size"],
+        "ratelimit_nodes": lambda: rate_limiter.snapshot(limit=0)["tracked_nodes"],
+        "threads": threading.active_count,
+        "gc_objects": lambda: len(gc.get_objects()),
+    }
+    if inbox is not None:
+        gauges["inbox"] = inbox.qsize
+    if print_ledger is not None:
+        gauges["ledger_entries"] = lambda: print_ledger.stats()["entries"]
+        gauges["ledger_pending"] = lambda: print_ledger.stats()["pending_writes"]
+    if print_history is not None:
+        gauges["history_pending"] = lambda: print_history.stats()["pending_writes"]
+    if receipt_store is not None:
+        gauges["receipts_pending"] = lambda: receipt_store.stats()["pending_writes"]
+    if traffic_archive is not None:
+        gauges["archive_queued"] = lambda: traffic_archive.stats()["queued"]
+    return gauges
+
+soak_monitor = None
+if SOAK_INTERVAL:
+    soak_monitor = SoakMonitor(
+        os.path.join(TRACE_DIR, f"soak-{time.strftime('%Y%m%d-%H%M%S')}.ndjson"),
+        soakGauges(),
+        tracer=tracer,
+        interval=SOAK_INTERVAL,
+        top_sites=SOAK_TOP_SITES
+    ).start()
+    logger.info(f"Soak mode: sampling every {SOAK_INTERVAL}s to {soak_monitor.path}")
+
+if STATUS_PORT:
+    status_server = StatusServer(STATUS_HOST, STATUS_PORT)
+    if use_mqtt:
+        status_server.add("mqtt", mqttStatus)
+    status_server.add("transports", transportStatus)
+    if print_queue is not None:
+        status_server.add("print", print_queue.stats)
+    else:
+        status_server.add("routes", print_router.stats)
+    status_server.add("dedup", seenPackets.stats)
+    status_server.add("nodes", nodeStats)
+    status_server.add("ratelimit", rate_limiter.snapshot)
+    status_server.add("maintenance", db_maintenance.stats)
+    status_server.add("schema", schema_stats)
+    status_server.add("reception", rx_stats.snapshot)
+    status_server.add("config", config_reloader.stats)
+    if print_coordinator is not None:
+        status_server.add("cluster", print_coordinator.stats)
+    if print_ledger is not None:
+        status_server.add("ledger", print_ledger.stats)
+    if traffic_archive is not None:
+        status_server.add("archive", traffic_archive.stats)
+    if print_history is not None:
+        status_server.add("history", print_history.stats)
+    if receipt_store is not None:
+        status_server.add("receipts", receipt_store.stats)
+    if soak_monitor is not None:
+        status_server.add("soak", soak_monitor.stats)
+    status_server.add_check("healthz", "print_worker", print_router.alive)
+    status_server.add_check("readyz", "print_worker", print_router.alive)
+    if use_mqtt:
+        status_server.add_check("healthz", "mqtt", mqttHealthy)
+        status_server.add_check("readyz", "mqtt", lambda: mqtt_state["connected"])
+    for transport in radio_transports:
+        status_server.add_check("healthz", transport.name,
+                                lambda transport=transport: transport.healthy(STATUS_MAX_DISCONNECTED_SECONDS))
+        status_server.add_check("readyz", transport.name, lambda transport=transport: transport.connected)
+    status_server.start()
+if MQTT_STATS_TOPIC and use_mqtt:
+    threading.Thread(target=publish_stats, args=(client,), name="stats-publisher", daemon=True).start()
+
+def reconnectDelay(attempt):
+    """Exponential backoff with jitter, so many clients don't reconnect in lockstep"""
+    ceiling = min(MQTT_RECONNECT_MAX, MQTT_RECONNECT_MIN * 2 ** min(attempt, 20))
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+def connectProperties():
+    """MQTT 5 CONNECT properties: ask the broker to keep our session while we are away"""
+    properties = Properties(PacketTypes.CONNECT)
+    if not MQTT_CLEAN_SESSION:
+        properties.SessionExpiryInterval = MQTT_SESSION_EXPIRY
+    return properties
+
+def runMqtt():
+    """Run the MQTT network loop forever, reconnecting with backoff whenever the connection drops"""
+    while True:
+        try:
+            if MQTT_PROTOCOL == "5":
+                client.connect(MQTT_SRV, MQTT_PORT, keepalive=60, clean_start=MQTT_CLEAN_SESSION,
+                               properties=connectProperties())
+            else:
+                client.connect(MQTT_SRV, MQTT_PORT, keepalive=60)
+            while client.loop(timeout=1.0) == mqtt.MQTT_ERR_SUCCESS:
+                pass
+        except (OSError, ValueError) as e:
+            logger.error(f"MQTT Connection Error: {e}")
+        if mqtt_state["connected"]:
+            # loop() noticed the drop before on_disconnect ran
+            on_disconnect(client, None, mqtt.MQTT_ERR_CONN_LOST)
+        delay = reconnectDelay(mqtt_state["attempt"])
+        mqtt_state["attempt"] += 1
+        logger.info(f"Reconnecting to MQTT broker in {delay:.1f}s (attempt {mqtt_state['attempt']})")
+        time.sleep(delay)
+
+if inbox is not None:
+    threading.Thread(target=drainInbox, name="mqtt-inbox", daemon=True).start()
+for transport in radio_transports:
+    transport.start(radioPacket)
+# Exit through SystemExit on SIGTERM so the printer lease is handed over straight away
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 try:
-    client.connect(MQTT_SRV, MQTT_PORT, keepalive=60)
-    client.loop_forever()
-except Exception as e:
-    logger.error(f"MQTT Connection Error: {e}")
-    sys.exit(1)
+    if use_mqtt:
+        runMqtt()
+    else:
+        # The radio transports run on their own threads
+        threading.Event().wait()
+finally:
+    if print_coordinator is not None:
+        print_coordinator.stop()
+    if print_ledger is not None:
+        # Otherwise telegrams printed since the last commit are printed again at the next start
+        print_ledger.flush()
+    if traffic_archive is not None:
+        traffic_archive.close()
+    if print_history is not None:
+        print_history.flush()
+    if receipt_store is not None:
+        receipt_store.flush()
+    if node_snapshot is not None:
+        try:
+            node_snapshot.write()
+        except Exception as e:
+            logger.error(f"Error writing node snapshot: {e}")
+    if soak_monitor is not None:
+        soak_monitor.sample()
+        logger.info(f"Soak drift report for {soak_monitor.path}:\n{format_report(soak_monitor.report())}")
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+Benchmark per-packet decoding in app.py.
+
+Builds a synthetic feed of encrypted ServiceEnvelopes (text, nodeinfo,
+position and telemetry, with a share re-published by other gateways like
+real duplicate uplinks) and runs it through two pipelines that do what
+app.py's packet handling does, without the database or printer:
+
+  copy  the earlier path: parse the envelope, decrypt into a new Data,
+        CopyFrom it into the packet and parse the app payload, for every
+        copy, before dropping duplicates
+  view  the PacketView path: parse the envelope, drop duplicates, then
+        decrypt and parse the app payload on first access
+
+For each it reports time per packet and the memory allocated while
+handling a packet, measured with tracemalloc. Examples:
+
+    python bench-packets.py
+    python bench-packets.py --packets 50000 --copies 3 --json
+"""
+import argparse
+import base64
+import json
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.backends import default_backend
+from meshtastic import mqtt_pb2, mesh_pb2, protocols
+from meshtastic.protobuf import portnums_pb2, telemetry_pb2
+
+from common.packet import PacketView
+
+DEFAULT_KEY = "1PG7OiApB1nwvP+rz05pAQ=="
+CHANNEL = "LongFast"
+
+def build_feed(key, packets, copies, seed):
+    """Return a list of serialized envelopes, each packet heard by 1 to `copies` gateways"""
+    rng = random.Random(seed)
+    aes = algorithms.AES(key)
+    feed = []
+    for _ in range(packets):
+        sender = rng.randrange(0x10000000, 0xFFFFFFF0)
+        data = mesh_pb2.Data()
+        kind = rng.choice(("text", "nodeinfo", "position", "telemetry"))
+        if kind == "text":
+            data.portnum = portnums_pb2.TEXT_MESSAGE_APP
+            data.payload = b"hello mesh anyone copy test from the booth"
+        elif kind == "nodeinfo":
+            user = mesh_pb2.User(id=f"!{sender:08x}", short_name=f"{sender & 0xFFFF:04x}",
+                                 long_name=f"Bench {sender:08x}", hw_model=9)
+            data.portnum = portnums_pb2.NODEINFO_APP
+            data.payload = user.SerializeToString()
+        elif kind == "position":
+            position = mesh_pb2.Position(latitude_i=375000000, longitude_i=-1220000000, altitude=30)
+            data.portnum = portnums_pb2.POSITION_APP
+            data.payload = position.SerializeToString()
+        else:
+            telemetry = telemetry_pb2.Telemetry(time=int(time.time()))
+            telemetry.device_metrics.battery_level = 80
+            telemetry.device_metrics.voltage = 3.9
+            data.portnum = portnums_pb2.TELEMETRY_APP
+            data.payload = telemetry.SerializeToString()
+
+        mp = mesh_pb2.MeshPacket()
+        setattr(mp, "from", sender)
+        mp.to = 4294967295
+        mp.id = rng.getrandbits(32)
+        mp.hop_start = 3
+        nonce = mp.id.to_bytes(8, "little") + sender.to_bytes(8, "little")
+        encryptor = Cipher(aes, modes.CTR(nonce), backend=default_backend()).encryptor()
+        mp.encrypted = encryptor.update(data.SerializeToString()) + encryptor.finalize()
+        for gateway in range(rng.randint(1, copies)):
+            mp.rx_time = int(time.time())
+            mp.rx_snr = rng.uniform(-15, 10)
+            mp.rx_rssi = rng.randint(-125, -60)
+            mp.hop_limit = rng.randint(0, 3)
+            se = mqtt_pb2.ServiceEnvelope(channel_id=CHANNEL, gateway_id=f"!{gateway:08x}")
+            se.packet.CopyFrom(mp)
+            feed.append(se.SerializeToString())
+    return feed
+
+def copy_pipeline(keys):
+    """The per-packet work app.py did before PacketView"""
+    seen = set()
+
+    def handle(raw):
+        se = mqtt_pb2.ServiceEnvelope()
+        se.ParseFromString(raw)
+        mp = se.packet
+        # rx_stats and the tracer read the header fields
+        stats = (se.gateway_id, se.channel_id, getattr(mp, "from"), mp.id, mp.rx_snr, mp.rx_rssi,
+                 mp.hop_limit, mp.hop_start)
+        if mp.HasField("encrypted") and not mp.HasField("decoded"):
+            key = keys.get(se.channel_id) or keys.get("*")
+            nonce = getattr(mp, "id").to_bytes(8, "little") + getattr(mp, "from").to_bytes(8, "little")
+            decryptor = Cipher(key, modes.CTR(nonce), backend=default_backend()).decryptor()
+            data = mesh_pb2.Data()
+            data.ParseFromString(decryptor.update(getattr(mp, "encrypted")) + decryptor.finalize())
+            mp.decoded.CopyFrom(data)
+        portnum = mp.decoded.portnum if mp.HasField("decoded") else None
+        handler = protocols.get(portnum) if portnum else None
+        if mp.id in seen:
+            return stats
+        seen.add(mp.id)
+        if handler is not None and handler.protobufFactory is not None:
+            pb = handler.protobufFactory()
+            pb.ParseFromString(mp.decoded.payload)
+        if mp.decoded.portnum == 1:
+            mp.decoded.payload.decode("utf-8")
+        return getattr(mp, "from"), mp.to, mp.id
+
+    return handle
+
+def view_pipeline(keys):
+    """The per-packet work app.py does with PacketView"""
+    seen = set()
+
+    def handle(raw):
+        packet = PacketView(raw, keys)
+        stats = (packet.gateway_id, packet.channel_id, packet.from_id, packet.id, packet.packet.rx_snr,
+                 packet.packet.rx_rssi, packet.packet.hop_limit, packet.packet.hop_start)
+        if packet.id in seen:
+            return stats
+        seen.add(packet.id)
+        portnum = packet.portnum
+        packet.app
+        if portnum == 1:
+            packet.payload.decode("utf-8")
+        return packet.from_id, packet.to, packet.id
+
+    return handle
+
+def measure(name, make, feed, keys, rounds):
+    times = []
+    for _ in range(rounds):
+        handle = make(keys)
+        started = time.perf_counter_ns()
+        for raw in feed:
+            handle(raw)
+        times.append((time.perf_counter_ns() - started) / len(feed))
+
+    # Memory is measured on a separate pass, since tracing slows everything down
+    handle = make(keys)
+    allocated = []
+    tracemalloc.start()
+    for raw in feed:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        handle(raw)
+        allocated.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    return {
+        "pipeline": name,
+        "ns_per_packet": round(statistics.median(times)),
+        "ns_per_packet_best": round(min(times)),
+        "alloc_bytes_per_packet": round(statistics.mean(allocated), 1),
+        "alloc_bytes_p99": sorted(allocated)[int(len(allocated) * 0.99)],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-packet decoding in app.py")
+    parser.add_argument("--packets", type=int, default=20000, help="Unique packets in the feed")
+    parser.add_argument("--copies", type=int, default=3, help="Most gateways that hear one packet")
+    parser.add_argument("--rounds", type=int, default=5, help="Timed passes over the feed per pipeline")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--key", default=DEFAULT_KEY, help="Base64 channel key")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    key = base64.b64decode(args.key.encode("ascii"))
+    keys = {"*": algorithms.AES(key)}
+    feed = build_feed(key, args.packets, args.copies, args.seed)
+
+    results = [measure(name, make, feed, keys, args.rounds)
+               for name, make in (("copy", copy_pipeline), ("view", view_pipeline))]
+    report = {
+        "python": sys.version.split()[0],
+        "envelopes": len(feed),
+        "unique_packets": args.packets,
+        "results": results,
+        "speedup": round(results[0]["ns_per_packet"] / results[1]["ns_per_packet"], 2),
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{len(feed)} envelopes, {args.packets} unique packets, Python {report['python']}")
+    print(f"{'pipeline':<10} {'ns/packet':>10} {'best':>10} {'alloc B/packet':>15} {'alloc B p99':>12}")
+    for result in results:
+        print(f"{result['pipeline']:<10} {result['ns_per_packet']:>10} {result['ns_per_packet_best']:>10} "
+              f"{result['alloc_bytes_per_packet']:>15} {result['alloc_bytes_p99']:>12}")
+    print(f"view is {report['speedup']}x the speed of copy")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+"""
+Benchmark the node repository and the database connection layer.
+
+Seeds a temporary SQLite database per size with the schema, engine and
+pragmas app.py uses, then measures the four calls on the packet path:
+get_node_by_id, save_or_update_node, can_print_message and
+update_last_print. Each runs single-threaded and from several threads at
+once, and in three variants with the same behaviour:
+
+  orm   NodeRepository as it is: a session per call and ORM objects
+  core  SQLAlchemy Core statements on a pooled connection
+  raw   hand-written SQL on a pooled DB-API connection
+
+For each case it reports throughput and per-call latency percentiles.
+Save the --json output and pass it back with --baseline to fail (exit 1)
+when a later run is slower beyond --tolerance. Examples:
+
+    python bench-repository.py --sizes 1000,100000
+    python bench-repository.py --json > bench.json
+    python bench-repository.py --baseline bench.json --tolerance 0.25
+    python bench-repository.py --sizes 1000000 --dir /tmp/bench --threads 1,4,16
+
+With --dir, seeded databases are kept there and reused by later runs.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import select, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database.connection import setup_database
+from database.models import NodeInfo
+from database.repository import NodeRepository
+
+METHODS = ("get_node_by_id", "save_or_update_node", "can_print_message", "update_last_print")
+HW_MODELS = [("TBEAM", 4), ("HELTEC_V3", 43), ("T_ECHO", 7), ("RAK4631", 9), ("TLORA_V2_1_1P6", 3)]
+RATE_LIMIT_SECONDS = 60
+
+def _now():
+    return datetime.now(timezone.utc)
+
+class CoreNodeRepository:
+    """NodeRepository's packet-path calls as single Core statements"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.table = NodeInfo.__table__
+
+    def get_node_by_id(self, node_id):
+        with self.engine.connect() as conn:
+            return conn.execute(select(self.table).where(self.table.c.node_id == node_id)).first()
+
+    def save_or_update_node(self, node_id, short_name=None, long_name=None, hw_model_name=None, hw_model_id=None):
+        now = _now()
+        c = self.table.c
+        statement = sqlite_insert(self.table).values(
+            node_id=node_id, short_name=short_name, long_name=long_name, hw_model_name=hw_model_name,
+            hw_model_id=hw_model_id, first_seen=now, last_seen=now
+        )
+        excluded = statement.excluded
+        statement = statement.on_conflict_do_update(
+            index_elements=[c.node_id],
+            set_={
+                "short_name": func.coalesce(excluded.short_name, c.short_name),
+                "long_name": func.coalesce(excluded.long_name, c.long_name),
+                "hw_model_name": func.coalesce(excluded.hw_model_name, c.hw_model_name),
+                "hw_model_id": func.coalesce(excluded.hw_model_id, c.hw_model_id),
+                "last_seen": now,
+            }
+        )
+        with self.engine.begin() as conn:
+            conn.execute(statement)
+        return True
+
+    def can_print_message(self, node_id, rate_limit_seconds):
+        with self.engine.connect() as conn:
+            last_print = conn.execute(
+                select(self.table.c.last_print).where(self.table.c.node_id == node_id)
+            ).scalar()
+        if last_print is None:
+            return True
+        return (_now() - last_print.replace(tzinfo=timezone.utc)).total_seconds() >= rate_limit_seconds
+
+    def update_last_print(self, node_id):
+        now = _now()
+        statement = sqlite_insert(self.table).values(node_id=node_id, last_print=now, first_seen=now, last_seen=now)
+        statement = statement.on_conflict_do_update(
+            index_elements=[self.table.c.node_id],
+            set_={"last_print": now, "last_seen": now}
+        )
+        with self.engine.begin() as conn:
+            conn.execute(statement)
+        return True
+
+class RawNodeRepository:
+    """NodeRepository's packet-path calls as SQL strings on the DB-API connection"""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def _run(self, sql, params, fetch=False):
+        conn = self.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            if fetch:
+                return cursor.fetchone()
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _timestamp():
+        # The format SQLAlchemy's SQLite DateTime type stores
+        return _now().replace(tzinfo=None).isoformat(sep=" ", timespec="microseconds")
+
+    def get_node_by_id(self, node_id):
+        return self._run("SELECT node_id, long_name, short_name, hw_model_name, hw_model_id, first_seen, last_seen, "
+                         "last_print FROM nodes WHERE node_id = ?", (node_id,), fetch=True)
+
+    def save_or_update_node(self, node_id, short_name=None, long_name=None, hw_model_name=None, hw_model_id=None):
+        now = self._timestamp()
+        self._run(
+            "INSERT INTO nodes (node_id, short_name, long_name, hw_model_name, hw_model_id, first_seen, last_seen) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (node_id) DO UPDATE SET "
+            "short_name = coalesce(excluded.short_name, short_name), "
+            "long_name = coalesce(excluded.long_name, long_name), "
+            "hw_model_name = coalesce(excluded.hw_model_name, hw_model_name), "
+            "hw_model_id = coalesce(excluded.hw_model_id, hw_model_id), "
+            "last_seen = excluded.last_seen",
+            (node_id, short_name, long_name, hw_model_name, hw_model_id, now, now)
+        )
+        return True
+
+    def can_print_message(self, node_id, rate_limit_seconds):
+        row = self._run("SELECT last_print FROM nodes WHERE node_id = ?", (node_id,), fetch=True)
+        if row is None or row[0] is None:
+            return True
+        last_print = datetime.fromisoformat(row[0]).replace(tzinfo=timezone.utc)
+        return (_now() - last_print).total_seconds() >= rate_limit_seconds
+
+    def update_last_print(self, node_id):
+        now = self._timestamp()
+        self._run(
+            "INSERT INTO nodes (node_id, last_print, first_seen, last_seen) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (node_id) DO UPDATE SET last_print = excluded.last_print, last_seen = excluded.last_seen",
+            (node_id, now, now, now)
+        )
+        return True
+
+def seed(path, size, rng):
+    """Fill a new database with size nodes; returns their IDs"""
+    ids = rng.sample(range(1, 2 ** 32 - 1), size)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    conn = sqlite3.connect(path)
+    try:
+        for start in range(0, size, 50000):
+            rows = []
+            for node_id in ids[start:start + 50000]:
+                hw_model, hw_id = HW_MODELS[node_id % len(HW_MODELS)]
+                stamp = now.isoformat(sep=" ", timespec="microseconds")
+                rows.append((node_id, f"Node {node_id:08x}", f"{node_id & 0xFFFF:04x}", hw_model, hw_id, stamp, stamp,
+                             stamp if node_id % 3 == 0 else None))
+            conn.executemany("INSERT INTO nodes (node_id, long_name, short_name, hw_model_name, hw_model_id, "
+                             "first_seen, last_seen, last_print) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    return ids
+
+def open_database(directory, size, rng):
+    """Create, or with a kept directory reuse, the database for one size"""
+    path = os.path.join(directory, f"nodes-{size}.db")
+    os.environ["SQLITE_DATABASE_PATH"] = path
+    reuse = os.path.exists(path)
+    session_factory = setup_database()
+    if session_factory is None:
+        sys.exit(f"Unable to open {path}")
+    if reuse:
+        conn = sqlite3.connect(path)
+        ids = [row[0] for row in conn.execute("SELECT node_id FROM nodes")]
+        conn.close()
+        if len(ids) >= size:
+            return session_factory, ids
+        print(f"{path} holds {len(ids)} nodes, seeding again", file=sys.stderr)
+        session_factory.remove()
+        session_factory().get_bind().dispose()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        session_factory = setup_database()
+    started = time.perf_counter()
+    ids = seed(path, size, rng)
+    print(f"Seeded {size} nodes in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return session_factory, ids
+
+def workload(method, ids, ops, hit_ratio, rng):
+    """Argument tuples for ops calls; hit_ratio of them name a node that exists"""
+    calls = []
+    for _ in range(ops):
+        node_id = rng.choice(ids) if rng.random() < hit_ratio else rng.randrange(2 ** 32, 2 ** 40)
+        if method == "save_or_update_node":
+            hw_model, hw_id = HW_MODELS[node_id % len(HW_MODELS)]
+            # Mostly the same names again, as with repeated NODEINFO packets
+            long_name = f"Renamed {node_id:08x}" if rng.random() < 0.1 else f"Node {node_id:08x}"
+            calls.append((node_id, f"{node_id & 0xFFFF:04x}", long_name, hw_model, hw_id))
+        elif method == "can_print_message":
+            calls.append((node_id, RATE_LIMIT_SECONDS))
+        else:
+            calls.append((node_id,))
+    return calls
+
+def run(function, calls, threads):
+    """Make the calls from threads at once; returns per-call latencies in ns, wall time and errors"""
+    latencies = [[] for _ in range(threads)]
+    errors = [0] * threads
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(index):
+        mine = latencies[index]
+        barrier.wait()
+        for args in calls[index::threads]:
+            started = time.perf_counter_ns()
+            try:
+                function(*args)
+            except Exception:
+                errors[index] += 1
+            mine.append(time.perf_counter_ns() - started)
+
+    workers = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    wall = time.perf_counter() - started
+    return [latency for part in latencies for latency in part], wall, sum(errors)
+
+def summarize(latencies, wall):
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] / 1000, 1)
+
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": round(len(latencies) / wall, 1),
+        "mean_us": round(statistics.mean(latencies) / 1000, 1),
+        "p50_us": percentile(0.50),
+        "p95_us": percentile(0.95),
+        "p99_us": percentile(0.99),
+        "max_us": round(latencies[-1] / 1000, 1),
+    }
+
+def compare(results, baseline, tolerance):
+    """Cases whose throughput fell by more than tolerance against a baseline report"""
+    before = {(r["size"], r["variant"], r["method"], r["threads"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = before.get((result["size"], result["variant"], result["method"], result["threads"]))
+        if old and result["ops_per_sec"] < old["ops_per_sec"] * (1 - tolerance):
+            regressions.append({**{k: result[k] for k in ("size", "variant", "method", "threads")},
+                                "ops_per_sec": result["ops_per_sec"], "baseline_ops_per_sec": old["ops_per_sec"],
+                                "change": round(result["ops_per_sec"] / old["ops_per_sec"] - 1, 3)})
+    return regressions
+
+def int_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the node repository and connection layer")
+    parser.add_argument("--sizes", type=int_list, default=[1000, 100000, 1000000], help="Node counts to seed")
+    parser.add_argument("--threads", type=int_list, default=[1, 8], help="Thread counts to run each case with")
+    parser.add_argument("--variants", default="orm,core,raw", help="Comma-separated: orm, core, raw")
+    parser.add_argument("--methods", default=",".join(METHODS), help="Comma-separated repository methods")
+    parser.add_argument("--ops", type=int, default=2000, help="Calls per case")
+    parser.add_argument("--hit-ratio", type=float, default=0.9, help="Share of calls for a node that exists")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--dir", help="Keep seeded databases here and reuse them (default: a temp directory)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument("--baseline", help="JSON from an earlier run; exit 1 if a case got slower")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed throughput drop against --baseline")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logging.getLogger().setLevel(logging.WARNING)
+
+    directory = args.dir or tempfile.mkdtemp(prefix="bench-repository-")
+    os.makedirs(directory, exist_ok=True)
+    variants = args.variants.split(",")
+    methods = args.methods.split(",")
+    rng = random.Random(args.seed)
+    results = []
+    try:
+        for size in args.sizes:
+            session_factory, ids = open_database(directory, size, rng)
+            session = session_factory()
+            engine = session.get_bind()
+            session.close()
+            repos = {
+                "orm": NodeRepository(session_factory),
+                "core": CoreNodeRepository(engine),
+                "raw": RawNodeRepository(engine),
+            }
+            for method in methods:
+                for threads in args.threads:
+                    for variant in variants:
+                        calls = workload(method, ids, args.ops, args.hit_ratio, rng)
+                        function = getattr(repos[variant], method)
+                        # Warm the pool and the page cache
+                        run(function, calls[:50], threads)
+                        latencies, wall, errors = run(function, calls, threads)
+                        result = {"size": size, "variant": variant, "method": method, "threads": threads,
+                                  **summarize(latencies, wall), "errors": errors}
+                        results.append(result)
+                        if not args.json:
+                            print(f"{size:>8} {method:<20} {threads:>3}t {variant:<5} {result['ops_per_sec']:>10.0f}/s "
+                                  f"p50 {result['p50_us']:>8.1f}us p95 {result['p95_us']:>8.1f}us "
+                                  f"p99 {result['p99_us']:>8.1f}us" + (f" errors {errors}" if errors else ""),
+                                  flush=True)
+            session_factory.remove()
+            engine.dispose()
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    report = {
+        "python": sys.version.split()[0],
+        "sqlite": sqlite3.sqlite_version,
+        "ops": args.ops,
+        "hit_ratio": args.hit_ratio,
+        "results": results,
+    }
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fp:
+            regressions = compare(results, json.load(fp), args.tolerance)
+        report["regressions"] = regressions
+    if args.json:
+        print(json.dumps(report, indent=2))
+    elif args.baseline:
+        for regression in regressions:
+            print(f"SLOWER {regression['size']} {regression['method']} {regression['threads']}t "
+                  f"{regression['variant']}: {regression['ops_per_sec']:.0f}/s vs "
+                  f"{regression['baseline_ops_per_sec']:.0f}/s ({regression['change']:+.0%})")
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+import base64
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from google.protobuf.json_format import MessageToDict
+
+logger = logging.getLogger('telegramtastic.archive')
+
+BROADCAST_ID = 4294967295
+SEGMENT_SUFFIX = ".ndjson.gz"
+INDEX_SUFFIX = ".idx.json"
+
+def packet_record(received, packet):
+    """
+    Turn a PacketView into an archive record
+
+    Args:
+        received (float): When the envelope arrived, as a Unix timestamp
+        packet (PacketView): The packet, after proccessPacket is done with it
+
+    Returns:
+        dict: The record, ready to be written as one NDJSON line
+    """
+    mp = packet.packet
+    record = {
+        "t": round(received, 3),
+        "rx_time": mp.rx_time or None,
+        "from": packet.from_id,
+        "to": packet.to,
+        "id": packet.id,
+        "channel": packet.channel_id,
+        "gateway": packet.gateway_id,
+        "port": packet.portnum,
+        "hop_limit": mp.hop_limit,
+        "hop_start": mp.hop_start,
+        "snr": round(mp.rx_snr, 2),
+        "rssi": mp.rx_rssi,
+    }
+    if packet.data is None:
+        record["encrypted"] = True
+    elif packet.portnum == 1:
+        record["text"] = packet.payload.decode("utf-8", errors="replace")
+    else:
+        try:
+            app = packet.app
+        except Exception as e:
+            app = None
+            record["error"] = str(e)
+        if app is not None:
+            record["app"] = MessageToDict(app, preserving_proto_field_name=True)
+        else:
+            record["payload"] = base64.b64encode(packet.payload).decode("ascii")
+    return record
+
+class _Index:
+    """What a segment holds: its time range, packet count, node IDs and port numbers"""
+
+    __slots__ = ("start", "end", "records", "nodes", "portnums")
+
+    def __init__(self):
+        self.start = None
+        self.end = None
+        self.records = 0
+        self.nodes = set()
+        self.portnums = set()
+
+class _Segment:
+    """An open segment file and the index of what has been written to it"""
+
+    __slots__ = ("path", "fp", "gz", "opened", "index", "last_flush")
+
+    def __init__(self, path):
+        self.path = path
+        self.fp = open(path, "xb")
+        self.gz = gzip.GzipFile(fileobj=self.fp, mode="wb")
+        self.opened = time.time()
+        self.index = _Index()
+        self.last_flush = time.monotonic()
+
+    def write(self, records):
+        lines = []
+        for record in records:
+            lines.append(json.dumps(record, separators=(",", ":")))
+            _index_record(self.index, record)
+        self.gz.write(("\n".join(lines) + "\n").encode("utf-8"))
+
+    def flush(self):
+        """Make everything written so far readable, even if the process dies before close"""
+        self.gz.flush()
+        self.fp.flush()
+        self.last_flush = time.monotonic()
+
+    def size(self):
+        return self.fp.tell()
+
+    def close(self):
+        self.gz.close()
+        self.fp.close()
+        _write_index(self.path, self.index)
+
+def _index_record(index, record):
+    t = record["t"]
+    index.start = t if index.start is None else min(index.start, t)
+    index.end = t if index.end is None else max(index.end, t)
+    index.records += 1
+    index.nodes.add(record["from"])
+    if record["to"] != BROADCAST_ID:
+        index.nodes.add(record["to"])
+    index.portnums.add(record["port"])
+
+def _write_index(path, index):
+    """Write a segment's index next to it, replacing any earlier one in one rename"""
+    index_path = path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+    with open(index_path + ".tmp", "w", encoding="utf-8") as fp:
+        json.dump({
+            "segment": os.path.basename(path),
+            "start": index.start,
+            "end": index.end,
+            "records": index.records,
+            "bytes": os.path.getsize(path),
+            "nodes": sorted(index.nodes),
+            "portnums": sorted(index.portnums, key=lambda port: -1 if port is None else port),
+        }, fp, separators=(",", ":"))
+    os.replace(index_path + ".tmp", index_path)
+
+def read_segment(path):
+    """Yield the records in a segment, including one still being written or cut short by a crash"""
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as fp:
+            for line in fp:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A line cut off mid-write
+                    continue
+    except (EOFError, gzip.BadGzipFile):
+        # No gzip trailer yet: the segment is open, or was never closed
+        return
+
+def list_segments(directory):
+    """
+    Find the segments in an archive directory, oldest first
+
+    Returns:
+        list: (segment path, index dict or None) tuples; segments without an index
+            are still open or were never closed
+    """
+    segments = []
+    for path in sorted(glob.glob(os.path.join(directory, "traffic-*" + SEGMENT_SUFFIX))):
+        index = None
+        try:
+            with open(path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX, encoding="utf-8") as fp:
+                index = json.load(fp)
+        except (OSError, ValueError):
+            pass
+        segments.append((path, index))
+    return segments
+
+def scan(directory, node=None, since=None, until=None, portnums=None, stats=None):
+    """
+    Yield archived records matching every filter given
+
+    Segments whose index rules out a match are skipped without being opened.
+    Segments without an index are always read.
+
+    Args:
+        directory (str): The archive directory
+        node (int): Only packets from or to this node
+        since (float): Only packets received at or after this Unix timestamp
+        until (float): Only packets received before this Unix timestamp
+        portnums (set): Only packets on these port numbers
+        stats (dict): If given, filled in with segments, skipped and scanned counts
+    """
+    segments = list_segments(directory)
+    if stats is not None:
+        stats.update(segments=len(segments), skipped=0, scanned=0)
+    for path, index in segments:
+        if index is not None and (
+                not index["records"]
+                or (since is not None and index["end"] < since)
+                or (until is not None and index["start"] >= until)
+                or (node is not None and node not in index["nodes"])
+                or (portnums is not None and portnums.isdisjoint(index["portnums"]))):
+            if stats is not None:
+                stats["skipped"] += 1
+            continue
+        if stats is not None:
+            stats["scanned"] += 1
+        for record in read_segment(path):
+            if since is not None and record["t"] < since:
+                continue
+            if until is not None and record["t"] >= until:
+                continue
+            if node is not None and record["from"] != node and record["to"] != node:
+                continue
+            if portnums is not None and record["port"] not in portnums:
+                continue
+            yield record
+
+class TrafficArchive:
+    """
+    Append-only archive of decoded traffic in rotating, gzip-compressed NDJSON segments.
+
+    add() only puts the packet on a bounded queue, so packet handling never
+    waits on compression or the disk. If the writer falls behind and the
+    queue is full, packets are dropped from the archive and counted. The
+    writer thread turns packets into records, compresses them into the
+    current segment and flushes every flush_interval seconds. A crash
+    therefore loses at most the last few seconds.
+
+    A new segment is started every segment_seconds, or once the current one
+    reaches segment_bytes on disk. When a segment is closed, a small index of
+    its time range, node IDs and port numbers is written next to it, so
+    scan() can skip whole segments. Segments left without an index by a crash
+    are indexed when the archive next starts. Segments older than
+    retention_days are deleted; 0 keeps everything.
+    """
+
+    def __init__(self, directory, segment_seconds=3600, segment_bytes=64 * 1024 * 1024, retention_days=0,
+                 queue_size=10000, flush_interval=5.0):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.retention_days = retention_days
+        self.flush_interval = flush_interval
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stopping = threading.Event()
+        self._thread = None
+        self._segment = None
+        self.archived = 0
+        self.dropped = 0
+        self.errors = 0
+        self.segments_closed = 0
+        self.segments_removed = 0
+
+    def add(self, packet):
+        """Queue a processed packet for the archive; never blocks"""
+        try:
+            self._queue.put_nowait((time.time(), packet))
+        except queue.Full:
+            self.dropped += 1
+
+    def _open(self):
+        name = "traffic-" + datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        path = os.path.join(self.directory, name + SEGMENT_SUFFIX)
+        suffix = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, f"{name}-{suffix}{SEGMENT_SUFFIX}")
+            suffix += 1
+        self._segment = _Segment(path)
+        logger.debug(f"Started archive segment {path}")
+
+    def _close(self):
+        segment, self._segment = self._segment, None
+        segment.close()
+        self.segments_closed += 1
+        logger.debug(f"Closed archive segment {segment.path}: {segment.index.records} packets, "
+                     f"{os.path.getsize(segment.path)} bytes")
+        self._prune()
+
+    def _prune(self):
+        if not self.retention_days:
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        for path, index in list_segments(self.directory):
+            if index is not None and index["end"] is not None and index["end"] < cutoff:
+                for stale in (path, path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX):
+                    try:
+                        os.remove(stale)
+                    except OSError as e:
+                        logger.warning(f"Could not remove archive file {stale}: {e}")
+                self.segments_removed += 1
+
+    def _reindex(self):
+        """Index segments left open by an earlier run"""
+        for path, index in list_segments(self.directory):
+            if index is None:
+                rebuilt = _Index()
+                for record in read_segment(path):
+                    _index_record(rebuilt, record)
+                _write_index(path, rebuilt)
+                logger.info(f"Indexed archive segment {os.path.basename(path)} left open by the last run "
+                            f"({rebuilt.records} packets)")
+
+    def _write(self, batch):
+        records = []
+        for received, packet in batch:
+            try:
+                records.append(packet_record(received, packet))
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Could not archive packet {packet.id}: {e}")
+        if not records:
+            return
+        if self._segment is None:
+            self._open()
+        self._segment.write(records)
+        self.archived += len(records)
+
+    def _loop(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._reindex()
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=min(self.flush_interval, 1.0)))
+                while len(batch) < 500:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                if batch:
+                    self._write(batch)
+                segment = self._segment
+                if segment is not None:
+                    if (time.time() - segment.opened >= self.segment_seconds
+                            or segment.size() >= self.segment_bytes):
+                        self._close()
+                    elif time.monotonic() - segment.last_flush >= self.flush_interval:
+                        segment.flush()
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error writing the traffic archive: {e}")
+                time.sleep(1)
+        if self._segment is not None:
+            self._close()
+
+    def start(self):
+        """Start the writer thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="traffic-archive", daemon=True)
+            self._thread.start()
+            logger.info(f"Archiving decoded traffic to {self.directory}")
+        return self
+
+    def close(self, timeout=10):
+        """Write out what is queued and close the current segment with its index"""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join(timeout)
+
+    def stats(self):
+        segment = self._segment
+        return {
+            "directory": self.directory,
+            "archived": self.archived,
+            "queued": self._queue.qsize(),
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "segment": os.path.basename(segment.path) if segment is not None else None,
+            "segment_packets": segment.index.records if segment is not None else 0,
+            "segment_bytes": segment.size() if segment is not None else 0,
+            "segments_closed": self.segments_closed,
+            "segments_removed": self.segments_removed,
+        }
@@ -0,0 +1,233 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger('telegramtastic.cluster')
+
+class PrintCoordinator:
+    """
+    Lets several app.py instances share one printer without printing twice.
+
+    Every instance hands its telegrams to handoff(), which writes them to the
+    shared print_jobs table. A packet that reached more than one instance is
+    only stored once, because of the table's unique (printer, from, packet id)
+    key.
+
+    One instance at a time holds the lease on the printer, stored in the
+    shared SQLite database. The owner renews it every ttl / 3 seconds and
+    polls print_jobs every poll_interval seconds, claiming waiting telegrams
+    and passing them to submit. No more than batch_size are kept in the local
+    print queue, so the backlog stays in the table where a successor can
+    reach it. The other instances stand by and try to take the lease
+    whenever it lapses. When an instance takes over, telegrams the
+    previous owner claimed but never printed are released and printed again,
+    so a receipt that was mid-print at failover may appear twice. A telegram
+    whose print fails is released through failed_job() for the owner to
+    claim again, up to max_attempts times; after that it stays claimed until
+    the lease changes hands.
+
+    on_acquire() is called when the lease is won and must open the printer;
+    if it raises, the lease is given up so another instance can try.
+    on_release() is called when the lease is lost or given up.
+    """
+
+    def __init__(self, repo, printer_name, instance_id, submit, queue_depth, on_acquire=None, on_release=None,
+                 counters=None, ttl=15.0, poll_interval=0.5, batch_size=20, max_attempts=3):
+        self.repo = repo
+        self.printer_name = printer_name
+        self.instance_id = instance_id
+        self.submit = submit
+        self.queue_depth = queue_depth
+        self.on_acquire = on_acquire
+        self.on_release = on_release
+        # Returns the instance's cumulative received and processed counts for heartbeats
+        self.counters = counters
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self.owner = None
+        self.lease_expires = None
+        self.owning = False
+        self.handed_off = 0
+        self.duplicates = 0
+        self.claimed = 0
+        self.printed = 0
+        self.released = 0
+        self.abandoned = 0
+        self.takeovers = 0
+        # Failed attempts by job ID, for telegrams not printed yet
+        self._failures = {}
+        self._last_heartbeat = None
+        self._instances = []
+        self._pending = None
+
+    def handoff(self, from_node, packet_id, priority, payload):
+        """
+        Queue a telegram for whichever instance owns the printer
+
+        Returns:
+            bool: False if another instance already queued this packet
+        """
+        added = self.repo.add_job(self.printer_name, self.instance_id, from_node, packet_id, priority, payload)
+        with self._lock:
+            if added:
+                self.handed_off += 1
+            else:
+                self.duplicates += 1
+        return added
+
+    def printed_job(self, job_id):
+        """Record that a claimed telegram has been printed"""
+        self.repo.mark_printed(job_id)
+        with self._lock:
+            self.printed += 1
+            self._failures.pop(job_id, None)
+
+    def failed_job(self, job_id, error):
+        """Release a claimed telegram whose print failed, so it is claimed and printed again"""
+        with self._lock:
+            failures = self._failures[job_id] = self._failures.get(job_id, 0) + 1
+            if failures >= self.max_attempts:
+                del self._failures[job_id]
+                self.abandoned += 1
+            else:
+                self.released += 1
+        if failures >= self.max_attempts:
+            logger.error(f"Giving up on print job {job_id} on {self.printer_name} after {failures} attempts: {error}")
+            return
+        self.repo.release_job(job_id)
+
+    def _renew(self):
+        lease = self.repo.acquire_lease(self.printer_name, self.instance_id, self.ttl)
+        if lease is None:
+            # Database trouble: we can't prove we still own the printer, so we don't
+            self._lose("could not renew lease")
+            return
+        self.owner, self.lease_expires = lease
+        if self.owner != self.instance_id:
+            self._lose(f"lease held by {self.owner}")
+        elif not self.owning and not self.queue_depth():
+            # Telegrams queued under an earlier lease are dropped before we take
+            # over again, since the release in _take puts them back in the table
+            self._take()
+
+    def _take(self):
+        try:
+            if self.on_acquire is not None:
+                self.on_acquire()
+        except Exception as e:
+            logger.error(f"Won the lease on printer {self.printer_name} but could not open it: {e}")
+            self.repo.release_lease(self.printer_name, self.instance_id)
+            self.owner = None
+            return
+        released = self.repo.release_claims(self.printer_name)
+        with self._lock:
+            self._failures.clear()
+        self.owning = True
+        self.takeovers += 1
+        logger.info(f"Now printing on {self.printer_name}"
+                    f"{f', re-queued {released} unprinted telegram(s)' if released else ''}")
+
+    def _lose(self, reason):
+        if not self.owning:
+            return
+        self.owning = False
+        logger.warning(f"Stopped printing on {self.printer_name}: {reason}")
+        if self.on_release is not None:
+            try:
+                self.on_release()
+            except Exception as e:
+                logger.warning(f"Error closing printer {self.printer_name}: {e}")
+
+    def _claim(self):
+        room = self.batch_size - self.queue_depth()
+        if room <= 0:
+            return 0
+        jobs = self.repo.claim_jobs(self.printer_name, self.instance_id, room)
+        for job in jobs:
+            self.submit(job)
+        with self._lock:
+            self.claimed += len(jobs)
+        return len(jobs)
+
+    def _heartbeat(self):
+        now = time.time()
+        received, processed = self.counters() if self.counters else (0, 0)
+        rate = None
+        if self._last_heartbeat is not None:
+            last_time, last_received = self._last_heartbeat
+            rate = round((received - last_received) / max(now - last_time, 1e-9), 2)
+        self._last_heartbeat = (now, received)
+        self.repo.heartbeat(self.instance_id, "owner" if self.owning else "standby", received=received,
+                            processed=processed, handed_off=self.handed_off, printed=self.printed, rate=rate)
+        # Refreshed here so the status API never queries the database
+        self._instances = self.repo.instances(now - self.ttl * 3)
+        self._pending = self.repo.pending_count(self.printer_name)
+
+    def _loop(self):
+        next_renew = 0
+        while True:
+            try:
+                if time.monotonic() >= next_renew:
+                    next_renew = time.monotonic() + self.ttl / 3
+                    self._renew()
+                    self._heartbeat()
+                if not self.owning or not self._claim():
+                    time.sleep(self.poll_interval)
+                else:
+                    # Top up again as soon as the printer has worked through some of the batch
+                    time.sleep(self.poll_interval / 10)
+            except Exception as e:
+                logger.error(f"Error coordinating printer {self.printer_name}: {e}")
+                time.sleep(self.poll_interval)
+
+    def stop(self):
+        """Give up the printer so a standby instance can take over without waiting for the lease to expire"""
+        if self.owning:
+            self._lose("shutting down")
+            self.repo.release_lease(self.printer_name, self.instance_id)
+
+    def start(self):
+        """Start the lease and claim thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="print-coordinator", daemon=True)
+            self._thread.start()
+            logger.info(f"Sharing printer {self.printer_name} as instance {self.instance_id}, lease {self.ttl}s")
+        return self
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            counters = {
+                "handed_off": self.handed_off,
+                "duplicates": self.duplicates,
+                "claimed": self.claimed,
+                "printed": self.printed,
+                "released": self.released,
+                "abandoned": self.abandoned,
+            }
+        return {
+            "instance_id": self.instance_id,
+            "printer": self.printer_name,
+            "role": "owner" if self.owning else "standby",
+            "owner": self.owner,
+            "lease_remaining": round(self.lease_expires - now, 1) if self.lease_expires else None,
+            "takeovers": self.takeovers,
+            "pending": self._pending,
+            **counters,
+            "instances": {
+                instance["instance_id"]: {
+                    "role": instance["role"],
+                    "rate": instance["rate"],
+                    "received": instance["received"],
+                    "processed": instance["processed"],
+                    "handed_off": instance["handed_off"],
+                    "printed": instance["printed"],
+                    "age": round(now - instance["last_seen"], 1),
+                } for instance in self._instances
+            },
+        }
@@ -3,14 +3,32 @@ from datetime import datetime, timezone
 
 logger = logging.getLogger('telegramtastic.common')
 
-# https://www.reddit.com/r/mildlyinteresting/comments/593ao8/telegram_from_greatgrandmother_on_my_birth/
-def printThis(to, frm, text, printer):
-    now = datetime.now().astimezone().strftime("%d %B %Y %H:%M %Z")
+def parse_node_ids(value):
+    """Parse a comma-separated list of node IDs, decimal or "!hex", into a set of ints"""
+    ids = set()
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        try:
+            ids.add(int(item[1:], 16) if item.startswith("!") else int(item))
+        except ValueError:
+            logger.warning(f"Ignoring invalid node ID {item!r}")
+    return ids
+
+def _timestamp(received=None):
+    """Format the receive time printed on a telegram"""
+    when = received.astimezone() if received is not None else datetime.now().astimezone()
+    return when.strftime("%d %B %Y %H:%M %Z")
+
+def _header(printer, title):
     printer.set_with_default()
     printer.set(double_height=True, double_width=True,bold=True,align="center")
-    printer.text("MESHTASTIC TELEGRAM\n")
+    printer.text(title)
     printer.text("=" * 21 + "\n\n")
     printer.set_with_default()
+
+# https://www.reddit.com/r/mildlyinteresting/comments/593ao8/telegram_from_greatgrandmother_on_my_birth/
+def printThis(to, frm, text, printer, received=None):
+    now = _timestamp(received)
+    _header(printer, "MESHTASTIC TELEGRAM\n")
     body = f"Recieved: {now}\n\n{text}\n\n".upper()
     printer.text(body)
     printer.set(align="center")
@@ -19,17 +37,31 @@ def printThis(to, frm, text, printer):
     printer.set_with_default()
     printer.cut()
 
-def printThis2(sender, text, printer):
-    now = datetime.now().astimezone().strftime("%d %B %Y %H:%M %Z")
-    printer.set_with_default()
-    printer.set(double_height=True, double_width=True,bold=True,align="center")
-    printer.text("MESHTASTIC TELEGRAM\nOPENSAUCE 2025\n")
-    printer.text("=" * 21 + "\n\n")
-    printer.set_with_default()
+def printThis2(sender, text, printer, received=None):
+    now = _timestamp(received)
+    _header(printer, "MESHTASTIC TELEGRAM\nOPENSAUCE 2025\n")
     body = f"Recieved: {now}\n\n{text}\n\n".upper()
     printer.text(body)
     printer.set(align="center")
     out = f"--{sender.short_name} aka {sender.long_name}\n\n".upper()
     printer.text(out)
     printer.set_with_default()
-    printer.cut()
\ No newline at end of file
+    printer.cut()
+
+def printDigest(jobs, printer, title="MESHTASTIC TELEGRAM\n", sep=" / "):
+    """
+    Print several queued telegrams on a single receipt.
+    One header and one cut are shared by all jobs, which is what makes
+    digest mode faster than printing each telegram on its own receipt.
+    """
+    _header(printer, title)
+    for i, job in enumerate(jobs):
+        if i > 0:
+            printer.text("-" * 32 + "\n\n")
+        body = f"Recieved: {_timestamp(job.received)}\n\n{job.text}\n\n".upper()
+        printer.text(body)
+        printer.set(align="center")
+        out = f"--{job.frm.short_name}{sep}{job.frm.long_name}\n\n".upper()
+        printer.text(out)
+        printer.set_with_default()
+    printer.cut()
@@ -0,0 +1,32 @@
+from collections import OrderedDict
+
+class RecentPackets:
+    """
+    The most recent max_size packet IDs, for dropping duplicate uplinks.
+
+    Copies of a packet heard by several gateways arrive within seconds of
+    each other, so only recent IDs need remembering; older ones are
+    forgotten first. Broker replays after a restart are caught by the print
+    ledger instead. Only touched by the thread handling messages.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._ids = OrderedDict()
+        self.forgotten = 0
+
+    def add(self, packet_id):
+        """Remember a packet ID, returning False if it was already seen"""
+        if packet_id in self._ids:
+            return False
+        self._ids[packet_id] = None
+        if len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+            self.forgotten += 1
+        return True
+
+    def __len__(self):
+        return len(self._ids)
+
+    def stats(self):
+        return {"size": len(self._ids), "max_size": self.max_size, "forgotten": self.forgotten}
@@ -0,0 +1,284 @@
+import logging
+
+logger = logging.getLogger('telegramtastic.escpos_decode')
+
+ESC = 0x1b
+GS = 0x1d
+DLE = 0x10
+FS = 0x1c
+
+# ESC t code page numbers from the default python-escpos profile
+CODE_PAGES = {
+    0: "cp437", 2: "cp850", 3: "cp860", 4: "cp863", 5: "cp865", 13: "cp857",
+    14: "cp737", 15: "iso8859_7", 16: "cp1252", 17: "cp866", 18: "cp852",
+    19: "cp858", 39: "iso8859_2", 40: "iso8859_15", 45: "cp1250", 46: "cp1251",
+}
+
+# Number of parameter bytes that follow simple fixed-length ESC and GS commands
+ESC_PARAMS = {
+    ord("@"): 0, ord("!"): 1, ord("E"): 1, ord("G"): 1, ord("-"): 1, ord("a"): 1,
+    ord("t"): 1, ord("{"): 1, ord("M"): 1, ord("d"): 1, ord("J"): 1, ord("2"): 0,
+    ord("3"): 1, ord("R"): 1, ord("r"): 1, ord(" "): 1, ord("$"): 2, ord("\\"): 2,
+    ord("p"): 3, ord("i"): 0, ord("m"): 0, ord("c"): 2, ord("B"): 2, ord("V"): 1,
+    ord("U"): 1, ord("e"): 1,
+}
+GS_PARAMS = {
+    ord("!"): 1, ord("b"): 1, ord("B"): 1, ord("h"): 1, ord("w"): 1, ord("H"): 1,
+    ord("f"): 1, ord("L"): 2, ord("W"): 2, ord("r"): 1, ord("a"): 1, ord("P"): 2,
+    ord("I"): 1, ord("T"): 1,
+}
+
+# Approximate paper use at 203 dpi (8 dots per mm) with the default 1/6" line spacing
+DOTS_PER_MM = 8
+LINE_DOTS = 34
+
+class Receipt:
+    """Readable transcript of one print job, delimited by a cut"""
+
+    def __init__(self):
+        self.lines = []
+        self.bytes = 0
+        self.paper_dots = 0
+        self.graphics = 0
+
+    @property
+    def paper_mm(self):
+        return self.paper_dots / DOTS_PER_MM
+
+    def transcript(self):
+        return "\n".join(self.lines)
+
+class EscposDecoder:
+    """
+    Incremental ESC/POS decoder.
+
+    Bytes can be fed in arbitrary chunks; incomplete commands are held back
+    until the rest arrives. Text and the commands python-escpos emits are
+    turned into a Receipt transcript, and each cut completes a receipt.
+    Status queries (DLE EOT) are passed to on_status so a caller can answer them.
+    """
+
+    def __init__(self, on_status=None):
+        self.on_status = on_status
+        self._buf = bytearray()
+        self._line = []
+        self.receipt = Receipt()
+        self.receipts = []
+        self.align = "left"
+        self.double_height = False
+        self.double_width = False
+        self.bold = False
+        self.encoding = CODE_PAGES[0]
+
+    def feed(self, data):
+        """Decode a chunk of bytes and return any receipts completed by it"""
+        self._buf += data
+        done = len(self.receipts)
+        i = 0
+        while i < len(self._buf):
+            receipt = self.receipt
+            used = self._command(i)
+            if used is None:
+                break
+            receipt.bytes += used
+            i += used
+        del self._buf[:i]
+        return self.receipts[done:]
+
+    def flush(self):
+        """Complete the current receipt even though no cut was received"""
+        self._newline(force=False)
+        if self.receipt.lines or self.receipt.graphics:
+            self._finish()
+            return [self.receipts[-1]]
+        return []
+
+    def _newline(self, force=True):
+        if not self._line and not force:
+            return
+        text = "".join(self._line)
+        self._line = []
+        # Lines longer than the paper is wide wrap onto more rows
+        rows = max(1, -(-len(text) // (21 if self.double_width else 42)))
+        if self.double_height or self.double_width or self.bold:
+            flags = "".join(f for f, on in (("H", self.double_height), ("W", self.double_width), ("B", self.bold)) if on)
+            text = f"{text}  [{flags}]" if text else text
+        if self.align == "center":
+            text = text.center(42 if not self.double_width else 21)
+        elif self.align == "right":
+            text = text.rjust(42 if not self.double_width else 21)
+        self.receipt.lines.append(text.rstrip())
+        self.receipt.paper_dots += rows * LINE_DOTS * (2 if self.double_height else 1)
+
+    def _finish(self):
+        self.receipt.lines.append("-" * 14 + " [cut] " + "-" * 14)
+        self.receipts.append(self.receipt)
+        self.receipt = Receipt()
+
+    def _note(self, text):
+        self._newline(force=False)
+        self.receipt.lines.append(f"[{text}]")
+
+    def _print_mode(self, n, gs=False):
+        if gs:
+            self.double_width = bool(n & 0xF0)
+            self.double_height = bool(n & 0x0F)
+        else:
+            self.bold = bool(n & 0x08)
+            self.double_height = bool(n & 0x10)
+            self.double_width = bool(n & 0x20)
+
+    def _command(self, i):
+        """Decode the command at offset i and return its length, or None if incomplete"""
+        buf = self._buf
+        b = buf[i]
+        if b == 0x0a:
+            self._newline()
+            return 1
+        if b == 0x0d:
+            return 1
+        if b == ESC:
+            return self._esc(i)
+        if b == GS:
+            return self._gs(i)
+        if b == DLE:
+            if i + 2 >= len(buf):
+                return None
+            if buf[i + 1] == 0x04:
+                if self.on_status is not None:
+                    self.on_status(buf[i + 2])
+                return 3
+            if buf[i + 1] == 0x14:
+                return 5 if i + 4 < len(buf) else None
+            return 3
+        if b == FS:
+            if i + 1 >= len(buf):
+                return None
+            return 3 if buf[i + 1] == ord("C") else 2
+        if b < 0x20 and b != 0x09:
+            return 1
+        # Printable run up to the next control byte
+        end = i
+        while end < len(buf) and (buf[end] >= 0x20 or buf[end] == 0x09):
+            end += 1
+        self._line.append(bytes(buf[i:end]).decode(self.encoding, errors="replace"))
+        return end - i
+
+    def _esc(self, i):
+        buf = self._buf
+        if i + 1 >= len(buf):
+            return None
+        cmd = buf[i + 1]
+        if cmd == ord("*"):
+            # Column bit image: ESC * m nL nH d1...dk
+            if i + 4 >= len(buf):
+                return None
+            m, n = buf[i + 2], buf[i + 3] | buf[i + 4] << 8
+            length = 5 + n * (1 if m in (0, 1) else 3)
+            if i + length > len(buf):
+                return None
+            self.receipt.graphics += 1
+            self.receipt.paper_dots += 8 if m in (0, 1) else 24
+            return length
+        params = ESC_PARAMS.get(cmd, 0)
+        if i + 2 + params > len(buf):
+            return None
+        arg = buf[i + 2] if params else None
+        if cmd == ord("@"):
+            self.align, self.double_height, self.double_width, self.bold = "left", False, False, False
+        elif cmd == ord("!"):
+            self._print_mode(arg)
+        elif cmd == ord("E"):
+            self.bold = bool(arg & 1)
+        elif cmd == ord("a"):
+            self._newline(force=False)
+            # 0-2 or "0"-"2"; printers ignore anything else
+            n = arg - 48 if arg >= 48 else arg
+            if n < 3:
+                self.align = ("left", "center", "right")[n]
+        elif cmd == ord("t"):
+            self.encoding = CODE_PAGES.get(arg, CODE_PAGES[0])
+        elif cmd == ord("d"):
+            self._newline(force=False)
+            self.receipt.paper_dots += LINE_DOTS * arg
+        elif cmd == ord("J"):
+            self.receipt.paper_dots += arg
+        elif cmd in (ord("i"), ord("m")):
+            self._newline(force=False)
+            self._finish()
+        return 2 + params
+
+    def _gs(self, i):
+        buf = self._buf
+        if i + 1 >= len(buf):
+            return None
+        cmd = buf[i + 1]
+        if cmd == ord("V"):
+            # GS V m, or GS V m n for the feed-and-cut variants
+            if i + 2 >= len(buf):
+                return None
+            length = 4 if buf[i + 2] in (65, 66, 97, 98, 103, 104) else 3
+            if i + length > len(buf):
+                return None
+            self._newline(force=False)
+            self._finish()
+            return length
+        if cmd == ord("v"):
+            # Raster bit image: GS v 0 m xL xH yL yH d1...dk
+            if i + 7 >= len(buf):
+                return None
+            width = buf[i + 4] | buf[i + 5] << 8
+            height = buf[i + 6] | buf[i + 7] << 8
+            length = 8 + width * height
+            if i + length > len(buf):
+                return None
+            self._note(f"raster image {width * 8}x{height}")
+            self.receipt.graphics += 1
+            self.receipt.paper_dots += height
+            return length
+        if cmd == ord("("):
+            # Extended commands (QR codes, graphics): GS ( fn pL pH data
+            if i + 4 >= len(buf):
+                return None
+            length = 5 + (buf[i + 3] | buf[i + 4] << 8)
+            if i + length > len(buf):
+                return None
+            fn, body = buf[i + 2], bytes(buf[i + 5:i + length])
+            if fn == ord("k") and len(body) > 3 and body[1] == 80:
+                self._note(f"qr {body[3:].decode('latin-1')}")
+            elif fn == ord("k") and len(body) > 1 and body[1] == 81:
+                self.receipt.graphics += 1
+                self.receipt.paper_dots += 200
+            return length
+        if cmd == ord("k"):
+            # Barcode: GS k m d1...dk NUL (m <= 6) or GS k m n d1...dn
+            if i + 3 >= len(buf):
+                return None
+            m = buf[i + 2]
+            if m <= 6:
+                end = buf.find(b"\x00", i + 3)
+                if end < 0:
+                    return None
+                data, length = bytes(buf[i + 3:end]), end - i + 1
+            else:
+                n = buf[i + 3]
+                if i + 4 + n > len(buf):
+                    return None
+                data, length = bytes(buf[i + 4:i + 4 + n]), 4 + n
+            self._note(f"barcode {data.decode('latin-1')}")
+            self.receipt.graphics += 1
+            self.receipt.paper_dots += 120
+            return length
+        params = GS_PARAMS.get(cmd, 0)
+        if i + 2 + params > len(buf):
+            return None
+        if cmd == ord("!"):
+            self._print_mode(buf[i + 2], gs=True)
+        return 2 + params
+
+def decode(data):
+    """Decode a complete ESC/POS byte stream into a list of Receipts"""
+    decoder = EscposDecoder()
+    decoder.feed(data)
+    decoder.flush()
+    return decoder.receipts
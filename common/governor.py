@@ -0,0 +1,176 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from .escpos_decode import decode
+
+logger = logging.getLogger('telegramtastic.governor')
+
+class _Window:
+    """Amounts used over the last window seconds"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.entries = deque()
+        self.total = 0.0
+
+    def expire(self, now):
+        while self.entries and self.entries[0][0] <= now - self.seconds:
+            self.total -= self.entries.popleft()[1]
+
+    def add(self, now, amount):
+        self.entries.append((now, amount))
+        self.total += amount
+
+    def wait_for(self, now, amount, limit):
+        """Seconds until amount more fits under limit; an amount over the limit fits in an empty window"""
+        excess = self.total + amount - limit
+        if excess <= 0 or not self.entries:
+            return 0.0
+        for when, used in self.entries:
+            excess -= used
+            if excess <= 0:
+                return when + self.seconds - now
+        return self.entries[-1][0] + self.seconds - now
+
+class PrintGovernor:
+    """
+    Global ceiling on how much paper and printer time telegrams get.
+
+    The per-node cooldown keeps one node from hogging the printer, but fifty
+    nodes each sending once a minute still outrun a thermal printer and its
+    roll. admit() is called with each rendered receipt before it is sent.
+    The receipt is decoded to estimate its paper length, from its line count
+    with double-height lines counting twice and long lines wrapping, and its
+    print time at speed_mm_s plus cut_seconds per cut. admit() blocks until
+    the receipt fits both ceilings, and record() counts it once it has been
+    sent, so a receipt that fails and is retried is only counted once:
+
+        paper_mm_per_hour:  paper used in any rolling hour (0 = no limit)
+        duty_cycle:         share of any duty_window seconds spent printing (1 = no limit)
+
+    While it blocks, the print queue backs up, digests kick in and the
+    scheduler sheds load as usual. stats() reports what is left of the paper
+    budget and how long the given backlog would take to print at the ceilings.
+    """
+
+    def __init__(self, paper_mm_per_hour=0, duty_cycle=1.0, duty_window=600, speed_mm_s=150, cut_seconds=0.3):
+        if not 0 < duty_cycle <= 1:
+            raise ValueError(f"Duty cycle must be above 0 and at most 1, not {duty_cycle}")
+        self.paper_mm_per_hour = paper_mm_per_hour
+        self.duty_cycle = duty_cycle
+        self.speed_mm_s = speed_mm_s
+        self.cut_seconds = cut_seconds
+
+        self._lock = threading.Lock()
+        self._paper = _Window(3600)
+        self._duty = _Window(duty_window)
+        self.receipts = 0
+        self.paper_mm = 0.0
+        self.print_seconds = 0.0
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.waiting_since = None
+
+    def estimate(self, data):
+        """
+        Estimate the paper and print time an ESC/POS byte stream takes
+
+        Returns:
+            tuple: (paper in mm, print time in seconds)
+        """
+        receipts = decode(data)
+        paper_mm = sum(receipt.paper_mm for receipt in receipts)
+        return paper_mm, len(receipts) * self.cut_seconds + paper_mm / self.speed_mm_s
+
+    def admit(self, data):
+        """
+        Block until the receipt fits under the ceilings
+
+        Returns:
+            tuple: (paper in mm, print time in seconds) to pass to record() once the receipt is sent
+        """
+        paper_mm, seconds = self.estimate(data)
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = self._delay(now, paper_mm, seconds)
+                if delay <= 0:
+                    self.waiting_since = None
+                    break
+                if self.waiting_since is None:
+                    self.waiting_since = started
+                    self.throttled += 1
+                    logger.info(f"Print budget used up, holding a {paper_mm:.0f} mm receipt for {delay:.0f}s")
+            time.sleep(min(delay, 5))
+        self.throttled_seconds += time.monotonic() - started
+        return paper_mm, seconds
+
+    def record(self, paper_mm, seconds):
+        """Count a receipt admitted by admit() as printed"""
+        with self._lock:
+            now = time.monotonic()
+            self._paper.add(now, paper_mm)
+            self._duty.add(now, seconds)
+            self.receipts += 1
+            self.paper_mm += paper_mm
+            self.print_seconds += seconds
+
+    def _delay(self, now, paper_mm, seconds):
+        self._paper.expire(now)
+        self._duty.expire(now)
+        delay = 0.0
+        if self.paper_mm_per_hour:
+            delay = self._paper.wait_for(now, paper_mm, self.paper_mm_per_hour)
+        if self.duty_cycle < 1:
+            delay = max(delay, self._duty.wait_for(now, seconds, self.duty_cycle * self._duty.seconds))
+        return delay
+
+    def drain_seconds(self, depth):
+        """
+        Projected seconds to print depth more telegrams at the ceilings, from the average receipt so far
+
+        Digests print several telegrams per receipt, so this errs long when the backlog is deep.
+        """
+        if not depth or not self.receipts:
+            return 0.0 if not depth else None
+        with self._lock:
+            now = time.monotonic()
+            self._paper.expire(now)
+            self._duty.expire(now)
+            paper_mm = depth * self.paper_mm / self.receipts
+            seconds = depth * self.print_seconds / self.receipts
+            drain = seconds
+            if self.paper_mm_per_hour:
+                over = paper_mm - max(self.paper_mm_per_hour - self._paper.total, 0)
+                drain = max(drain, over * 3600 / self.paper_mm_per_hour)
+            if self.duty_cycle < 1:
+                over = seconds - max(self.duty_cycle * self._duty.seconds - self._duty.total, 0)
+                drain = max(drain, over / self.duty_cycle)
+        return drain
+
+    def stats(self, depth=0):
+        with self._lock:
+            now = time.monotonic()
+            self._paper.expire(now)
+            self._duty.expire(now)
+            paper_hour = self._paper.total
+            duty = self._duty.total / self._duty.seconds
+            waiting = now - self.waiting_since if self.waiting_since is not None else None
+        drain = self.drain_seconds(depth)
+        return {
+            "receipts": self.receipts,
+            "paper_m": round(self.paper_mm / 1000, 2),
+            "paper_mm_last_hour": round(paper_hour),
+            "paper_mm_per_hour": self.paper_mm_per_hour or None,
+            "paper_mm_remaining": round(max(self.paper_mm_per_hour - paper_hour, 0)) if self.paper_mm_per_hour else None,
+            "duty": round(duty, 3),
+            "duty_cycle": self.duty_cycle,
+            "average_receipt_mm": round(self.paper_mm / self.receipts) if self.receipts else None,
+            "throttled": self.throttled,
+            "throttled_seconds": round(self.throttled_seconds, 1),
+            "waiting_seconds": round(waiting, 1) if waiting is not None else None,
+            "drain_seconds": round(drain, 1) if drain is not None else None,
+        }
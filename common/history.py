@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger('telegramtastic.history')
+
+class PrintHistory:
+    """
+    Searchable record of every telegram that made it onto paper.
+
+    record() is called by the print worker as each job is printed and only
+    appends a row to a buffer. A writer thread inserts the buffer every
+    flush_interval seconds, or as soon as batch_size rows are waiting, in one
+    transaction, and SQLite's triggers add the rows to the full-text index in
+    the same commit. Printing never waits on the database.
+
+    If the database stays unavailable, at most max_pending rows are kept;
+    older ones are dropped from the history and counted.
+    """
+
+    def __init__(self, repo, source, flush_interval=1.0, batch_size=500, max_pending=10000):
+        self.repo = repo
+        self.source = source
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = []
+        self._thread = None
+        self.recorded = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.write_errors = 0
+        self.last_flush_ms = None
+
+    def record(self, job):
+        """Add a printed PrintJob to the history"""
+        row = {
+            "printed_at": time.time(),
+            "received_at": job.received.timestamp() if job.received is not None else None,
+            "from_node": job.from_id,
+            "packet_id": job.packet_id,
+            "short_name": job.frm.short_name,
+            "long_name": job.frm.long_name,
+            "to_name": job.to.long_name if job.to is not None else None,
+            "priority": job.priority,
+            "source": self.source,
+            "text": job.text,
+        }
+        with self._lock:
+            self._pending.append(row)
+            self.recorded += 1
+            if len(self._pending) > self.max_pending:
+                del self._pending[0]
+                self.dropped += 1
+            if len(self._pending) >= self.batch_size:
+                self._wake.set()
+
+    def flush(self):
+        """Insert the waiting rows in one transaction"""
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return 0
+        started = time.perf_counter()
+        if not self.repo.save_batch(rows):
+            # Put them back in front of anything recorded since, for the next attempt
+            with self._lock:
+                self._pending[:0] = rows
+                overflow = len(self._pending) - self.max_pending
+                if overflow > 0:
+                    del self._pending[:overflow]
+                    self.dropped += overflow
+            self.write_errors += 1
+            return 0
+        self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+        self.flushes += 1
+        self.rows_written += len(rows)
+        return len(rows)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "recorded": self.recorded,
+            "pending_writes": pending,
+            "rows_written": self.rows_written,
+            "flushes": self.flushes,
+            "last_flush_ms": self.last_flush_ms,
+            "dropped": self.dropped,
+            "write_errors": self.write_errors,
+        }
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error writing the print history: {e}")
+
+    def start(self):
+        """Start the writer thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="print-history", daemon=True)
+            self._thread.start()
+        return self
@@ -0,0 +1,187 @@
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger('telegramtastic.ledger')
+
+class PrintLedger:
+    """
+    Durable record of every telegram queued for printing, keyed by (from, packet id).
+
+    Each telegram moves through queued, printing and then printed or failed.
+    The latest state of every key is kept in an in-memory index, so "has this
+    packet already been queued?" is a dictionary lookup, and the index is
+    reloaded from the print_ledger table at startup. A broker replay or a
+    duplicate delivery after a restart is therefore recognised and skipped.
+
+    Changes are not written one by one. They collect in a buffer that a
+    writer thread commits every flush_interval seconds, or as soon as
+    batch_size changes are waiting, in a single transaction. Packet handling
+    never waits on an fsync. Several changes to one key between commits
+    become one row.
+
+    Work that must not happen before the ledger is on disk, such as
+    acknowledging a QoS 1 message, is passed to when_durable() and runs
+    after the next commit. If the process dies first, the broker redelivers
+    the message. Entries still queued or printing at startup are returned by
+    unfinished() to be printed again.
+    """
+
+    STATES = ("queued", "printing", "printed", "failed")
+
+    def __init__(self, repo, flush_interval=0.2, batch_size=500, max_entries=100000):
+        self.repo = repo
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._index = OrderedDict()
+        self._pending = {}
+        self._callbacks = []
+        self._flushing = False
+        self._thread = None
+        self.transitions = Counter()
+        self.flushes = 0
+        self.rows_written = 0
+        self.write_errors = 0
+        self.last_flush_ms = None
+
+    def load(self):
+        """Rebuild the in-memory index from the most recent ledger entries"""
+        entries = self.repo.recent(self.max_entries)
+        with self._lock:
+            for from_node, packet_id, state in entries:
+                self._index[(from_node, packet_id)] = state
+        logger.info(f"Loaded {len(entries)} print ledger entries")
+        return self
+
+    def state(self, from_node, packet_id):
+        """The telegram's latest state, or None if it was never queued"""
+        return self._index.get((from_node, packet_id))
+
+    def add(self, from_node, packet_id, priority, payload):
+        """
+        Record a telegram as queued
+
+        Returns:
+            bool: False if the telegram is already in the ledger
+        """
+        key = (from_node, packet_id)
+        now = time.time()
+        with self._lock:
+            if key in self._index:
+                return False
+            self._set(key, "queued")
+            self._pending[key] = {
+                "from_node": from_node, "packet_id": packet_id, "state": "queued", "priority": priority,
+                "payload": payload, "error": None, "created_at": now, "updated_at": now,
+            }
+            self._maybe_wake()
+        return True
+
+    def mark(self, from_node, packet_id, state, error=None):
+        """Record a telegram's move to printing, printed or failed"""
+        key = (from_node, packet_id)
+        now = time.time()
+        with self._lock:
+            self._set(key, state)
+            row = self._pending.get(key)
+            if row is None:
+                # The queued row is already on disk; only the state changes
+                self._pending[key] = {
+                    "from_node": from_node, "packet_id": packet_id, "state": state, "priority": None,
+                    "payload": None, "error": error, "created_at": now, "updated_at": now,
+                }
+            else:
+                row.update(state=state, error=error, updated_at=now)
+            self._maybe_wake()
+
+    def _set(self, key, state):
+        """Update the index (called with the lock held)"""
+        self.transitions[state] += 1
+        self._index[key] = state
+        self._index.move_to_end(key)
+        if len(self._index) > self.max_entries:
+            self._index.popitem(last=False)
+
+    def _maybe_wake(self):
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+
+    def when_durable(self, callback):
+        """Run callback once every change recorded so far has been committed"""
+        with self._lock:
+            if self._pending or self._flushing:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def flush(self):
+        """Commit the waiting changes in one transaction, then run the callbacks waiting on them"""
+        with self._lock:
+            rows, self._pending = self._pending, {}
+            callbacks, self._callbacks = self._callbacks, []
+            self._flushing = True
+        try:
+            if rows:
+                started = time.perf_counter()
+                if not self.repo.save_batch(list(rows.values())):
+                    # Keep the changes, and whatever waits on them, for the next attempt
+                    with self._lock:
+                        for key, row in rows.items():
+                            newer = self._pending.get(key)
+                            if newer is not None:
+                                row.update(state=newer["state"], error=newer["error"], updated_at=newer["updated_at"])
+                            self._pending[key] = row
+                        self._callbacks[:0] = callbacks
+                    self.write_errors += 1
+                    return 0
+                self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+                self.flushes += 1
+                self.rows_written += len(rows)
+        finally:
+            with self._lock:
+                self._flushing = False
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Error in print ledger callback: {e}")
+        return len(rows)
+
+    def unfinished(self):
+        """Telegrams that were queued or printing when the app last stopped"""
+        return self.repo.unfinished()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "pending_writes": len(self._pending),
+                "waiting_callbacks": len(self._callbacks),
+                "transitions": dict(self.transitions),
+                "flushes": self.flushes,
+                "rows_written": self.rows_written,
+                "rows_per_flush": round(self.rows_written / self.flushes, 1) if self.flushes else None,
+                "last_flush_ms": self.last_flush_ms,
+                "write_errors": self.write_errors,
+            }
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error writing the print ledger: {e}")
+
+    def start(self):
+        """Start the writer thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="print-ledger", daemon=True)
+            self._thread.start()
+        return self
@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger('telegramtastic.metrics')
+
+def percentile(values, q):
+    """Return the q-th percentile (0-100) of a list of numbers, or None if empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+class IngestMeter:
+    """
+    Counts ingested MQTT messages and tracks how far behind real time they are.
+
+    Lag is the difference between now and the packet's rx_time, so it grows
+    as soon as messages start waiting in the client or broker buffers.
+    Totals are cumulative; lag and handling time are reported per window,
+    from the last sample_size messages of it, so a window that is never
+    reset doesn't grow without bound.
+    """
+
+    def __init__(self, sample_size=4096):
+        self.sample_size = sample_size
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.received = 0
+        self.processed = 0
+        self.duplicates = 0
+        self.decrypt_failures = 0
+        self.last_received = None
+        self._window_start = time.monotonic()
+        self._window_received = 0
+        self._lags = deque(maxlen=sample_size)
+        self._handle_times = deque(maxlen=sample_size)
+
+    def record_received(self, rx_time=None, handle_time=None):
+        """Record one envelope received from the broker"""
+        with self._lock:
+            self.received += 1
+            self.last_received = time.time()
+            self._window_received += 1
+            if rx_time:
+                self._lags.append(time.time() - rx_time)
+            if handle_time is not None:
+                self._handle_times.append(handle_time)
+
+    def record_processed(self):
+        """Record one unique packet that passed duplicate filtering"""
+        with self._lock:
+            self.processed += 1
+
+    def record_duplicate(self):
+        with self._lock:
+            self.duplicates += 1
+
+    def record_decrypt_failure(self):
+        with self._lock:
+            self.decrypt_failures += 1
+
+    def snapshot(self, reset=True):
+        """Return cumulative counters plus rate and lag for the current window"""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = max(now - self._window_start, 1e-9)
+            lags, handle_times = self._lags, self._handle_times
+            window_received = self._window_received
+            stats = {
+                "timestamp": time.time(),
+                "uptime": round(time.time() - self.started, 1),
+                "received": self.received,
+                "processed": self.processed,
+                "duplicates": self.duplicates,
+                "decrypt_failures": self.decrypt_failures,
+                "last_message_age": round(time.time() - self.last_received, 3) if self.last_received else None,
+            }
+            if reset:
+                self._window_start = now
+                self._window_received = 0
+                self._lags = deque(maxlen=self.sample_size)
+                self._handle_times = deque(maxlen=self.sample_size)
+        stats.update({
+            "window_seconds": round(elapsed, 2),
+            "rate": round(window_received / elapsed, 2),
+            "lag_p50": percentile(lags, 50),
+            "lag_p95": percentile(lags, 95),
+            "lag_max": max(lags) if lags else None,
+            "handle_ms_p95": round(percentile(handle_times, 95) * 1000, 3) if handle_times else None,
+        })
+        return stats
@@ -0,0 +1,60 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger('telegramtastic.nodecache')
+
+class NodeCache:
+    """
+    LRU cache of node names in front of the database.
+
+    Misses are loaded through loader(node_id), which returns a
+    (short_name, long_name) tuple or None for unknown nodes. Unknown nodes are
+    remembered for negative_ttl seconds. Callers must put() fresh names
+    whenever they store them.
+    """
+
+    def __init__(self, loader, max_size=10000, negative_ttl=60):
+        self.loader = loader
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, node_id):
+        """Return (short_name, long_name) for a node, or None if it is unknown"""
+        with self._lock:
+            entry = self._entries.get(node_id)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                self._entries.move_to_end(node_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        names = self.loader(node_id)
+        self.put(node_id, *(names or (None, None)))
+        return names
+
+    def put(self, node_id, short_name, long_name):
+        """Insert or refresh a node's names"""
+        if short_name is None and long_name is None:
+            entry = (None, time.monotonic() + self.negative_ttl)
+        else:
+            entry = ((short_name, long_name), None)
+        with self._lock:
+            self._entries[node_id] = entry
+            self._entries.move_to_end(node_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
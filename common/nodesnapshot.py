@@ -0,0 +1,244 @@
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+logger = logging.getLogger('telegramtastic.nodesnapshot')
+
+# magic, version, reserved, node count, string table bytes, created (Unix time)
+HEADER = struct.Struct("<4sHHIId")
+MAGIC = b"TTNS"
+VERSION = 1
+# Offset standing for a missing name
+NO_NAME = 0xFFFFFFFF
+
+def write_snapshot(path, rows):
+    """
+    Write node names to a snapshot file, replacing any previous one atomically
+
+    The file is a header, the node IDs as a sorted array of little-endian
+    uint32, two uint32 offsets per node (short and long name) into a string
+    table, and the string table, where each distinct name is stored once as a
+    uint16 length and UTF-8 bytes.
+
+    Args:
+        path (str): File to write
+        rows (iterable): (node_id, short_name, long_name) tuples in node_id order
+
+    Returns:
+        int: Number of nodes written
+    """
+    ids = array("I")
+    offsets = array("I")
+    strings = bytearray()
+    interned = {}
+
+    def intern(name):
+        if name is None:
+            return NO_NAME
+        offset = interned.get(name)
+        if offset is None:
+            encoded = name.encode("utf-8")[:0xFFFF]
+            offset = interned[name] = len(strings)
+            strings.extend(struct.pack("<H", len(encoded)))
+            strings.extend(encoded)
+        return offset
+
+    last = -1
+    for node_id, short_name, long_name in rows:
+        if not 0 <= node_id <= 0xFFFFFFFF:
+            continue
+        if node_id <= last:
+            raise ValueError(f"Node {node_id} is out of order, rows must be sorted by node_id")
+        last = node_id
+        ids.append(node_id)
+        offsets.append(intern(short_name))
+        offsets.append(intern(long_name))
+    if sys.byteorder == "big":
+        ids.byteswap()
+        offsets.byteswap()
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(ids), len(strings), time.time()))
+        f.write(ids.tobytes())
+        f.write(offsets.tobytes())
+        f.write(strings)
+    os.replace(temp_path, path)
+    return len(ids)
+
+class NodeSnapshot:
+    """
+    Node names from a snapshot file, memory-mapped rather than read.
+
+    Opening one costs a few system calls whatever its size, and the pages
+    are read in the background as the kernel prefetches them, so lookups
+    are warm from the start. A lookup is a binary search over the ID array
+    and decodes only the two names it returns.
+    """
+
+    def __init__(self, path, mapped):
+        self.path = path
+        self._mmap = mapped
+        magic, version, _, count, strings_size, self.created = HEADER.unpack_from(mapped)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} node snapshot")
+        ids_end = HEADER.size + count * 4
+        self._strings = ids_end + count * 8
+        if len(mapped) < self._strings + strings_size:
+            raise ValueError(f"{path} is truncated")
+        view = memoryview(mapped)
+        self._ids = view[HEADER.size:ids_end].cast("I")
+        self._offsets = view[ids_end:self._strings].cast("I")
+
+    @classmethod
+    def open(cls, path):
+        """Map a snapshot file, returning None if it is missing or unreadable"""
+        if sys.byteorder != "little":
+            logger.warning("Node snapshots are little-endian and can't be mapped on this machine")
+            return None
+        try:
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"Could not map node snapshot {path}: {e}")
+            return None
+        try:
+            snapshot = cls(path, mapped)
+        except (ValueError, struct.error) as e:
+            logger.warning(f"Ignoring node snapshot {path}: {e}")
+            return None
+        if hasattr(mapped, "madvise"):
+            mapped.madvise(mmap.MADV_WILLNEED)
+        return snapshot
+
+    def _name(self, offset):
+        if offset == NO_NAME:
+            return None
+        start = self._strings + offset
+        length = struct.unpack_from("<H", self._mmap, start)[0]
+        return self._mmap[start + 2:start + 2 + length].decode("utf-8", errors="replace")
+
+    def get(self, node_id):
+        """Return (short_name, long_name) for a node, or None if it isn't in the snapshot"""
+        ids = self._ids
+        index = bisect_left(ids, node_id)
+        if index == len(ids) or ids[index] != node_id:
+            return None
+        return (self._name(self._offsets[index * 2]), self._name(self._offsets[index * 2 + 1]))
+
+    def __len__(self):
+        return len(self._ids)
+
+class NodeSnapshotter:
+    """
+    Keeps a node name snapshot for instant lookups after a restart.
+
+    The snapshot is mapped when this is created, so names resolve as soon as
+    the app starts instead of every sender printing as UNK until the
+    database is queried or it announces itself again. Every interval seconds,
+    and by write() at shutdown, the node table is read through rows() and
+    written to a new snapshot, which is then swapped in. The snapshot sits
+    between the node cache and the database. Nodes whose names are saved
+    after the snapshot was written are passed to invalidate(), and are
+    looked up in the database until the next write.
+    """
+
+    def __init__(self, path, rows, interval=600):
+        self.path = path
+        self.rows = rows
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self.writes = 0
+        self.last_write_ms = None
+        self.hits = 0
+        self.misses = 0
+        # Nodes saved since the snapshot was written
+        self._stale = set()
+        started = time.perf_counter()
+        self.snapshot = NodeSnapshot.open(path)
+        self.open_ms = round((time.perf_counter() - started) * 1000, 2)
+        if self.snapshot is not None:
+            logger.info(f"Mapped {len(self.snapshot)} node names from {path} in {self.open_ms} ms")
+
+    def get(self, node_id):
+        """Return (short_name, long_name) from the snapshot, or None"""
+        snapshot = self.snapshot
+        names = snapshot.get(node_id) if snapshot is not None and node_id not in self._stale else None
+        if names is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return names
+
+    def invalidate(self, node_id, names=None):
+        """
+        Stop answering for a node whose names have been saved since the snapshot was written
+
+        Args:
+            node_id (int): Node saved to the database
+            names (tuple): The saved (short_name, long_name); a node the snapshot already has them for is left alone
+        """
+        snapshot = self.snapshot
+        if snapshot is None or (names is not None and snapshot.get(node_id) == tuple(names)):
+            return
+        self._stale.add(node_id)
+
+    def write(self):
+        """Write the node table to a new snapshot and swap it in"""
+        with self._lock:
+            started = time.perf_counter()
+            # Saved before the table is read, so the new snapshot has them
+            written = set(self._stale)
+            count = write_snapshot(self.path, self.rows())
+            # The old mapping is released once no lookup is using it
+            self.snapshot = NodeSnapshot.open(self.path)
+            self._stale -= written
+            self.writes += 1
+            self.last_write_ms = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"Wrote {count} node names to {self.path} in {self.last_write_ms} ms")
+        return count
+
+    def stats(self):
+        snapshot = self.snapshot
+        return {
+            "path": self.path,
+            "nodes": len(snapshot) if snapshot is not None else 0,
+            "age": round(time.time() - snapshot.created, 1) if snapshot is not None else None,
+            "open_ms": self.open_ms,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": len(self._stale),
+            "writes": self.writes,
+            "last_write_ms": self.last_write_ms,
+        }
+
+    def _loop(self):
+        if self.snapshot is None:
+            # Nothing to start from next time; write one now rather than after a full interval
+            self._write_logged()
+        while True:
+            time.sleep(self.interval)
+            self._write_logged()
+
+    def _write_logged(self):
+        try:
+            self.write()
+        except Exception as e:
+            logger.error(f"Error writing node snapshot: {e}")
+
+    def start(self):
+        """Start rewriting the snapshot every interval seconds"""
+        if self._thread is None and self.interval:
+            self._thread = threading.Thread(target=self._loop, name="node-snapshot", daemon=True)
+            self._thread.start()
+        return self
@@ -0,0 +1,129 @@
+from cryptography.hazmat.primitives.ciphers import Cipher, modes
+from meshtastic import mesh_pb2, mqtt_pb2, protocols
+
+_UNSET = object()
+
+def decrypt_data(packet_id, from_id, encrypted, key):
+    """
+    Decrypt a MeshPacket's encrypted payload into a Data message
+
+    Args:
+        packet_id (int): The packet ID, half of the AES-CTR nonce
+        from_id (int): The sending node, the other half of the nonce
+        encrypted (bytes): The encrypted payload
+        key (algorithms.AES): The channel key, or None
+
+    Returns:
+        mesh_pb2.Data: The decoded Data, or None if there is no key or the bytes don't parse
+    """
+    if key is None:
+        return None
+    try:
+        # Build the nonce from message ID and sender
+        nonce = packet_id.to_bytes(8, "little") + from_id.to_bytes(8, "little")
+        decryptor = Cipher(key, modes.CTR(nonce)).decryptor()
+        data = mesh_pb2.Data()
+        data.ParseFromString(decryptor.update(encrypted) + decryptor.finalize())
+        return data
+    except Exception:
+        return None
+
+class PacketView:
+    """
+    One ServiceEnvelope from the broker, decoded only as far as it is read.
+
+    The envelope is parsed once when the view is built, and the header fields
+    every stage needs (from, to, id, channel and gateway) are copied into
+    slots, since reading a field from a protobuf message costs far more than
+    reading an attribute. Everything else is left alone until asked for:
+
+    - data decrypts the payload on first access, with the key for the
+      envelope's channel, into a Data message that is kept on the view
+      rather than copied back into the packet. Plain packets use the
+      packet's own decoded field.
+    - app parses data.payload with the port's protobuf type, once.
+
+    Duplicates dropped before anything reads data are never decrypted. The
+    same view is passed from stage to stage, so nothing is parsed twice.
+    raw is the message bytes exactly as received from the client, never
+    copied, for stages that keep or forward the envelope.
+    """
+
+    __slots__ = ("raw", "envelope", "packet", "from_id", "to", "id", "channel_id", "gateway_id",
+                 "decrypted", "_keys", "_data", "_portnum", "_app")
+
+    def __init__(self, raw, keys=None):
+        """
+        Args:
+            raw (bytes): The serialized ServiceEnvelope
+            keys (dict): AES keys by channel name, with "*" as the default
+        """
+        self.raw = raw
+        self.envelope = mqtt_pb2.ServiceEnvelope()
+        self.envelope.ParseFromString(raw)
+        self.packet = packet = self.envelope.packet
+        self.from_id = getattr(packet, "from")
+        self.to = packet.to
+        self.id = packet.id
+        self.channel_id = self.envelope.channel_id
+        self.gateway_id = self.envelope.gateway_id
+        # None until data is read, then whether the payload had to be decrypted and was
+        self.decrypted = None
+        self._keys = keys
+        self._data = _UNSET
+        self._portnum = None
+        self._app = _UNSET
+
+    @property
+    def encrypted(self):
+        """True if the payload arrived encrypted"""
+        return self.packet.WhichOneof("payload_variant") == "encrypted"
+
+    @property
+    def data(self):
+        """The decoded Data message, or None if it could not be decrypted"""
+        if self._data is _UNSET:
+            data = None
+            variant = self.packet.WhichOneof("payload_variant")
+            if variant == "decoded":
+                data = self.packet.decoded
+                self.decrypted = False
+            elif variant == "encrypted":
+                keys = self._keys or {}
+                data = decrypt_data(self.id, self.from_id, self.packet.encrypted,
+                                    keys.get(self.channel_id) or keys.get("*"))
+                self.decrypted = data is not None
+            self._data = data
+            self._portnum = data.portnum if data is not None else None
+        return self._data
+
+    @property
+    def portnum(self):
+        """The port number as an int, or None if there is no decoded payload"""
+        if self._data is _UNSET:
+            self.data
+        return self._portnum
+
+    @property
+    def payload(self):
+        """The app payload bytes, or None if there is no decoded payload"""
+        data = self.data
+        return data.payload if data is not None else None
+
+    @property
+    def handler(self):
+        """The meshtastic protocol entry for the port, or None"""
+        portnum = self.portnum
+        return protocols.get(portnum) if portnum else None
+
+    @property
+    def app(self):
+        """The app payload parsed with the port's protobuf type, or None if the port has none"""
+        if self._app is _UNSET:
+            app = None
+            handler = self.handler
+            if handler is not None and handler.protobufFactory is not None:
+                app = handler.protobufFactory()
+                app.ParseFromString(self._data.payload)
+            self._app = app
+        return self._app
@@ -0,0 +1,108 @@
+import logging
+
+from escpos.printer import Dummy, Network, Usb
+
+logger = logging.getLogger('telegramtastic.printers')
+
+def send_receipt(printer, draw, jobs=(), governor=None, store=None):
+    """
+    Draw a receipt into memory and send it to the printer in one write
+
+    Args:
+        printer (Escpos): The printer to send the receipt to
+        draw (callable): Called with an escpos Dummy to draw the receipt into
+        jobs (list): The PrintJobs on the receipt
+        governor (PrintGovernor): Waits for the paper and print time budget before sending, and is charged once sent
+        store (ReceiptStore): Keeps the receipt's bytes for reprints
+    """
+    buffer = Dummy()
+    draw(buffer)
+    data = buffer.output
+    if governor is not None:
+        cost = governor.admit(data)
+    printer._raw(data)
+    if governor is not None:
+        governor.record(*cost)
+    if store is not None:
+        store.add(jobs, data)
+
+class PrinterTarget:
+    """
+    Where to find a printer: a network printer by host and port, or a USB
+    printer by device or vendor and product ID.
+
+    Written as "host[:port]", "usb:DEVICE" or "usb:VID:PID" with the IDs in
+    hex, e.g. "192.168.1.50:9100", "usb:/dev/usb/lp0" or "usb:04b8:0202".
+    """
+
+    def __init__(self, kind, host=None, port=9100, device=None, vendor_id=None, product_id=None):
+        self.kind = kind
+        self.host = host
+        self.port = port
+        self.device = device
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+
+    @classmethod
+    def parse(cls, value, default_port=9100):
+        """Parse a "host[:port]", "usb:DEVICE" or "usb:VID:PID" string, raising ValueError if it is invalid"""
+        value = (value or "").strip()
+        if not value:
+            raise ValueError("Empty printer target")
+        if value.lower().startswith("usb:"):
+            rest = value[4:]
+            vendor, sep, product = rest.partition(":")
+            if sep and not rest.startswith("/"):
+                return cls("usb", vendor_id=int(vendor, 16), product_id=int(product, 16))
+            return cls("usb", device=rest)
+        host, _, port = value.partition(":")
+        return cls("network", host=host, port=int(port) if port else default_port)
+
+    @classmethod
+    def from_env(cls, printer_type, ip=None, port=9100, usb_device=None, usb_vendor_id=None, usb_product_id=None):
+        """The printer configured by the PRINTER_* settings, raising ValueError if they are incomplete"""
+        if printer_type == "network":
+            if not ip:
+                raise ValueError("PRINTER_IP not set for network printer")
+            return cls("network", host=ip, port=port)
+        if printer_type == "usb":
+            if usb_device:
+                return cls("usb", device=usb_device)
+            if usb_vendor_id and usb_product_id:
+                # Convert hex strings to integers
+                return cls("usb", vendor_id=int(usb_vendor_id, 16), product_id=int(usb_product_id, 16))
+            raise ValueError("USB printer requires either PRINTER_USB_DEVICE or both PRINTER_USB_VENDOR_ID and PRINTER_USB_PRODUCT_ID")
+        raise ValueError(f"Invalid PRINTER_TYPE: {printer_type}. Must be 'network' or 'usb'")
+
+    def open(self, timeout=5, reset=True):
+        """Connect to the printer and, unless reset is False, reset it to its defaults; raises an exception if that fails"""
+        logger.info(f"Connecting to {self.description()}...")
+        if self.kind == "network":
+            printer = Network(self.host, port=self.port, timeout=timeout)
+        elif self.device:
+            printer = Usb(self.device)
+        else:
+            printer = Usb(self.vendor_id, self.product_id)
+        if reset:
+            printer.set_with_default()
+        return printer
+
+    def description(self):
+        if self.kind == "network":
+            return f"network printer at {self.host}:{self.port}"
+        if self.device:
+            return f"USB printer at device {self.device}"
+        return f"USB printer (VID: {hex(self.vendor_id)}, PID: {hex(self.product_id)})"
+
+    def __str__(self):
+        if self.kind == "network":
+            return f"{self.host}:{self.port}"
+        if self.device:
+            return f"usb:{self.device}"
+        return f"usb:{self.vendor_id:04x}:{self.product_id:04x}"
+
+    def __eq__(self, other):
+        return isinstance(other, PrinterTarget) and str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
@@ -0,0 +1,586 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from types import SimpleNamespace
+
+logger = logging.getLogger('telegramtastic.printqueue')
+
+class PrintJob:
+    """A telegram waiting to be printed"""
+
+    def __init__(self, frm, text, to=None, received=None, on_printed=None, packet_id=None, priority=None, from_id=None,
+                 on_failed=None):
+        self.frm = frm
+        self.to = to
+        self.text = text
+        self.received = received or datetime.now().astimezone()
+        self.enqueued = time.monotonic()
+        # Optional callbacks run after the job has been printed, or with the error once it has failed for good
+        self.on_printed = on_printed
+        self.on_failed = on_failed
+        self.packet_id = packet_id
+        # PrintScheduler class name, e.g. "admin", "dm" or "channel"
+        self.priority = priority
+        # Sender node ID, which with packet_id identifies the telegram in the print ledger
+        self.from_id = from_id
+        # Failed print attempts so far
+        self.attempts = 0
+
+SHED_POLICIES = ("drop-oldest", "drop-lowest-priority", "defer")
+
+class PrintClass:
+    """A priority class of telegrams with its scheduling weight and queue cap (0 = unbounded)"""
+
+    def __init__(self, name, weight=1, cap=0):
+        self.name = name
+        self.weight = max(1, weight)
+        self.cap = cap
+        self.jobs = deque()
+        # Smooth weighted round-robin credit
+        self.credit = 0
+
+def parse_class_config(weights, caps=""):
+    """
+    Build PrintClasses from "name=value" lists, e.g. "admin=8,dm=4,channel=1".
+
+    Classes are ordered highest priority first, in the order they are listed
+    in weights. Caps for unlisted classes default to 0 (unbounded).
+    """
+    def parse(value):
+        pairs = {}
+        for item in filter(None, (part.strip() for part in value.split(","))):
+            name, _, number = item.partition("=")
+            pairs[name.strip()] = int(number)
+        return pairs
+
+    cap_map = parse(caps or "")
+    return [PrintClass(name, weight, cap_map.get(name, 0)) for name, weight in parse(weights).items()]
+
+class PrintScheduler:
+    """
+    Weighted priority queues in front of the printer, with load shedding.
+
+    Each job is filed under job.priority. The worker takes jobs using smooth
+    weighted round-robin across the classes that have work, so a class with
+    weight 8 gets 8 receipts for every 1 from a class with weight 1, and no
+    class with work waiting is ever starved.
+
+    When a job arrives for a class that is at its cap, or the scheduler holds
+    max_pending jobs, the shedding policy decides what gives:
+
+        drop-oldest           drop the longest-waiting job (the class's own
+                              when it is at its cap)
+        drop-lowest-priority  drop the newest job of the lowest-priority class
+                              that has work, which may be the arriving job
+        defer                 write the arriving job to a spool file on disk
+                              and load it back once the backlog drains
+
+    Jobs in higher-priority classes are never dropped to make room for lower
+    ones, so a flood of channel traffic cannot push out admin telegrams.
+
+    Telegrams left in the spool by a previous run are loaded back too, unless
+    resume_spool is False because something else, such as the print ledger,
+    prints them again. The old spool is then discarded so nothing prints twice.
+    """
+
+    def __init__(self, classes, policy="drop-oldest", max_pending=0, spool_path=None, resume_spool=True):
+        if policy not in SHED_POLICIES:
+            raise ValueError(f"Unknown shedding policy {policy!r}, expected one of {', '.join(SHED_POLICIES)}")
+        if policy == "defer" and not spool_path:
+            raise ValueError("The defer shedding policy needs a spool path")
+        self.classes = {cls.name: cls for cls in classes}
+        self._rank = {cls.name: rank for rank, cls in enumerate(classes)}
+        self.policy = policy
+        # Without an explicit limit, the backlog is bounded by the class caps,
+        # unless one of the classes is unbounded
+        if not max_pending and all(cls.cap for cls in classes):
+            max_pending = sum(cls.cap for cls in classes)
+        self.max_pending = max_pending
+        self.spool_path = spool_path
+
+        self._cond = threading.Condition()
+        self._pending = 0
+        # Jobs taken by the worker and not yet reported done()
+        self._active = 0
+        # Called with each job that is dropped to shed load
+        self.on_drop = None
+        self.dropped = Counter()
+        self.deferred = Counter()
+        self.taken = Counter()
+
+        # Spooled jobs live on disk; only their (on_printed, on_failed)
+        # callbacks, which cannot be serialized, are kept in memory until the
+        # job is reloaded
+        self._spooled = 0
+        self._spool_offset = 0
+        self._spool_callbacks = {}
+        # Seeded from the clock so records left over from a previous run never
+        # pick up a callback registered in this one
+        self._spool_seq = time.time_ns()
+        if spool_path:
+            os.makedirs(os.path.dirname(spool_path) or ".", exist_ok=True)
+            if not resume_spool:
+                left = self._count_spool()
+                if left:
+                    os.remove(spool_path)
+                    logger.info(f"Discarded {left} deferred telegrams in {spool_path}, they are printed from the ledger")
+            self._spooled = self._count_spool()
+            if self._spooled:
+                logger.info(f"Found {self._spooled} deferred telegrams in {spool_path}")
+
+    def requeue(self, jobs):
+        """Put jobs back at the head of their classes, e.g. after a failed print, ignoring the caps"""
+        with self._cond:
+            for job in reversed(jobs):
+                self._class_for(job).jobs.appendleft(job)
+                self._pending += 1
+            self._cond.notify()
+
+    def _class_for(self, job):
+        name = getattr(job, "priority", None)
+        if name in self.classes:
+            return self.classes[name]
+        # Unknown classes are treated as the lowest priority
+        return list(self.classes.values())[-1]
+
+    def put(self, job):
+        """
+        Queue a job, shedding load if its class or the scheduler is full.
+
+        Returns:
+            bool: True if the job was queued or deferred, False if it was dropped
+        """
+        with self._cond:
+            cls = self._class_for(job)
+            class_full = cls.cap and len(cls.jobs) >= cls.cap
+            total_full = self.max_pending and self._pending >= self.max_pending
+            if class_full or total_full:
+                if self.policy == "defer":
+                    return self._defer(job, cls)
+                if not self._shed(job, cls, class_full):
+                    return False
+            cls.jobs.append(job)
+            self._pending += 1
+            self._cond.notify()
+            return True
+
+    def _shed(self, job, cls, class_full):
+        """Make room for job by dropping a job; return False if job itself was dropped"""
+        if class_full:
+            candidates = [cls]
+        else:
+            # Only classes at or below the arriving job's priority may lose a job
+            candidates = [c for c in self.classes.values()
+                          if c.jobs and self._rank[c.name] >= self._rank[cls.name]]
+
+        if self.policy == "drop-oldest":
+            victim_cls = min(candidates, key=lambda c: c.jobs[0].enqueued, default=None)
+            if victim_cls is None:
+                self._drop(job, cls)
+                return False
+            self._drop(victim_cls.jobs.popleft(), victim_cls)
+        else:
+            victim_cls = max(candidates, key=lambda c: self._rank[c.name], default=None)
+            if victim_cls is None or victim_cls is cls:
+                # The arriving job is the newest job of the lowest-priority class
+                self._drop(job, cls)
+                return False
+            self._drop(victim_cls.jobs.pop(), victim_cls)
+        self._pending -= 1
+        return True
+
+    def _drop(self, job, cls):
+        self.dropped[cls.name] += 1
+        if self.on_drop is not None:
+            self.on_drop(job)
+        logger.debug(f"Print backlog full, dropped {cls.name} telegram from {getattr(job.frm, 'short_name', job.frm)}")
+
+    def _defer(self, job, cls):
+        """Write job to the spool, dropping it if that fails; return True if it was spooled"""
+        self._spool_seq += 1
+        record = {
+            "seq": self._spool_seq,
+            "priority": cls.name,
+            "frm": [job.frm.short_name, job.frm.long_name],
+            "to": [job.to.short_name, job.to.long_name] if job.to is not None else None,
+            "text": job.text,
+            "received": job.received.isoformat(),
+            "packet_id": job.packet_id,
+            "from_id": job.from_id,
+        }
+        try:
+            with open(self.spool_path, "a", encoding="utf-8") as fp:
+                fp.write(json.dumps(record) + "\n")
+        except OSError as e:
+            self._drop(job, cls)
+            logger.error(f"Unable to defer telegram to {self.spool_path}: {e}")
+            return False
+        if job.on_printed is not None or job.on_failed is not None:
+            self._spool_callbacks[self._spool_seq] = (job.on_printed, job.on_failed)
+        self._spooled += 1
+        self.deferred[cls.name] += 1
+        logger.debug(f"Print backlog full, deferred {cls.name} telegram to disk ({self._spooled} spooled)")
+        return True
+
+    def _count_spool(self):
+        try:
+            with open(self.spool_path, "rb") as fp:
+                return sum(1 for line in fp if line.strip())
+        except FileNotFoundError:
+            return 0
+
+    def _reload_spool(self):
+        """Move spooled jobs back into memory once the backlog has drained (called with the lock held)"""
+        if not self._spooled or (self.max_pending and self._pending > self.max_pending // 2):
+            return
+        loaded = 0
+        with open(self.spool_path, "r", encoding="utf-8") as fp:
+            fp.seek(self._spool_offset)
+            while not self.max_pending or self._pending < self.max_pending:
+                line = fp.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    self._spool_offset = fp.tell()
+                    continue
+                record = json.loads(line)
+                cls = self.classes.get(record["priority"]) or list(self.classes.values())[-1]
+                if cls.cap and len(cls.jobs) >= cls.cap:
+                    # Keep spool order: wait until this job's class has room
+                    break
+                self._spool_offset = fp.tell()
+                on_printed, on_failed = self._spool_callbacks.pop(record.get("seq"), (None, None))
+                cls.jobs.append(PrintJob(
+                    SimpleNamespace(short_name=record["frm"][0], long_name=record["frm"][1]),
+                    record["text"],
+                    to=SimpleNamespace(short_name=record["to"][0], long_name=record["to"][1]) if record["to"] else None,
+                    received=datetime.fromisoformat(record["received"]),
+                    on_printed=on_printed,
+                    on_failed=on_failed,
+                    packet_id=record["packet_id"],
+                    priority=cls.name,
+                    from_id=record.get("from_id"),
+                ))
+                self._pending += 1
+                self._spooled -= 1
+                loaded += 1
+        if self._spooled <= 0:
+            # Everything is back in memory; start a fresh spool file
+            self._spooled = 0
+            self._spool_offset = 0
+            os.remove(self.spool_path)
+        if loaded:
+            logger.info(f"Reloaded {loaded} deferred telegrams, {self._spooled} still spooled")
+
+    def _take(self):
+        """Pick the next job by smooth weighted round-robin (called with the lock held)"""
+        active = [cls for cls in self.classes.values() if cls.jobs]
+        if not active:
+            return None
+        total = sum(cls.weight for cls in active)
+        for cls in active:
+            cls.credit += cls.weight
+        chosen = max(active, key=lambda cls: cls.credit)
+        chosen.credit -= total
+        self._pending -= 1
+        self._active += 1
+        self.taken[chosen.name] += 1
+        return chosen.jobs.popleft()
+
+    def get(self, timeout=None):
+        """Block until a job is available and return it"""
+        with self._cond:
+            while True:
+                self._reload_spool()
+                job = self._take()
+                if job is not None:
+                    return job
+                if not self._cond.wait(timeout=timeout if timeout is not None else 1.0) and timeout is not None:
+                    return None
+
+    def get_nowait(self):
+        """Return the next job, or None if nothing is waiting"""
+        with self._cond:
+            self._reload_spool()
+            return self._take()
+
+    def done(self, count=1):
+        """Record that count taken jobs have been printed, failed or put back with requeue()"""
+        with self._cond:
+            self._active -= count
+            self._cond.notify_all()
+
+    def idle(self):
+        """True when no job is waiting in memory or being printed"""
+        with self._cond:
+            return not self._pending and not self._active
+
+    def depth(self):
+        """Number of jobs waiting in memory"""
+        return self._pending
+
+    def oldest_age(self):
+        """Seconds the longest-waiting in-memory job has been queued, or None"""
+        with self._cond:
+            oldest = min((cls.jobs[0].enqueued for cls in self.classes.values() if cls.jobs), default=None)
+        return time.monotonic() - oldest if oldest is not None else None
+
+    def stats(self):
+        with self._cond:
+            return {
+                "policy": self.policy,
+                "max_pending": self.max_pending,
+                "spooled": self._spooled,
+                "classes": {
+                    name: {
+                        "weight": cls.weight,
+                        "cap": cls.cap,
+                        "pending": len(cls.jobs),
+                        "taken": self.taken[name],
+                        "dropped": self.dropped[name],
+                        "deferred": self.deferred[name],
+                    } for name, cls in self.classes.items()
+                },
+            }
+
+class PrintQueue:
+    """
+    Background print worker with adaptive digest batching.
+
+    Telegrams are printed one receipt per message while the printer keeps up.
+    Once the pending backlog reaches digest_threshold, up to digest_max queued
+    telegrams are rendered onto one receipt with a single header and cut.
+    A digest_threshold of 0 disables batching.
+
+    Jobs are ordered by a PrintScheduler; without one, every job shares a
+    single unbounded first-come, first-served class.
+
+    on_state(job, state, error) is called as each job starts "printing" and
+    when it is "printed" or has "failed", including when the scheduler drops
+    it to shed load.
+
+    With connect, a callable that opens the printer, the worker reopens the
+    printer after a failed print, and while it cannot be opened holds the
+    next receipt and retries every reconnect_interval seconds; jobs arriving
+    meanwhile wait in the scheduler, which sheds load as usual. The jobs of
+    the failed receipt go back to the head of their classes, "queued" again,
+    until they have failed max_attempts times. Without connect, a failed or
+    missing printer fails the jobs, as when another instance owns it.
+
+    governor is the PrintGovernor the print functions send receipts through,
+    if any; its paper budget and projected drain time are part of stats().
+    """
+
+    def __init__(self, printer, print_single, print_digest=None, digest_threshold=0, digest_max=5, stats_interval=300,
+                 scheduler=None, on_state=None, connect=None, reconnect_interval=5, name=None, governor=None,
+                 max_attempts=3):
+        self.printer = printer
+        self.governor = governor
+        self.connect = connect
+        self.reconnect_interval = reconnect_interval
+        self.max_attempts = max_attempts
+        self.name = name
+        self.print_single = print_single
+        self.print_digest = print_digest
+        self.digest_threshold = digest_threshold if print_digest is not None else 0
+        self.digest_max = max(2, digest_max)
+        self.stats_interval = stats_interval
+
+        self.scheduler = scheduler or PrintScheduler([PrintClass("default")])
+        self.on_state = on_state
+        self.scheduler.on_drop = lambda job: self._fail([job], "dropped to shed load")
+        self._thread = None
+        self._started = time.monotonic()
+        self._last_report = self._started
+
+        # Receipts printed, keyed by number of telegrams on the receipt
+        self.batch_sizes = Counter()
+        self.printed = 0
+        self.failed = 0
+        self.retried = 0
+        self.reconnects = 0
+        self.offline_since = None
+
+    def start(self):
+        """Start the print worker thread"""
+        if self._thread is None:
+            name = f"print-worker-{self.name}" if self.name else "print-worker"
+            self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, job):
+        """
+        Queue a job for printing
+
+        Returns:
+            bool: False if the scheduler dropped the job to shed load
+        """
+        return self.scheduler.put(job)
+
+    def depth(self):
+        """Number of jobs waiting to be printed"""
+        return self.scheduler.depth()
+
+    def oldest_age(self):
+        """Seconds the oldest waiting job has been queued, or None if the queue is empty"""
+        return self.scheduler.oldest_age()
+
+    def alive(self):
+        """True while the print worker thread is running"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def drain(self, timeout=30):
+        """
+        Wait for the jobs in memory to be printed, e.g. before exiting
+
+        Deferred jobs are left in the spool, which the next run loads.
+
+        Returns:
+            bool: True if nothing is left to print in memory
+        """
+        deadline = time.monotonic() + timeout
+        while not self.scheduler.idle():
+            if not self.alive() or time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def stats(self):
+        """Return printing counters and the batch sizes used so far"""
+        minutes = max(time.monotonic() - self._started, 1) / 60
+        stats = {
+            "printed": self.printed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "pending": self.depth(),
+            "oldest_job_age": self.oldest_age(),
+            "receipts": sum(self.batch_sizes.values()),
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "messages_per_minute": round(self.printed / minutes, 2),
+            "reconnects": self.reconnects,
+            "offline_seconds": round(time.monotonic() - self.offline_since, 1) if self.offline_since is not None else None,
+            "scheduler": self.scheduler.stats(),
+        }
+        if self.governor is not None:
+            stats["governor"] = self.governor.stats(self.depth())
+        return stats
+
+    def _next_batch(self):
+        """Block for the next job, then take more if the backlog is large enough to digest"""
+        batch = [self.scheduler.get()]
+        if self.digest_threshold and self.scheduler.depth() + 1 >= self.digest_threshold:
+            while len(batch) < self.digest_max:
+                job = self.scheduler.get_nowait()
+                if job is None:
+                    break
+                batch.append(job)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._print_batch(batch)
+            finally:
+                self.scheduler.done(len(batch))
+            self._maybe_report()
+
+    def _print_batch(self, batch):
+        if self.printer is None and self.connect is not None:
+            self._wait_for_printer()
+        if self.printer is None:
+            # No printer to drive, e.g. another instance owns it
+            self.failed += len(batch)
+            self._fail(batch, "no printer connected")
+            logger.warning(f"No printer connected, dropped {len(batch)} telegram(s)")
+            return
+        self._notify(batch, "printing")
+        try:
+            if len(batch) == 1:
+                self.print_single(batch[0], self.printer)
+            else:
+                logger.info(f"Print backlog at {self.depth() + len(batch)}, printing digest of {len(batch)} telegrams")
+                self.print_digest(batch, self.printer)
+            self.batch_sizes[len(batch)] += 1
+            self.printed += len(batch)
+            self._notify(batch, "printed")
+            for job in batch:
+                if job.on_printed is not None:
+                    try:
+                        job.on_printed(job)
+                    except Exception as e:
+                        logger.warning(f"Error in print callback: {e}")
+        except Exception as e:
+            logger.error(f"Error printing {len(batch)} telegram(s){self._label()}: {e}")
+            retry = []
+            if self.connect is not None:
+                for job in batch:
+                    job.attempts += 1
+                retry = [job for job in batch if job.attempts < self.max_attempts]
+            failed = [job for job in batch if job.attempts >= self.max_attempts] if retry else batch
+            if failed:
+                self.failed += len(failed)
+                self._fail(failed, str(e))
+            if self.connect is not None:
+                self._reopen()
+            if retry:
+                # Printed first once the printer is back
+                self.retried += len(retry)
+                self._notify(retry, "queued", str(e))
+                self.scheduler.requeue(retry)
+
+    def _label(self):
+        return f" at {self.name}" if self.name else ""
+
+    def _reopen(self):
+        """Close the printer and open it again, leaving it unset if that fails"""
+        printer, self.printer = self.printer, None
+        if printer is not None:
+            try:
+                printer.close()
+            except Exception as e:
+                logger.debug(f"Error closing printer{self._label()}: {e}")
+        if self.offline_since is None:
+            self.offline_since = time.monotonic()
+        try:
+            self.printer = self.connect()
+        except Exception as e:
+            logger.error(f"Unable to open printer{self._label()}: {e}")
+            return False
+        self.reconnects += 1
+        self.offline_since = None
+        logger.info(f"Reopened printer{self._label()}")
+        return True
+
+    def _wait_for_printer(self):
+        while not self._reopen():
+            time.sleep(self.reconnect_interval)
+
+    def _fail(self, jobs, error):
+        self._notify(jobs, "failed", error)
+        for job in jobs:
+            if job.on_failed is not None:
+                try:
+                    job.on_failed(job, error)
+                except Exception as e:
+                    logger.warning(f"Error in print failure callback: {e}")
+
+    def _notify(self, jobs, state, error=None):
+        if self.on_state is None:
+            return
+        for job in jobs:
+            try:
+                self.on_state(job, state, error)
+            except Exception as e:
+                logger.warning(f"Error in print state callback: {e}")
+
+    def _maybe_report(self):
+        now = time.monotonic()
+        if self.stats_interval and now - self._last_report >= self.stats_interval:
+            self._last_report = now
+            logger.info(f"Print stats: {self.stats()}")
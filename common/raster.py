@@ -0,0 +1,181 @@
+import logging
+import math
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageDraw, ImageFont
+
+from .common import _timestamp
+
+logger = logging.getLogger('telegramtastic.raster')
+
+# GS v 0 accepts at most this many dot rows on common Epson-compatible printers
+MAX_RASTER_HEIGHT = 2303
+
+class RasterRenderer:
+    """
+    Render telegrams as 1-bit images and send them with one ESC/POS raster command.
+
+    Header bitmaps are rasterised once per title and glyph bitmaps once per
+    character, so composing a receipt is mostly a series of cached pastes.
+    The max_glyphs most recently used glyphs are kept, since telegrams can
+    bring in any number of distinct emoji and CJK characters.
+    Unlike text mode, any font and any character the font has a glyph for can
+    be printed, regardless of the printer code page.
+    """
+
+    def __init__(self, width=512, font_path=None, font_size=24, margin=8, max_glyphs=4096):
+        self.width = width
+        self.margin = margin
+        self.max_glyphs = max_glyphs
+        self.font_path = font_path
+        self.font_size = font_size
+        self.font = self._load_font(font_path, font_size)
+        ascent, descent = self.font.getmetrics()
+        self.line_height = ascent + descent + 2
+
+        self._glyphs = OrderedDict()
+        # Print workers for several stations share one renderer
+        self._glyph_lock = threading.Lock()
+        self._headers = {}
+
+    @staticmethod
+    def _load_font(font_path, size):
+        if font_path:
+            try:
+                return ImageFont.truetype(font_path, size)
+            except OSError as e:
+                logger.warning(f"Unable to load raster font {font_path}, using default: {e}")
+        return ImageFont.load_default(size)
+
+    def _glyph(self, ch):
+        """Return the cached 1-bit bitmap for a single character"""
+        with self._glyph_lock:
+            glyph = self._glyphs.get(ch)
+            if glyph is not None:
+                self._glyphs.move_to_end(ch)
+                return glyph
+        width = max(1, math.ceil(self.font.getlength(ch)))
+        glyph = Image.new("1", (width, self.line_height), 0)
+        ImageDraw.Draw(glyph).text((0, 0), ch, font=self.font, fill=1)
+        with self._glyph_lock:
+            self._glyphs[ch] = glyph
+            if len(self._glyphs) > self.max_glyphs:
+                self._glyphs.popitem(last=False)
+        return glyph
+
+    def header(self, title):
+        """Return the cached header bitmap for a title, rendering it on first use"""
+        bitmap = self._headers.get(title)
+        if bitmap is None:
+            lines = title.strip("\n").split("\n")
+            limit = self.width - 2 * self.margin
+            # Start at double size like text mode and shrink until the longest line fits
+            size = self.font_size * 2
+            font = self._load_font(self.font_path, size)
+            while size > self.font_size and max(font.getlength(line) for line in lines) > limit:
+                size -= 2
+                font = self._load_font(self.font_path, size)
+            lines.append("=" * int(limit // font.getlength("=")))
+
+            ascent, descent = font.getmetrics()
+            line_height = ascent + descent + 4
+            bitmap = Image.new("1", (self.width, line_height * len(lines) + self.line_height), 0)
+            draw = ImageDraw.Draw(bitmap)
+            for i, line in enumerate(lines):
+                x = max(0, (self.width - font.getlength(line)) // 2)
+                # A one pixel offset redraw stands in for the printer's bold mode
+                draw.text((x, i * line_height), line, font=font, fill=1)
+                draw.text((x + 1, i * line_height), line, font=font, fill=1)
+            self._headers[title] = bitmap
+        return bitmap
+
+    def _wrap(self, text):
+        """Split text into lines that fit the printable width"""
+        limit = self.width - 2 * self.margin
+        lines = []
+        for paragraph in text.split("\n"):
+            line, line_width = "", 0
+            for word in paragraph.split(" "):
+                word_width = sum(self._glyph(ch).width for ch in word)
+                space = self._glyph(" ").width if line else 0
+                if line and line_width + space + word_width > limit:
+                    lines.append(line)
+                    line, line_width, space = "", 0, 0
+                # Hard-break words that are wider than the paper on their own
+                while word_width > limit:
+                    cut, cut_width = 0, 0
+                    while cut < len(word) and cut_width + self._glyph(word[cut]).width <= limit:
+                        cut_width += self._glyph(word[cut]).width
+                        cut += 1
+                    cut = max(cut, 1)
+                    lines.append(word[:cut])
+                    word = word[cut:]
+                    word_width = sum(self._glyph(ch).width for ch in word)
+                line += (" " if space else "") + word
+                line_width += space + word_width
+            lines.append(line)
+        return lines
+
+    def _paste_line(self, canvas, line, y, center=False):
+        width = sum(self._glyph(ch).width for ch in line)
+        x = (self.width - width) // 2 if center else self.margin
+        for ch in line:
+            glyph = self._glyph(ch)
+            canvas.paste(1, (x, y, x + glyph.width, y + glyph.height), glyph)
+            x += glyph.width
+
+    def render(self, title, entries):
+        """
+        Compose a receipt image.
+
+        Args:
+            title (str): Header text, one line per newline
+            entries (list): (received, text, signature) tuples, one per telegram
+
+        Returns:
+            PIL.Image.Image: 1-bit receipt image where 1 is ink
+        """
+        header = self.header(title)
+        blocks = []
+        for i, (received, text, signature) in enumerate(entries):
+            if i > 0:
+                blocks.append(("-" * 32, False))
+                blocks.append(("", False))
+            body = f"Recieved: {_timestamp(received)}\n\n{text}\n".upper()
+            blocks.extend((line, False) for line in self._wrap(body))
+            blocks.extend((line, True) for line in self._wrap(signature.upper()))
+            blocks.append(("", False))
+
+        canvas = Image.new("1", (self.width, header.height + self.line_height * len(blocks)), 0)
+        canvas.paste(header, (0, 0))
+        y = header.height
+        for line, center in blocks:
+            self._paste_line(canvas, line, y, center)
+            y += self.line_height
+        return canvas
+
+    @staticmethod
+    def to_escpos(image):
+        """Encode a 1-bit image as GS v 0 raster bit image command(s)"""
+        width_bytes = (image.width + 7) // 8
+        data = image.tobytes()
+        out = bytearray()
+        # Taller images are split only because printers reject oversized raster blocks
+        for top in range(0, image.height, MAX_RASTER_HEIGHT):
+            rows = min(MAX_RASTER_HEIGHT, image.height - top)
+            out += b"\x1dv0\x00"
+            out += bytes((width_bytes & 0xFF, width_bytes >> 8, rows & 0xFF, rows >> 8))
+            out += data[top * width_bytes:(top + rows) * width_bytes]
+        return bytes(out)
+
+    def print_digest(self, printer, title, entries):
+        """Render and print several telegrams on one receipt"""
+        printer.set_with_default()
+        printer._raw(self.to_escpos(self.render(title, entries)))
+        printer.cut()
+
+    def print_jobs(self, printer, title, jobs, sep=" / "):
+        """Print one or more queued PrintJobs as a single raster receipt"""
+        self.print_digest(printer, title, [
+            (job.received, job.text, f"--{job.frm.short_name}{sep}{job.frm.long_name}") for job in jobs
+        ])
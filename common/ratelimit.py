@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger('telegramtastic.ratelimit')
+
+class PrintRateLimiter:
+    """
+    Per-node print cooldown backed by the nodes table.
+
+    The database stays the source of truth; this class applies the cooldown
+    through NodeRepository and mirrors each node's last print and counters
+    in memory so they can be reported without a query. The mirror keeps the
+    max_nodes most recently seen nodes.
+    """
+
+    def __init__(self, node_repo, rate_limit_seconds, max_nodes=10000):
+        self.node_repo = node_repo
+        self.rate_limit_seconds = rate_limit_seconds
+        self.max_nodes = max_nodes
+        self._lock = threading.Lock()
+        self._nodes = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+
+    def allow(self, node_id, save=True):
+        """
+        Check the cooldown and, if the node may print, record the print.
+
+        Args:
+            node_id (int): Sending node
+            save (bool): Store the print in the database now. With False the
+                caller stores it later through save(), e.g. once the telegram
+                is in the print ledger; until then the cooldown is applied
+                from memory.
+
+        Returns:
+            bool: True if the message should be printed
+        """
+        if self._cooling(node_id) or not self.node_repo.can_print_message(node_id, self.rate_limit_seconds):
+            self._record(node_id, allowed=False)
+            return False
+        if save and not self.save(node_id):
+            logger.warning(f"Failed to update last_print for node {node_id}, skipping print")
+            return False
+        self._record(node_id, allowed=True)
+        return True
+
+    def save(self, node_id):
+        """Store a node's last print in the database, returning False if that fails"""
+        return self.node_repo.update_last_print(node_id)
+
+    def _cooling(self, node_id):
+        """True if this process let the node print within the cooldown"""
+        with self._lock:
+            state = self._nodes.get(node_id)
+            last_print = state["last_print"] if state is not None else None
+        return last_print is not None and time.time() - last_print < self.rate_limit_seconds
+
+    def _record(self, node_id, allowed):
+        with self._lock:
+            state = self._nodes.setdefault(node_id, {"last_print": None, "allowed": 0, "limited": 0})
+            self._nodes.move_to_end(node_id)
+            while len(self._nodes) > self.max_nodes:
+                self._nodes.popitem(last=False)
+            if allowed:
+                state["last_print"] = time.time()
+                state["allowed"] += 1
+                self.allowed += 1
+            else:
+                state["limited"] += 1
+                self.limited += 1
+
+    def snapshot(self, limit=100):
+        """Return limiter settings and the most recently printing nodes"""
+        now = time.time()
+        with self._lock:
+            nodes = sorted(self._nodes.items(), key=lambda item: item[1]["last_print"] or 0, reverse=True)[:limit]
+            nodes = [(node_id, dict(state)) for node_id, state in nodes]
+        return {
+            "rate_limit_seconds": self.rate_limit_seconds,
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "tracked_nodes": len(self._nodes),
+            "nodes": {
+                str(node_id): {
+                    **state,
+                    "cooldown_remaining": max(0.0, round(self.rate_limit_seconds - (now - state["last_print"]), 1)) if state["last_print"] else 0.0,
+                } for node_id, state in nodes
+            },
+        }
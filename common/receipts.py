@@ -0,0 +1,189 @@
+import hashlib
+import logging
+import threading
+import time
+import zlib
+
+from escpos.printer import Dummy
+
+from .common import _header
+
+logger = logging.getLogger('telegramtastic.receipts')
+
+def _compress(data, zdict):
+    # Raw deflate: the size check in load_receipt stands in for zlib's header and checksum
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=zdict)
+    return compressor.compress(data) + compressor.flush()
+
+def pack(data, headers):
+    """
+    Split a receipt into a known header and a compressed body
+
+    Args:
+        data (bytes): The receipt's ESC/POS byte stream
+        headers (list): (id, header bytes) tuples, longest first
+
+    Returns:
+        tuple: (header id or None, body deflated with the header as preset dictionary)
+    """
+    for header_id, header in headers:
+        if data.startswith(header):
+            return header_id, _compress(data[len(header):], header)
+    return None, _compress(data, b"")
+
+def unpack(header, body):
+    """Rebuild a receipt's byte stream from pack()"""
+    header = header or b""
+    decompressor = zlib.decompressobj(-15, zdict=header)
+    return header + decompressor.decompress(body) + decompressor.flush()
+
+def load_receipt(repo, packet_id, from_node=None):
+    """
+    The stored bytes of the newest receipt a telegram was printed on
+
+    Returns:
+        tuple: (receipt dict from ReceiptRepository.get, bytes), or (None, None) if it is not stored
+    """
+    receipt = repo.get(packet_id, from_node)
+    if receipt is None:
+        return None, None
+    data = unpack(receipt["header"], receipt["body"])
+    if len(data) != receipt["size"]:
+        raise ValueError(f"Stored receipt {receipt['id']} is {len(data)} bytes, expected {receipt['size']}")
+    return receipt, data
+
+class ReceiptStore:
+    """
+    Keeps the exact ESC/POS bytes of printed receipts so they can be reprinted.
+
+    common.printers.send_receipt() draws a receipt into an in-memory buffer
+    instead of the printer, sends the buffer in one write and add()s it here,
+    keyed by (sender, packet id) for every telegram on the receipt. A reprint sends the same bytes again:
+    same text, same timestamp, no rendering and no name lookups.
+
+    Receipts mostly start with the same header. Headers registered with
+    register_title() are stored once, and each receipt keeps only the rest,
+    deflated with the header as preset dictionary, so a text receipt of a
+    couple of hundred bytes is stored in under 100.
+
+    Receipts are written in batches by a background thread, like the print
+    history. Once the store holds more than max_bytes, the least recently
+    printed or reprinted receipts are evicted until it is back under 90%.
+    """
+
+    def __init__(self, repo, max_bytes=32 * 1024 * 1024, flush_interval=1.0, batch_size=100, max_pending=1000):
+        self.repo = repo
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = []
+        self._headers = []
+        self._known = {}
+        self._thread = None
+        self.stored_bytes = 0
+        self.stored = 0
+        self.raw_bytes = 0
+        self.packed_bytes = 0
+        self.evicted = 0
+        self.dropped = 0
+        self.write_errors = 0
+
+    def load(self):
+        """Load the stored headers and the store's size"""
+        self._known = self.repo.headers()
+        self._sort_headers()
+        self.stored_bytes = self.repo.stored_bytes() or 0
+        logger.info(f"Receipt store holds {self.stored_bytes / 1024:.0f} KiB of {self.max_bytes / 1024:.0f} KiB")
+        return self
+
+    def _sort_headers(self):
+        self._headers = sorted(self._known.values(), key=lambda header: -len(header[1]))
+
+    def register_title(self, title):
+        """Store the bytes that _header() prints for a title, so receipts starting with them share one copy"""
+        buffer = Dummy()
+        _header(buffer, title)
+        data = buffer.output
+        digest = hashlib.sha1(data).hexdigest()
+        if digest not in self._known:
+            header_id = self.repo.save_header(digest, data)
+            if header_id is not None:
+                self._known[digest] = (header_id, data)
+                self._sort_headers()
+        return self
+
+    def add(self, jobs, data):
+        """Queue a printed receipt to be stored under each of its telegrams"""
+        keys = [(job.from_id, job.packet_id) for job in jobs
+                if job.from_id is not None and job.packet_id is not None]
+        if not keys:
+            return
+        with self._lock:
+            self._pending.append((time.time(), keys, data))
+            if len(self._pending) > self.max_pending:
+                del self._pending[0]
+                self.dropped += 1
+            if len(self._pending) >= self.batch_size:
+                self._wake.set()
+
+    def flush(self):
+        """Compress and store the waiting receipts in one transaction, then evict if over budget"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+        receipts = []
+        for printed_at, keys, data in pending:
+            header_id, body = pack(data, self._headers)
+            receipts.append({"header_id": header_id, "body": body, "size": len(data),
+                             "printed_at": printed_at, "keys": keys})
+        if not self.repo.save_batch(receipts):
+            with self._lock:
+                self._pending[:0] = pending[-self.max_pending:]
+            self.write_errors += 1
+            return 0
+        packed = sum(len(receipt["body"]) for receipt in receipts)
+        self.stored += len(receipts)
+        self.raw_bytes += sum(receipt["size"] for receipt in receipts)
+        self.packed_bytes += packed
+        self.stored_bytes += packed
+        if self.stored_bytes > self.max_bytes:
+            deleted, freed = self.repo.evict(self.stored_bytes - int(self.max_bytes * 0.9))
+            self.evicted += deleted
+            self.stored_bytes -= freed
+            logger.info(f"Evicted {deleted} stored receipt(s), {freed / 1024:.0f} KiB")
+        return len(receipts)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "stored": self.stored,
+            "pending_writes": pending,
+            "stored_bytes": self.stored_bytes,
+            "max_bytes": self.max_bytes,
+            "compression_ratio": round(self.raw_bytes / self.packed_bytes, 1) if self.packed_bytes else None,
+            "evicted": self.evicted,
+            "dropped": self.dropped,
+            "write_errors": self.write_errors,
+        }
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error writing the receipt store: {e}")
+
+    def start(self):
+        """Start the writer thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="receipt-store", daemon=True)
+            self._thread.start()
+        return self
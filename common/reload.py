@@ -0,0 +1,104 @@
+import logging
+import os
+import threading
+import time
+
+from dotenv import dotenv_values
+
+logger = logging.getLogger('telegramtastic.reload')
+
+class ConfigReloader:
+    """
+    Reloads a fixed set of settings from the .env file while the process runs.
+
+    A reload is triggered by trigger(), typically from a SIGHUP handler, or
+    by the file's modification time changing when poll_interval is set. It
+    runs on the reloader's own thread, so signal handlers never call into
+    MQTT or database code directly.
+
+    Each setting is read from the file, falling back to the process
+    environment, and compared with the value currently applied. Only the
+    changed settings are passed to apply(changes), where changes maps each
+    name to an (old, new) tuple. If apply raises, the current values are kept
+    and the next reload tries again.
+    """
+
+    def __init__(self, path, keys, apply, poll_interval=2.0):
+        self.path = path
+        self.keys = keys
+        self.apply = apply
+        self.poll_interval = poll_interval
+        # The values the process started with, which are the ones currently applied
+        self.current = {key: os.getenv(key) for key in keys}
+        self._event = threading.Event()
+        self._mtime = self._file_mtime()
+        self._thread = None
+        self.reloads = 0
+        self.last_reload = None
+
+    def read(self):
+        """Read the reloadable settings from the file, falling back to the environment"""
+        values = dotenv_values(self.path) if os.path.exists(self.path) else {}
+        return {key: values[key] if values.get(key) is not None else os.getenv(key) for key in self.keys}
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def trigger(self):
+        """Request a reload; safe to call from a signal handler"""
+        self._event.set()
+
+    def reload(self, reason="manual"):
+        """Apply any changed settings now and return a report"""
+        started = time.perf_counter()
+        report = {"time": time.time(), "reason": reason, "changed": [], "error": None}
+        try:
+            new = self.read()
+            changes = {key: (self.current[key], new[key]) for key in self.keys if new[key] != self.current[key]}
+            if changes:
+                self.apply(changes)
+                self.current.update({key: value for key, (_, value) in changes.items()})
+            report["changed"] = sorted(changes)
+        except Exception as e:
+            report["error"] = str(e)
+            logger.error(f"Config reload failed, keeping current settings: {e}")
+        report["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        self.reloads += 1
+        self.last_reload = report
+        if report["changed"]:
+            logger.info(f"Reloaded {', '.join(report['changed'])} in {report['latency_ms']} ms ({reason})")
+        elif not report["error"]:
+            logger.info(f"Config reload ({reason}): nothing changed")
+        return report
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "watching": bool(self.poll_interval),
+            "reloads": self.reloads,
+            "last_reload": self.last_reload,
+        }
+
+    def _loop(self):
+        while True:
+            signalled = self._event.wait(self.poll_interval or None)
+            self._event.clear()
+            mtime = self._file_mtime()
+            if signalled:
+                self._mtime = mtime
+                self.reload("signal")
+            elif mtime != self._mtime:
+                self._mtime = mtime
+                self.reload("file changed")
+
+    def start(self):
+        """Start the reloader thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="config-reload", daemon=True)
+            self._thread.start()
+            logger.info(f"Config reload enabled for {', '.join(self.keys)} from {self.path}"
+                        f"{f', watching every {self.poll_interval}s' if self.poll_interval else ''}")
+        return self
@@ -0,0 +1,234 @@
+import logging
+from collections import Counter
+
+from .common import parse_node_ids
+from .printers import PrinterTarget
+
+logger = logging.getLogger('telegramtastic.routing')
+
+BROADCAST_ID = 4294967295
+
+ROUTE_KEYS = ("channel", "to", "from", "gateway")
+
+class Route:
+    """
+    Telegrams that print at one station.
+
+    A route matches a telegram when every condition it sets matches; unset
+    conditions match anything:
+
+        channels:  channel names, as in the MQTT topic
+        dm:        True for direct messages only, False for broadcasts only
+        to_nodes:  direct messages to one of these nodes
+        senders:   telegrams from one of these nodes
+        gateways:  telegrams heard by one of these gateways
+
+    target is the PrinterTarget to print on, or None for the printer set up
+    with the PRINTER_* settings.
+    """
+
+    def __init__(self, name, target=None, channels=None, dm=None, to_nodes=None, senders=None, gateways=None):
+        self.name = name
+        self.target = target
+        self.channels = channels
+        self.dm = True if to_nodes else dm
+        self.to_nodes = to_nodes
+        self.senders = senders
+        self.gateways = gateways
+        # Set by PrintRouter.start(); routes to the same printer share a queue
+        self.station = None
+        self.queue = None
+        self.matched = 0
+
+    def accepts(self, to, sender, gateway):
+        """The conditions not already covered by the router's lookup table"""
+        if self.senders is not None and sender not in self.senders:
+            return False
+        if self.to_nodes is not None and to not in self.to_nodes:
+            return False
+        if self.gateways is not None and gateway not in self.gateways:
+            return False
+        return True
+
+    def describe(self):
+        conditions = {}
+        if self.channels is not None:
+            conditions["channel"] = sorted(self.channels)
+        if self.to_nodes is not None:
+            conditions["to"] = [f"!{node:08x}" for node in sorted(self.to_nodes)]
+        elif self.dm is not None:
+            conditions["to"] = "dm" if self.dm else "broadcast"
+        if self.senders is not None:
+            conditions["from"] = [f"!{node:08x}" for node in sorted(self.senders)]
+        if self.gateways is not None:
+            conditions["gateway"] = [f"!{node:08x}" for node in sorted(self.gateways)]
+        return conditions
+
+def _node_number(node_id):
+    """A "!a1b2c3d4" node ID as an int, or None"""
+    try:
+        return int(node_id[1:], 16) if node_id and node_id.startswith("!") else None
+    except ValueError:
+        return None
+
+def parse_routes(value):
+    """
+    Parse PRINT_ROUTES into Routes, in the order they are listed.
+
+    Routes are separated by ";". Each starts with name=printer, where printer
+    is "host[:port]", "usb:DEVICE", "usb:VID:PID" or "default" for the
+    PRINTER_* printer, followed by any of these conditions, with
+    comma-separated values:
+
+        channel=LongFast,MediumFast
+        to=dm | to=broadcast | to=!a1b2c3d4,...
+        from=!a1b2c3d4,...
+        gateway=!a1b2c3d4,...
+
+    For example "booth=192.168.1.50 channel=LongFast; desk=usb:/dev/usb/lp0 to=dm".
+    Raises ValueError if a route is invalid.
+    """
+    routes = []
+    for spec in filter(None, (part.strip() for part in (value or "").split(";"))):
+        tokens = spec.split()
+        name, sep, printer = tokens[0].partition("=")
+        if not sep or not name or not printer:
+            raise ValueError(f"Route {spec!r} must start with name=printer")
+        if any(route.name == name for route in routes):
+            raise ValueError(f"Duplicate route name {name!r}")
+        route = Route(name, None if printer == "default" else PrinterTarget.parse(printer))
+        for token in tokens[1:]:
+            key, sep, items = token.partition("=")
+            if not sep or key not in ROUTE_KEYS or not items:
+                raise ValueError(f"Invalid condition {token!r} in route {name!r}, expected one of {', '.join(ROUTE_KEYS)}")
+            if key == "channel":
+                route.channels = set(filter(None, items.split(",")))
+            elif key == "to" and items in ("dm", "broadcast"):
+                route.dm = items == "dm"
+            else:
+                nodes = parse_node_ids(items)
+                if not nodes:
+                    raise ValueError(f"No valid node IDs in {token!r} in route {name!r}")
+                if key == "to":
+                    route.to_nodes, route.dm = nodes, True
+                elif key == "from":
+                    route.senders = nodes
+                else:
+                    route.gateways = nodes
+        routes.append(route)
+    return routes
+
+class PrintRouter:
+    """
+    Picks the station each telegram prints at.
+
+    Routes are tried in order and the first match wins; a telegram that
+    matches no route is not printed. The routes are compiled into a table
+    keyed by (channel, direct message or not) that holds, in order, only the
+    routes that can match such a telegram, so picking a route is one dict
+    lookup plus the sender, recipient and gateway checks of the few routes
+    that set them. A table entry under None covers channels no route names.
+
+    Each printer gets its own PrintQueue and print worker, shared by the
+    routes that print there, so a jammed or unreachable printer only backs
+    up its own queue.
+    """
+
+    def __init__(self, routes):
+        if not routes:
+            raise ValueError("No print routes")
+        self.routes = routes
+        self.stations = {}
+        self.unrouted = 0
+        self.unrouted_channels = Counter()
+
+        named = set()
+        for route in routes:
+            named |= route.channels or set()
+        self._table = {}
+        for channel in list(named) + [None]:
+            for dm in (False, True):
+                self._table[(channel, dm)] = [
+                    # Only routes with conditions left to check need accepts()
+                    (route, route.senders is not None or route.to_nodes is not None or route.gateways is not None)
+                    for route in routes
+                    if (route.channels is None or channel in route.channels) and route.dm in (None, dm)
+                ]
+
+    def start(self, make_queue):
+        """
+        Start a print worker per printer
+
+        Args:
+            make_queue (callable): Called with a station name and its PrinterTarget
+                (None for the PRINTER_* printer); returns a started PrintQueue
+        """
+        for route in self.routes:
+            key = str(route.target) if route.target is not None else None
+            if key not in self.stations:
+                # Named after the first route that prints there
+                self.stations[key] = (route.name, make_queue(route.name, route.target))
+            route.station, route.queue = self.stations[key]
+        return self
+
+    def route(self, channel, to, sender, gateway=None):
+        """
+        The route a telegram prints on
+
+        Args:
+            channel (str): The channel name from the envelope
+            to (int): Destination node ID
+            sender (int): Sender node ID
+            gateway (str): The gateway ID from the envelope, e.g. "!a1b2c3d4"
+
+        Returns:
+            Route: The first matching route, or None if the telegram is not to be printed
+        """
+        dm = to != BROADCAST_ID
+        candidates = self._table.get((channel, dm))
+        if candidates is None:
+            candidates = self._table[(None, dm)]
+        gateway_id = None
+        for route, check in candidates:
+            if check:
+                if route.gateways is not None and gateway_id is None:
+                    gateway_id = _node_number(gateway)
+                if not route.accepts(to, sender, gateway_id):
+                    continue
+            route.matched += 1
+            return route
+        self.unrouted += 1
+        self.unrouted_channels[channel] += 1
+        return None
+
+    def queues(self):
+        return [queue for _, queue in self.stations.values()]
+
+    def by_name(self, name):
+        """A route by name, or the first route if there is none by that name"""
+        for route in self.routes:
+            if route.name == name:
+                return route
+        return self.routes[0]
+
+    def depth(self):
+        """Jobs waiting across every station"""
+        return sum(queue.depth() for queue in self.queues())
+
+    def alive(self):
+        """True while every station's print worker is running"""
+        return all(queue.alive() for queue in self.queues())
+
+    def stats(self):
+        return {
+            "routes": [
+                {"name": route.name, "station": route.station, "match": route.describe(), "matched": route.matched}
+                for route in self.routes
+            ],
+            "unrouted": self.unrouted,
+            "unrouted_channels": dict(self.unrouted_channels.most_common(10)),
+            "stations": {
+                station: dict(queue.stats(), printer=key or "default")
+                for key, (station, queue) in self.stations.items()
+            },
+        }
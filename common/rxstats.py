@@ -0,0 +1,234 @@
+import logging
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict
+
+from common.metrics import percentile
+
+logger = logging.getLogger('telegramtastic.rxstats')
+
+class _Ring:
+    """Fixed-size ring of numbers stored in a compact array"""
+
+    __slots__ = ("_data", "_next", "_full")
+
+    def __init__(self, typecode, size):
+        self._data = array(typecode, bytes(array(typecode).itemsize * size))
+        self._next = 0
+        self._full = False
+
+    def append(self, value):
+        self._data[self._next] = value
+        self._next += 1
+        if self._next == len(self._data):
+            self._next = 0
+            self._full = True
+
+    def values(self):
+        """Return a copy of the samples as an array (a cheap memory copy)"""
+        return self._data[:] if self._full else self._data[:self._next]
+
+class _Reception:
+    """Counters and recent signal samples for one gateway or node"""
+
+    __slots__ = ("packets", "first", "duplicates", "delay_total", "ranks", "snr", "rssi", "hops", "last_seen")
+
+    def __init__(self, window):
+        self.snr = _Ring("f", window)
+        self.rssi = _Ring("h", window)
+        self.hops = _Ring("b", window)
+        self.reset()
+        self.last_seen = None
+
+    def reset(self):
+        """Clear the per-period counters; the sample rings keep rolling"""
+        self.packets = 0
+        self.first = 0
+        self.duplicates = 0
+        self.delay_total = 0.0
+        # How many gateways had already delivered a packet when this one did
+        self.ranks = Counter()
+
+    def add(self, rank, delay, snr, rssi, hops):
+        self.packets += 1
+        self.last_seen = time.time()
+        self.ranks[rank] += 1
+        if rank == 1:
+            self.first += 1
+        else:
+            self.duplicates += 1
+            self.delay_total += delay
+        # Packets relayed over MQTT by another gateway carry no radio measurements
+        if snr or rssi:
+            self.snr.append(snr)
+            self.rssi.append(rssi)
+        if hops is not None:
+            self.hops.append(hops)
+
+    def copy(self, reset=False):
+        """Return the raw counters and samples, so they can be summarized without the lock"""
+        raw = (self.packets, self.first, self.duplicates, self.delay_total, self.ranks, self.last_seen,
+               self.snr.values(), self.rssi.values(), self.hops.values())
+        if reset:
+            self.reset()
+        else:
+            raw = raw[:4] + (Counter(self.ranks),) + raw[5:]
+        return raw
+
+def _summary(raw, elapsed):
+    packets, first, duplicates, delay_total, ranks, last_seen, snr, rssi, hops = raw
+    return {
+        "packets": packets,
+        "rate": round(packets / elapsed, 3),
+        "first_arrivals": first,
+        "duplicates": duplicates,
+        "first_share": round(first / packets, 3) if packets else None,
+        "dup_delay_ms": round(delay_total / duplicates * 1000, 1) if duplicates else None,
+        "arrival_ranks": dict(sorted(ranks.items())),
+        "snr_p50": round(percentile(snr, 50), 2) if snr else None,
+        "snr_p10": round(percentile(snr, 10), 2) if snr else None,
+        "rssi_p50": percentile(rssi, 50),
+        "rssi_p10": percentile(rssi, 10),
+        "hops_avg": round(sum(hops) / len(hops), 2) if hops else None,
+        "last_seen": last_seen,
+    }
+
+class RxStatsAggregator:
+    """
+    In-memory reception statistics per gateway, per sending node and per topic.
+
+    Every envelope, duplicates included, is recorded with the gateway that
+    uplinked it. Arrival order is worked out from a bounded table of recently
+    seen packet IDs: the first gateway to deliver a packet gets rank 1, the
+    next rank 2 and so on, with the delay behind the first copy.
+
+    SNR, RSSI and hop counts are kept in fixed-size rings of the latest
+    `window` samples, so memory per gateway and node is constant. At most
+    max_gateways gateways and max_nodes nodes are tracked; the least recently
+    heard are forgotten.
+
+    flush() turns the counters for the period into rows and hands them to
+    save_rows in one call, so the database sees one batched write per period
+    rather than one per packet.
+    """
+
+    def __init__(self, window=256, max_gateways=1000, max_nodes=5000, max_packets=20000, save_rows=None,
+                 flush_interval=300):
+        self.window = window
+        self.max_gateways = max_gateways
+        self.max_nodes = max_nodes
+        self.max_packets = max_packets
+        self.save_rows = save_rows
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._gateways = OrderedDict()
+        self._nodes = OrderedDict()
+        self._topics = Counter()
+        # packet_id -> (first arrival time, copies seen)
+        self._arrivals = OrderedDict()
+        self._period_start = time.time()
+        self._thread = None
+        self.flushes = 0
+        self.rows_written = 0
+
+    def record(self, gateway_id, channel_id, node_id, packet_id, rx_snr=0.0, rx_rssi=0, hop_limit=0, hop_start=0):
+        """Record one envelope as received from the broker"""
+        now = time.time()
+        hops = hop_start - hop_limit if hop_start else None
+        with self._lock:
+            key = (node_id, packet_id)
+            arrival = self._arrivals.get(key)
+            if arrival is None:
+                arrival = (now, 1)
+                if len(self._arrivals) >= self.max_packets:
+                    self._arrivals.popitem(last=False)
+            else:
+                arrival = (arrival[0], arrival[1] + 1)
+            self._arrivals[key] = arrival
+            rank, delay = arrival[1], now - arrival[0]
+
+            self._entry(self._gateways, gateway_id, self.max_gateways).add(rank, delay, rx_snr, rx_rssi, hops)
+            self._entry(self._nodes, node_id, self.max_nodes).add(rank, delay, rx_snr, rx_rssi, hops)
+
+            self._topics[channel_id] += 1
+
+    def _entry(self, entries, key, max_size):
+        entry = entries.get(key)
+        if entry is None:
+            entry = entries[key] = _Reception(self.window)
+            if len(entries) > max_size:
+                entries.popitem(last=False)
+        else:
+            entries.move_to_end(key)
+        return entry
+
+    def snapshot(self, limit=20):
+        """Return the period so far: gateways ranked by first arrivals, busiest nodes and topics"""
+        with self._lock:
+            elapsed = max(time.time() - self._period_start, 1e-9)
+            gateways = sorted(self._gateways.items(), key=lambda item: item[1].first, reverse=True)[:limit]
+            gateways = [(gw, rec.copy()) for gw, rec in gateways]
+            nodes = sorted(self._nodes.items(), key=lambda item: item[1].packets, reverse=True)[:limit]
+            nodes = [(str(node_id), rec.copy()) for node_id, rec in nodes]
+            topics = dict(self._topics.most_common(limit))
+        return {
+            "period_seconds": round(elapsed, 1),
+            "gateways": {gw: _summary(raw, elapsed) for gw, raw in gateways},
+            "tracked_gateways": len(self._gateways),
+            "nodes": {node_id: _summary(raw, elapsed) for node_id, raw in nodes},
+            "tracked_nodes": len(self._nodes),
+            "channels": topics,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+        }
+
+    def flush(self):
+        """Write this period's gateway, node and channel rows in one batch and start a new period"""
+        with self._lock:
+            period_start, period_end = self._period_start, time.time()
+            taken = [(kind, str(key), rec.copy(reset=True))
+                     for kind, entries in (("gateway", self._gateways), ("node", self._nodes))
+                     for key, rec in entries.items() if rec.packets]
+            topics = dict(self._topics)
+            self._topics.clear()
+            self._period_start = period_end
+
+        # Percentiles are worked out after releasing the lock so packets keep flowing
+        elapsed = max(period_end - period_start, 1e-9)
+        rows = []
+        for kind, key, raw in taken:
+            summary = _summary(raw, elapsed)
+            rows.append({"kind": kind, "key": key, **{column: summary[column] for column in (
+                "packets", "first_arrivals", "duplicates", "dup_delay_ms",
+                "snr_p50", "snr_p10", "rssi_p50", "rssi_p10", "hops_avg")}})
+        for channel_id, count in topics.items():
+            rows.append({"kind": "channel", "key": channel_id, "packets": count})
+
+        for row in rows:
+            row["period_start"] = period_start
+            row["period_end"] = period_end
+        if rows and self.save_rows is not None:
+            if self.save_rows(rows):
+                self.rows_written += len(rows)
+            else:
+                logger.warning(f"Dropped {len(rows)} reception stats rows after a database error")
+        self.flushes += 1
+        return rows
+
+    def _loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                rows = self.flush()
+                logger.debug(f"Flushed {len(rows)} reception stats rows")
+            except Exception as e:
+                logger.error(f"Error flushing reception stats: {e}")
+
+    def start(self):
+        """Start the periodic flush thread"""
+        if self._thread is None and self.flush_interval and self.save_rows is not None:
+            self._thread = threading.Thread(target=self._loop, name="rxstats-flush", daemon=True)
+            self._thread.start()
+        return self
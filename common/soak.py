@@ -0,0 +1,239 @@
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+
+from .metrics import percentile
+
+logger = logging.getLogger('telegramtastic.soak')
+
+# (relative, absolute) growth from the first to the last third of a run that
+# counts as drift, by series prefix; both have to be exceeded
+DRIFT_THRESHOLDS = {
+    "rss_mb": (0.05, 2.0),
+    "heap_total_kb": (0.05, 1024),
+    "heap_kb.": (0.2, 256),
+    "gauges.": (0.2, 5),
+    "latency_ms.": (0.5, 1.0),
+}
+
+def rss_mb():
+    """Resident set size of this process in MiB"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576
+    except (OSError, ValueError, IndexError):
+        import resource
+        # Peak rather than current RSS where there is no /proc; kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1048576 if sys.platform == "darwin" else 1024)
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _site(frame):
+    """A short file:line for a (filename, lineno) allocation site"""
+    filename = frame[0]
+    for marker in ("site-packages" + os.sep, _ROOT + os.sep):
+        if marker in filename:
+            filename = filename.split(marker, 1)[1]
+            break
+    return f"{filename}:{frame[1]}"
+
+def series(samples):
+    """Flatten samples into {series name: [(time, value), ...]}"""
+    result = {}
+    for sample in samples:
+        t = sample["t"]
+        values = {"rss_mb": sample.get("rss_mb"), "heap_total_kb": sample.get("heap_total_kb")}
+        for name, value in sample.get("gauges", {}).items():
+            values[f"gauges.{name}"] = value
+        for stage, latency in sample.get("latency_ms", {}).items():
+            values[f"latency_ms.{stage}.p95"] = latency.get("p95")
+        for site, size in sample.get("heap_kb", {}).items():
+            values[f"heap_kb.{site}"] = size
+        for name, value in values.items():
+            if value is not None:
+                result.setdefault(name, []).append((t, value))
+    return result
+
+def drift_report(samples, warmup=0.1, min_points=6):
+    """
+    Compare the first and last third of each series after warmup
+
+    Medians of the thirds are compared, so spikes and queues that fill and
+    drain don't count as drift; only a level that keeps rising does.
+
+    Args:
+        samples (list): Sample dicts as written by SoakMonitor
+        warmup (float): Share of the run at the start to leave out, while caches and pools fill
+        min_points (int): Series with fewer samples after warmup are skipped
+
+    Returns:
+        list: One dict per series, drifting series first, then by relative growth
+    """
+    samples = sorted(samples, key=lambda sample: sample["t"])
+    if not samples:
+        return []
+    start = samples[0]["t"] + (samples[-1]["t"] - samples[0]["t"]) * warmup
+    report = []
+    for name, points in series([sample for sample in samples if sample["t"] >= start]).items():
+        if len(points) < min_points:
+            continue
+        third = len(points) // 3
+        head, tail = points[:third], points[-third:]
+        first = statistics.median(value for _, value in head)
+        last = statistics.median(value for _, value in tail)
+        hours = (statistics.median(t for t, _ in tail) - statistics.median(t for t, _ in head)) / 3600
+        growth = last - first
+        relative, absolute = next(
+            (threshold for prefix, threshold in DRIFT_THRESHOLDS.items() if name.startswith(prefix)), (0.2, 0)
+        )
+        report.append({
+            "series": name,
+            "first": round(first, 3),
+            "last": round(last, 3),
+            "growth": round(growth, 3),
+            "relative": round(growth / abs(first), 3) if first else None,
+            "per_hour": round(growth / hours, 3) if hours > 0 else None,
+            "drift": growth > absolute and growth > relative * abs(first),
+        })
+    report.sort(key=_rank)
+    return report
+
+def _rank(row):
+    relative = row["relative"]
+    if relative is None:
+        # Started from zero
+        relative = float("inf") if row["growth"] > 0 else 0
+    return (not row["drift"], -relative)
+
+def format_report(report, limit=30):
+    """Text table of a drift report, drifting series first"""
+    drifting = [row for row in report if row["drift"]]
+    lines = [f"{len(drifting)} of {len(report)} series drifting"]
+    lines.append(f"{'series':<60} {'first':>12} {'last':>12} {'growth':>8} {'per hour':>10}")
+    for row in report[:max(limit, len(drifting))]:
+        relative = f"{row['relative']:+.0%}" if row["relative"] is not None else "new"
+        per_hour = f"{row['per_hour']:+.2f}" if row["per_hour"] is not None else "-"
+        mark = "DRIFT " if row["drift"] else "      "
+        lines.append(f"{mark}{row['series'][:54]:<54} {row['first']:>12g} {row['last']:>12g} {relative:>8} {per_hour:>10}")
+    return "\n".join(lines)
+
+def load_samples(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+class SoakMonitor:
+    """
+    Samples memory, queue depths and latency for long soak tests.
+
+    Every interval seconds it records the process RSS, the top_sites
+    largest allocation sites traced by tracemalloc, the value of each gauge
+    (name: callable returning a number) and p50/p95 latency of each tracer
+    span seen since the last sample. Samples are appended to path as
+    NDJSON, so a run can be examined with soak-test.py while it is going
+    and after it has stopped, and drift_report() flags any series whose
+    level keeps rising.
+
+    tracemalloc slows allocation down noticeably; top_sites=0 leaves it off.
+    At most max_samples are kept in memory for stats(); past that every
+    other one is dropped, halving the resolution rather than growing.
+    """
+
+    def __init__(self, path, gauges, tracer=None, interval=60, top_sites=25, max_samples=2000):
+        self.path = path
+        self.gauges = gauges
+        self.tracer = tracer
+        self.interval = interval
+        self.top_sites = top_sites
+        self.max_samples = max_samples
+
+        self.samples = []
+        self.sample_ms = None
+        self.drifting = []
+        self.errors = 0
+        self._since_ns = time.perf_counter_ns()
+        self._thread = None
+
+    def sample(self):
+        """Take one sample, append it to the file and return it"""
+        started = time.perf_counter()
+        sample = {"t": round(time.time(), 3), "rss_mb": round(rss_mb(), 2)}
+        gauges = {}
+        for name, gauge in self.gauges.items():
+            try:
+                gauges[name] = gauge()
+            except Exception as e:
+                logger.debug(f"Error reading soak gauge {name}: {e}")
+        sample["gauges"] = gauges
+        if self.tracer is not None:
+            now = time.perf_counter_ns()
+            sample["latency_ms"] = {
+                name: {"n": len(values), "p50": round(percentile(values, 50), 3), "p95": round(percentile(values, 95), 3)}
+                for name, values in self.tracer.durations(self._since_ns).items()
+            }
+            self._since_ns = now
+        if tracemalloc.is_tracing():
+            sample["heap_total_kb"] = round(tracemalloc.get_traced_memory()[0] / 1024)
+            sample["heap_kb"] = {_site(frame): round(size / 1024) for frame, size in self._top_sites()}
+        self.sample_ms = round((time.perf_counter() - started) * 1000, 1)
+        sample["sample_ms"] = self.sample_ms
+
+        with open(self.path, "a") as f:
+            f.write(json.dumps(sample) + "\n")
+        self.samples.append(sample)
+        if len(self.samples) > self.max_samples:
+            self.samples = self.samples[::2]
+        self.drifting = [row["series"] for row in self.report() if row["drift"]]
+        return sample
+
+    def _top_sites(self):
+        """The largest allocation sites as ((filename, lineno), size), leaving out imports and tracemalloc itself"""
+        # Copying and grouping the traces holds the GIL throughout, so with a
+        # large heap packet handling pauses briefly at every sample
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, "<frozen *>"),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ))
+        return [((stat.traceback[0].filename, stat.traceback[0].lineno), stat.size)
+                for stat in snapshot.statistics("lineno")[:self.top_sites]]
+
+    def report(self):
+        return drift_report(self.samples)
+
+    def stats(self):
+        latest = self.samples[-1] if self.samples else {}
+        return {
+            "path": self.path,
+            "samples": len(self.samples),
+            "sample_ms": self.sample_ms,
+            "errors": self.errors,
+            "rss_mb": latest.get("rss_mb"),
+            "heap_total_kb": latest.get("heap_total_kb"),
+            "gauges": latest.get("gauges"),
+            "drifting": self.drifting,
+        }
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error taking soak sample: {e}")
+
+    def start(self):
+        """Start tracing allocations and sampling"""
+        if self._thread is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            if self.top_sites:
+                tracemalloc.start()
+            self.sample()
+            self._thread = threading.Thread(target=self._loop, name="soak-monitor", daemon=True)
+            self._thread.start()
+        return self
@@ -0,0 +1,99 @@
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('telegramtastic.status')
+
+class StatusServer:
+    """
+    Embedded read-only HTTP status service.
+
+    Providers are callables that read in-memory state and return a dict.
+    A background thread calls them every refresh_interval seconds and caches
+    the encoded result, so HTTP requests never touch the database or contend
+    with packet processing; they only serve the latest snapshot.
+
+    Endpoints:
+        /status          all sections
+        /status/<name>   one section
+        /healthz         liveness, 200 or 503
+        /readyz          readiness, 200 or 503
+    """
+
+    def __init__(self, host="127.0.0.1", port=8080, refresh_interval=1.0):
+        self.host = host
+        self.port = port
+        self.refresh_interval = refresh_interval
+        self._providers = {}
+        self._checks = {"healthz": [], "readyz": []}
+        self._snapshot = {}
+        self._httpd = None
+
+    def add(self, name, provider):
+        """Register a status section served at /status/<name>"""
+        self._providers[name] = provider
+
+    def add_check(self, kind, name, check):
+        """Register a liveness ("healthz") or readiness ("readyz") check returning True when OK"""
+        self._checks[kind].append((name, check))
+
+    def refresh(self):
+        """Rebuild every cached response from the providers"""
+        sections = {}
+        for name, provider in self._providers.items():
+            try:
+                sections[name] = provider()
+            except Exception as e:
+                sections[name] = {"error": str(e)}
+        snapshot = {"/status/" + name: (200, self._encode(data)) for name, data in sections.items()}
+        snapshot["/status"] = (200, self._encode({"timestamp": time.time(), **sections}))
+        for kind, checks in self._checks.items():
+            results = {}
+            for name, check in checks:
+                try:
+                    results[name] = bool(check())
+                except Exception:
+                    results[name] = False
+            ok = all(results.values())
+            snapshot["/" + kind] = (200 if ok else 503, self._encode({"ok": ok, "checks": results}))
+        self._snapshot = snapshot
+
+    @staticmethod
+    def _encode(data):
+        return json.dumps(data, default=str).encode("utf-8")
+
+    def _refresh_loop(self):
+        while True:
+            self.refresh()
+            time.sleep(self.refresh_interval)
+
+    def start(self):
+        """Start the refresher and HTTP server threads"""
+        self.refresh()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                entry = server._snapshot.get(self.path.rstrip("/") or "/status")
+                status, body = entry if entry else (404, b'{"error": "not found"}')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"{self.address_string()} {format % args}")
+
+        try:
+            self._httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            logger.error(f"Unable to start status server on {self.host}:{self.port}: {e}")
+            return self
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._refresh_loop, name="status-refresh", daemon=True).start()
+        threading.Thread(target=self._httpd.serve_forever, name="status-http", daemon=True).start()
+        logger.info(f"Status server listening on http://{self.host}:{self.port}/status")
+        return self
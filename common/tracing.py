@@ -0,0 +1,159 @@
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+logger = logging.getLogger('telegramtastic.tracing')
+
+_NULL_SPAN = contextlib.nullcontext()
+
+class _Span:
+    __slots__ = ("tracer", "name", "packet_id", "start", "prev")
+
+    def __init__(self, tracer, name, packet_id):
+        self.tracer = tracer
+        self.name = name
+        self.packet_id = packet_id
+
+    def __enter__(self):
+        local = self.tracer._local
+        self.prev = getattr(local, "packet_id", None)
+        if self.packet_id is None:
+            self.packet_id = self.prev
+        else:
+            local.packet_id = self.packet_id
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self.tracer._local.packet_id = self.prev
+        self.tracer.record(self.name, self.start, end, self.packet_id)
+        return False
+
+class Tracer:
+    """
+    Lightweight per-packet trace spans.
+
+    Spans are kept in a bounded in-memory ring and exported as Chrome trace
+    JSON (chrome://tracing, Perfetto or speedscope). A span opened with a
+    packet ID tags every nested span on the same thread with that ID.
+    When disabled, span() returns a shared no-op context manager.
+    """
+
+    def __init__(self, enabled=False, max_events=50000):
+        self.enabled = enabled
+        self._events = deque(maxlen=max_events)
+        self._local = threading.local()
+        self._epoch = time.perf_counter_ns()
+
+    def span(self, name, packet_id=None):
+        """Time a block of code, optionally tagging it with a packet ID"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, packet_id)
+
+    def record(self, name, start_ns, end_ns, packet_id=None):
+        """Record a span that was timed elsewhere, using perf_counter_ns timestamps"""
+        if self.enabled:
+            self._events.append((name, start_ns, end_ns - start_ns, threading.get_ident(), packet_id))
+
+    def instrument(self, obj, prefix, names):
+        """Wrap methods of an object so every call is recorded as a span"""
+        if not self.enabled:
+            return obj
+        for name in names:
+            method = getattr(obj, name)
+
+            @functools.wraps(method)
+            def traced(*args, _method=method, _name=f"{prefix}.{name}", **kwargs):
+                with self.span(_name):
+                    return _method(*args, **kwargs)
+
+            setattr(obj, name, traced)
+        return obj
+
+    def packet_spans(self, packet_id):
+        """Return (name, duration_ms) for every recorded span of a packet"""
+        return [(name, dur / 1e6) for name, _, dur, _, pid in list(self._events) if pid == packet_id]
+
+    def durations(self, since_ns=0):
+        """Return {span name: [duration_ms, ...]} for recorded spans that ended after since_ns"""
+        result = {}
+        for name, start, dur, _, _ in list(self._events):
+            if start + dur > since_ns:
+                result.setdefault(name, []).append(dur / 1e6)
+        return result
+
+    def export(self, path):
+        """Write recorded spans as Chrome trace JSON and return the number of events"""
+        pid = os.getpid()
+        events = [{
+            "name": name,
+            "ph": "X",
+            "ts": (start - self._epoch) / 1000,
+            "dur": dur / 1000,
+            "pid": pid,
+            "tid": tid,
+            "args": {"packet": packet_id} if packet_id is not None else {},
+        } for name, start, dur, tid, packet_id in list(self._events)]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return len(events)
+
+class SamplingProfiler:
+    """
+    Sample the stacks of every thread in the live process for a fixed window.
+
+    Samples are aggregated into folded stacks ("thread;frame;frame count"),
+    which flamegraph.pl and speedscope read directly. Only one window can
+    run at a time.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._running = threading.Lock()
+
+    def start(self, seconds, path):
+        """Start a profiling window in the background; returns False if one is already running"""
+        if not self._running.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._run, args=(seconds, path), name="sampling-profiler", daemon=True).start()
+        return True
+
+    def _run(self, seconds, path):
+        try:
+            stacks = Counter()
+            names = {}
+            me = threading.get_ident()
+            samples = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for thread in threading.enumerate():
+                    names[thread.ident] = thread.name
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    stacks[";".join(reversed(stack))] += 1
+                samples += 1
+                time.sleep(self.interval)
+
+            with open(path, "w") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            logger.info(f"Wrote {samples} profile samples ({len(stacks)} unique stacks) to {path}")
+        except Exception as e:
+            logger.error(f"Sampling profiler failed: {e}")
+        finally:
+            self._running.release()
@@ -0,0 +1,234 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+
+from meshtastic import mqtt_pb2
+from meshtastic.protobuf import config_pb2
+from meshtastic.serial_interface import SerialInterface
+from meshtastic.tcp_interface import TCPInterface
+from pubsub import pub
+
+from .metrics import percentile
+
+logger = logging.getLogger('telegramtastic.transports')
+
+# A packet from a radio transport, queued for the ingest thread alongside MQTT messages
+RadioMessage = namedtuple("RadioMessage", "payload transport")
+
+def _preset_name(node):
+    """The channel name a radio shows for an unnamed primary channel, e.g. LONG_FAST as "LongFast\""""
+    preset = config_pb2.Config.LoRaConfig.ModemPreset.Name(node.localConfig.lora.modem_preset)
+    return "".join(part.title() for part in preset.split("_"))
+
+class RadioTransport:
+    """
+    Packets heard by a Meshtastic node attached over serial or TCP.
+
+    The node decrypts the channels it knows, so packets arrive decoded. Each
+    one is wrapped in a ServiceEnvelope, as a gateway would upload it, with
+    the channel name for the packet's channel index and the node's own ID as
+    gateway, so duplicate filtering, reception statistics, routing and the
+    traffic archive treat it like any packet from the broker. The envelope
+    bytes are passed to deliver(payload, transport) on the interface's
+    thread.
+
+    Written as "serial", "serial:DEVICE" or "tcp:HOST[:PORT]"; plain
+    "serial" finds the node by probing. The connection is reopened every
+    reconnect_interval seconds after it drops.
+    """
+
+    def __init__(self, kind, address=None, port=4403, reconnect_interval=5):
+        self.kind = kind
+        self.address = address
+        self.port = port
+        self.reconnect_interval = reconnect_interval
+        self.name = str(self)
+
+        self.interface = None
+        self.gateway_id = None
+        self.channels = {}
+        self.connected = False
+        self.since = time.time()
+        self.disconnects = 0
+        self.received = 0
+        self.dropped = 0
+        self._lost = threading.Event()
+        self._deliver = None
+        self._thread = None
+
+    @classmethod
+    def parse(cls, value):
+        """Parse a "serial[:DEVICE]" or "tcp:HOST[:PORT]" string, raising ValueError if it is invalid"""
+        kind, _, rest = value.strip().partition(":")
+        kind = kind.lower()
+        if kind == "serial":
+            return cls("serial", rest or None)
+        if kind == "tcp":
+            host, _, port = rest.partition(":")
+            if not host:
+                raise ValueError(f"No host in transport {value}")
+            return cls("tcp", host, int(port) if port else 4403)
+        raise ValueError(f"Unknown transport {value}, must be mqtt, serial[:DEVICE] or tcp:HOST[:PORT]")
+
+    def __str__(self):
+        if self.kind == "tcp":
+            return f"tcp:{self.address}:{self.port}"
+        return f"serial:{self.address}" if self.address else "serial"
+
+    def _open(self):
+        if self.kind == "tcp":
+            return TCPInterface(self.address, portNumber=self.port)
+        return SerialInterface(self.address)
+
+    def _describe(self, interface):
+        """Take the gateway ID and channel names from the node's configuration"""
+        node = interface.localNode
+        self.gateway_id = f"!{node.nodeNum:08x}"
+        channels = {}
+        for channel in node.channels or []:
+            # Role 0 is a disabled slot
+            if channel.role:
+                channels[channel.index] = channel.settings.name or _preset_name(node)
+        self.channels = channels
+
+    def envelope(self, mesh_packet):
+        """Serialize a MeshPacket from the node into ServiceEnvelope bytes"""
+        envelope = mqtt_pb2.ServiceEnvelope()
+        envelope.packet.CopyFrom(mesh_packet)
+        envelope.channel_id = self.channels.get(mesh_packet.channel, str(mesh_packet.channel))
+        envelope.gateway_id = self.gateway_id or ""
+        return envelope.SerializeToString()
+
+    def _on_receive(self, packet, interface):
+        if interface is not self.interface:
+            return
+        raw = packet.get("raw")
+        if raw is None:
+            return
+        try:
+            payload = self.envelope(raw)
+        except Exception as e:
+            self.dropped += 1
+            logger.warning(f"Dropped a packet from {self.name} that could not be wrapped: {e}")
+            return
+        self.received += 1
+        self._deliver(payload, self.name)
+
+    def _on_lost(self, interface):
+        if interface is self.interface:
+            self._lost.set()
+
+    def _loop(self):
+        while True:
+            try:
+                logger.info(f"Connecting to Meshtastic node on {self.name}...")
+                self._lost.clear()
+                self.interface = self._open()
+                self._describe(self.interface)
+                self.connected = True
+                self.since = time.time()
+                logger.info(f"Receiving from {self.gateway_id} on {self.name}, channels: "
+                            f"{', '.join(self.channels.values()) or 'none'}")
+                self._lost.wait()
+                logger.warning(f"Lost connection to the node on {self.name}")
+            except Exception as e:
+                logger.error(f"Error connecting to the node on {self.name}: {e}")
+            if self.connected:
+                self.connected = False
+                self.since = time.time()
+                self.disconnects += 1
+            if self.interface is not None:
+                try:
+                    self.interface.close()
+                except Exception:
+                    pass
+                self.interface = None
+            time.sleep(self.reconnect_interval)
+
+    def healthy(self, max_disconnected_seconds):
+        """Connected, or disconnected recently enough to be a blip"""
+        return self.connected or time.time() - self.since < max_disconnected_seconds
+
+    def stats(self):
+        return {
+            "connected": self.connected,
+            "state_age": round(time.time() - self.since, 1),
+            "disconnects": self.disconnects,
+            "gateway_id": self.gateway_id,
+            "channels": self.channels,
+            "received": self.received,
+            "dropped": self.dropped,
+        }
+
+    def start(self, deliver):
+        """Connect in a background thread and pass each packet's envelope bytes to deliver"""
+        if self._thread is None:
+            self._deliver = deliver
+            # pubsub holds listeners weakly; they stay subscribed for as long as the transport exists
+            pub.subscribe(self._on_receive, "meshtastic.receive")
+            pub.subscribe(self._on_lost, "meshtastic.connection.lost")
+            self._thread = threading.Thread(target=self._loop, name=f"transport-{self.name}", daemon=True)
+            self._thread.start()
+        return self
+
+class TransportMeter:
+    """
+    Per-transport arrival counts and latency.
+
+    A packet heard on several transports, e.g. by the attached node and by a
+    gateway uploading to the broker, is counted as first on the one it
+    arrived on first; the others record how far behind it they were. Lag is
+    the time since the receiving node's rx_time, which has one second
+    resolution. Both are kept for the last window packets per transport.
+    """
+
+    def __init__(self, window=256, max_packets=10000):
+        self.window = window
+        self.max_packets = max_packets
+        self._lock = threading.Lock()
+        self._arrivals = OrderedDict()
+        self._transports = {}
+
+    def record(self, transport, from_id, packet_id, rx_time=0):
+        """Record one packet as received on transport"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._transports.get(transport)
+            if entry is None:
+                entry = self._transports[transport] = {
+                    "received": 0, "first": 0, "behind": deque(maxlen=self.window), "lag": deque(maxlen=self.window)
+                }
+            entry["received"] += 1
+            if rx_time:
+                entry["lag"].append(max(time.time() - rx_time, 0.0))
+            key = (from_id, packet_id)
+            first = self._arrivals.get(key)
+            if first is None:
+                self._arrivals[key] = (transport, now)
+                if len(self._arrivals) > self.max_packets:
+                    self._arrivals.popitem(last=False)
+                entry["first"] += 1
+            elif first[0] != transport:
+                entry["behind"].append(now - first[1])
+
+    def snapshot(self):
+        with self._lock:
+            entries = {name: (entry["received"], entry["first"], list(entry["behind"]), list(entry["lag"]))
+                       for name, entry in self._transports.items()}
+
+        def ms(values, q):
+            value = percentile(values, q)
+            return round(value * 1000, 1) if value is not None else None
+
+        return {
+            name: {
+                "received": received,
+                "first": first,
+                "behind_ms_p50": ms(behind, 50),
+                "behind_ms_p95": ms(behind, 95),
+                "lag_ms_p50": ms(lag, 50),
+                "lag_ms_p95": ms(lag, 95),
+            }
+            for name, (received, first, behind, lag) in entries.items()
+        }
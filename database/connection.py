@@ -1,22 +1,30 @@
 import os
 import logging
 import sys
-from sqlalchemy import create_engine, event, pool, text
+import sqlite3
+from sqlalchemy import create_engine, event, pool
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.exc import SQLAlchemyError
 
-from .models import Base
+from .migrations import SCHEMA_VERSION, IndexBuilder, migrate
 
 logger = logging.getLogger('telegramtastic.connection')
 
-def get_db_connection_string():
-    """Construct the database connection string for SQLite"""
+# Builds indexes that migrate_database() left for later, if there were any
+index_builder = None
+
+def get_db_path():
+    """Return the SQLite database file path, creating its directory if needed"""
     # Get the database file path from environment variable or use a default
     db_path = os.getenv('SQLITE_DATABASE_PATH', os.path.join(os.path.dirname(__file__), '../data/telegramtastic.db'))
     
     # Make sure the directory exists
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    
+    return db_path
+
+def get_db_connection_string():
+    """Construct the database connection string for SQLite"""
+    db_path = get_db_path()
     logger.info(f"Using SQLite database at: {db_path}")
     
     # SQLite connection string format
@@ -28,10 +36,15 @@ def setup_database():
     
     try:
         # Create engine with SQLite-compatible settings
+        # Each thread's scoped session checks out its own connection, so one
+        # thread's commit or rollback never ends another thread's transaction.
+        # The pool holds one connection per thread that uses the database.
         engine = create_engine(
             connection_string,
             connect_args={"check_same_thread": False},  # Allow multi-threading access to SQLite
-            poolclass=pool.StaticPool  # Use a static pool for SQLite
+            poolclass=pool.QueuePool,
+            pool_size=8,
+            max_overflow=8
         )
         
         # Add event listener for connection pool checkout errors
@@ -40,12 +53,18 @@ def setup_database():
             logger.info("Database connection established")
             # Enable foreign key support for SQLite
             dbapi_connection.execute("PRAGMA foreign_keys=ON")
+            # Only takes effect on a new database: lets maintenance hand free pages
+            # back to the filesystem with incremental_vacuum instead of a full VACUUM
+            dbapi_connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # WAL lets maintenance and CLI tools read while packets are being written
+            dbapi_connection.execute("PRAGMA journal_mode=WAL")
 
-        # Create all tables if they don't exist
-        Base.metadata.create_all(engine)
-        
-        # Run database migrations
-        migrate_database(engine)
+        # Run database migrations; indexes missing from large tables are built
+        # after startup, so it isn't held up by them
+        global index_builder
+        deferred = migrate_database(engine)
+        if deferred and index_builder is None:
+            index_builder = IndexBuilder(get_db_path(), deferred).start()
         
         # Create a session factory
         session_factory = scoped_session(sessionmaker(bind=engine))
@@ -53,26 +72,36 @@ def setup_database():
         logger.info("SQLite database connection successful")
         return session_factory
     
-    except SQLAlchemyError as e:
+    except (SQLAlchemyError, sqlite3.Error) as e:
         logger.error(f"Database connection failed: {e}")
         return None
 
 def migrate_database(engine):
-    """Apply database migrations for schema changes"""
+    """
+    Apply schema migrations, returning any indexes left to build in the background
+
+    Runs on a pooled connection, so the PRAGMAs set on connect, auto_vacuum
+    in particular, are in effect before the first table is created.
+    """
+    raw = engine.raw_connection()
     try:
-        with engine.connect() as conn:
-            # Check if last_print column exists
-            result = conn.execute(text("PRAGMA table_info(nodes)"))
-            columns = [row[1] for row in result.fetchall()]
-            
-            if 'last_print' not in columns:
-                logger.info("Adding last_print column to nodes table")
-                conn.execute(text("ALTER TABLE nodes ADD COLUMN last_print DATETIME"))
-                conn.commit()
-                logger.info("Database migration completed: added last_print column")
-            else:
-                logger.debug("Database schema is up to date")
-                
-    except SQLAlchemyError as e:
+        conn = raw.driver_connection
+        isolation_level = conn.isolation_level
+        # migrate() manages its own transaction
+        conn.isolation_level = None
+        try:
+            return migrate(conn)
+        finally:
+            conn.isolation_level = isolation_level
+    except sqlite3.Error as e:
         logger.error(f"Database migration failed: {e}")
-        raise
\ No newline at end of file
+        raise
+    finally:
+        raw.close()
+
+def schema_stats():
+    """Schema version and the progress of background index builds"""
+    return {
+        "version": SCHEMA_VERSION,
+        "indexes": index_builder.stats() if index_builder is not None else None,
+    }
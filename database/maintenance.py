@@ -0,0 +1,224 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger('telegramtastic.maintenance')
+
+class DatabaseMaintenance:
+    """
+    Background retention and compaction for the SQLite store.
+
+    Each run prunes nodes not seen for node_retention_days (unless they
+    printed within keep_printed_days), reception statistics older than
+    rx_stats_retention_days, printed handoff jobs and finished print ledger
+    entries older than print_jobs_retention_days, and instances without a
+    heartbeat for a day.
+    It then returns free pages to the filesystem, refreshes query planner
+    statistics and checkpoints the WAL.
+
+    Work is done on a separate sqlite3 connection in chunks of chunk_size rows
+    or vacuum_pages pages, each in its own short transaction, with a pause
+    between chunks so packet processing can take the write lock. A run stops
+    after time_budget seconds and picks up where it left off next time.
+    """
+
+    def __init__(self, db_path, node_retention_days=90, keep_printed_days=30, rx_stats_retention_days=30,
+                 print_jobs_retention_days=7, interval=3600, chunk_size=500, vacuum_pages=256, time_budget=5.0,
+                 pause=0.05):
+        self.db_path = db_path
+        self.node_retention_days = node_retention_days
+        self.keep_printed_days = keep_printed_days
+        self.rx_stats_retention_days = rx_stats_retention_days
+        self.print_jobs_retention_days = print_jobs_retention_days
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.vacuum_pages = vacuum_pages
+        self.time_budget = time_budget
+        self.pause = pause
+
+        self._thread = None
+        self.runs = 0
+        self.rows_removed = 0
+        self.bytes_reclaimed = 0
+        self.last_run = None
+
+    def _connect(self):
+        # A short busy timeout: if the app holds the write lock we would rather
+        # skip a chunk than queue up behind packet processing
+        conn = sqlite3.connect(self.db_path, timeout=1.0, isolation_level=None)
+        conn.execute("PRAGMA journal_size_limit=8388608")
+        return conn
+
+    @staticmethod
+    def _pragma(conn, name):
+        return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+    def _file_bytes(self):
+        return sum(os.path.getsize(path) for path in (self.db_path, self.db_path + "-wal")
+                   if os.path.exists(path))
+
+    def run_once(self):
+        """
+        Run every job once within the time budget.
+
+        Returns:
+            dict: Report with rows removed, bytes reclaimed and per-job timings
+        """
+        started = time.monotonic()
+        deadline = started + self.time_budget
+        report = {"started": datetime.now(timezone.utc).isoformat(), "rows_removed": 0, "complete": True}
+        size_before = self._file_bytes()
+        conn = self._connect()
+        try:
+            for job in (self._prune_nodes, self._prune_rx_stats, self._prune_print_jobs, self._incremental_vacuum,
+                        self._analyze, self._checkpoint):
+                job_started = time.monotonic()
+                try:
+                    job(conn, deadline, report)
+                except sqlite3.OperationalError as e:
+                    # Usually "database is locked"; the next run will retry
+                    logger.warning(f"Maintenance job {job.__name__.lstrip('_')} skipped: {e}")
+                    report["complete"] = False
+                report[job.__name__.lstrip('_') + "_ms"] = round((time.monotonic() - job_started) * 1000, 1)
+        finally:
+            conn.close()
+
+        report["bytes_reclaimed"] = max(0, size_before - self._file_bytes())
+        report["file_bytes"] = self._file_bytes()
+        report["duration_ms"] = round((time.monotonic() - started) * 1000, 1)
+        self.runs += 1
+        self.rows_removed += report["rows_removed"]
+        self.bytes_reclaimed += report["bytes_reclaimed"]
+        self.last_run = report
+        logger.info(f"Database maintenance removed {report['rows_removed']} nodes, reclaimed "
+                    f"{report['bytes_reclaimed']} bytes in {report['duration_ms']} ms"
+                    f"{'' if report['complete'] else ' (incomplete, will continue next run)'}")
+        return report
+
+    def _prune_nodes(self, conn, deadline, report):
+        if not self.node_retention_days:
+            return
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        # Same text format SQLAlchemy stores DateTime columns in, so comparisons use the index
+        seen_cutoff = (now - timedelta(days=self.node_retention_days)).strftime("%Y-%m-%d %H:%M:%S.%f")
+        print_cutoff = (now - timedelta(days=self.keep_printed_days)).strftime("%Y-%m-%d %H:%M:%S.%f")
+        while True:
+            if time.monotonic() >= deadline:
+                report["complete"] = False
+                return
+            removed = conn.execute(
+                "DELETE FROM nodes WHERE node_id IN ("
+                " SELECT node_id FROM nodes WHERE last_seen < ?"
+                " AND (last_print IS NULL OR last_print < ?) LIMIT ?)",
+                (seen_cutoff, print_cutoff, self.chunk_size)
+            ).rowcount
+            report["rows_removed"] += removed
+            if removed < self.chunk_size:
+                return
+            time.sleep(self.pause)
+
+    def _prune_rx_stats(self, conn, deadline, report):
+        if not self.rx_stats_retention_days:
+            return
+        cutoff = (datetime.now(timezone.utc).replace(tzinfo=None)
+                  - timedelta(days=self.rx_stats_retention_days)).strftime("%Y-%m-%d %H:%M:%S.%f")
+        report.setdefault("rx_stats_removed", 0)
+        while True:
+            if time.monotonic() >= deadline:
+                report["complete"] = False
+                return
+            removed = conn.execute(
+                "DELETE FROM rx_stats WHERE id IN (SELECT id FROM rx_stats WHERE period_end < ? LIMIT ?)",
+                (cutoff, self.chunk_size)
+            ).rowcount
+            report["rx_stats_removed"] += removed
+            if removed < self.chunk_size:
+                return
+            time.sleep(self.pause)
+
+    def _prune_print_jobs(self, conn, deadline, report):
+        if not self.print_jobs_retention_days:
+            return
+        # Handoff tables keep Unix timestamps rather than SQLAlchemy DateTime text
+        cutoff = time.time() - self.print_jobs_retention_days * 86400
+        report.setdefault("print_jobs_removed", 0)
+        while True:
+            if time.monotonic() >= deadline:
+                report["complete"] = False
+                return
+            removed = conn.execute(
+                "DELETE FROM print_jobs WHERE id IN (SELECT id FROM print_jobs WHERE printed_at < ? LIMIT ?)",
+                (cutoff, self.chunk_size)
+            ).rowcount
+            removed += conn.execute(
+                "DELETE FROM print_ledger WHERE rowid IN (SELECT rowid FROM print_ledger"
+                " WHERE state IN ('printed', 'failed') AND updated_at < ? LIMIT ?)",
+                (cutoff, self.chunk_size)
+            ).rowcount
+            report["print_jobs_removed"] += removed
+            if removed < self.chunk_size:
+                break
+            time.sleep(self.pause)
+        conn.execute("DELETE FROM instances WHERE last_seen < ?", (time.time() - 86400,))
+
+    def _incremental_vacuum(self, conn, deadline, report):
+        if self._pragma(conn, "auto_vacuum") != 2:
+            # Switching an existing database to incremental needs a full VACUUM,
+            # which would lock it for too long to do here
+            report["vacuum"] = "auto_vacuum is not INCREMENTAL, run PRAGMA auto_vacuum=INCREMENTAL; VACUUM offline to enable"
+            return
+        while self._pragma(conn, "freelist_count") > 0:
+            if time.monotonic() >= deadline:
+                report["complete"] = False
+                return
+            # The sqlite3 module steps a PRAGMA without result columns only once,
+            # and each step frees a single page, so free a chunk one page at a time
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for _ in range(self.vacuum_pages):
+                    conn.execute("PRAGMA incremental_vacuum(1)")
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+            time.sleep(self.pause)
+
+    def _analyze(self, conn, deadline, report):
+        # analysis_limit samples each index instead of scanning it, keeping ANALYZE short
+        conn.execute("PRAGMA analysis_limit=1000")
+        conn.execute("ANALYZE")
+
+    def _checkpoint(self, conn, deadline, report):
+        # PASSIVE never waits on readers or writers; whatever it cannot copy now
+        # is left for the next checkpoint
+        busy, wal_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        report["wal_pages"] = wal_pages
+        report["wal_checkpointed"] = checkpointed
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "rows_removed": self.rows_removed,
+            "bytes_reclaimed": self.bytes_reclaimed,
+            "last_run": self.last_run,
+        }
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Database maintenance failed: {e}")
+
+    def start(self):
+        """Start the maintenance scheduler thread"""
+        if self._thread is None and self.interval:
+            self._thread = threading.Thread(target=self._loop, name="db-maintenance", daemon=True)
+            self._thread.start()
+            logger.info(f"Database maintenance every {self.interval}s, pruning nodes not seen in "
+                        f"{self.node_retention_days} days")
+        return self
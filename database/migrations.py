@@ -0,0 +1,212 @@
+import logging
+import sqlite3
+import threading
+import time
+
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from .models import Base
+
+logger = logging.getLogger('telegramtastic.migrations')
+
+# Missing indexes on tables with up to this many rows are built at startup;
+# larger ones are left to IndexBuilder so startup isn't held up
+INDEX_INLINE_ROWS = 50000
+
+_dialect = sqlite.dialect()
+
+# External-content FTS5 index over print_history: the text is stored once, in
+# print_history, and the triggers add and remove index entries with each row
+PRINT_HISTORY_FTS = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS print_history_fts USING fts5(
+        text, short_name, long_name,
+        content='print_history', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS print_history_ai AFTER INSERT ON print_history BEGIN
+        INSERT INTO print_history_fts(rowid, text, short_name, long_name)
+        VALUES (new.id, new.text, new.short_name, new.long_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS print_history_ad AFTER DELETE ON print_history BEGIN
+        INSERT INTO print_history_fts(print_history_fts, rowid, text, short_name, long_name)
+        VALUES ('delete', old.id, old.text, old.short_name, old.long_name);
+    END""",
+    # Index any history written before the table existed
+    "INSERT INTO print_history_fts(print_history_fts) VALUES ('rebuild')",
+]
+
+def create_history_index(conn):
+    """Create the print history full-text index, if this SQLite build has FTS5 and it doesn't exist yet"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'print_history_fts'").fetchone():
+        return
+    conn.execute("SAVEPOINT print_history_fts")
+    try:
+        for statement in PRINT_HISTORY_FTS:
+            conn.execute(statement)
+        conn.execute("RELEASE print_history_fts")
+    except sqlite3.OperationalError as e:
+        conn.execute("ROLLBACK TO print_history_fts")
+        conn.execute("RELEASE print_history_fts")
+        logger.warning(f"Print history search is unavailable, SQLite has no FTS5 support: {e}")
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+
+def _add_column(conn, table, column, definition):
+    """ALTER TABLE ADD COLUMN, unless the table already has it from being created by a later version"""
+    if column not in _columns(conn, table):
+        logger.info(f"Adding {column} column to {table} table")
+        conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {definition}')
+
+def _create_tables(conn, tables):
+    """Create tables that don't exist yet; their indexes are added by migrate() afterwards"""
+    for table in tables:
+        conn.execute(str(CreateTable(table, if_not_exists=True).compile(dialect=_dialect)))
+
+def _baseline(conn):
+    # Databases from before versioning may have any subset of these
+    _create_tables(conn, Base.metadata.sorted_tables)
+    _add_column(conn, "nodes", "last_print", "DATETIME")
+
+def _print_history_search(conn):
+    create_history_index(conn)
+
+# Ordered schema changes as (version, description, step). Steps run in one
+# transaction with the rest of a migration and must be safe to run on a
+# database that already has the change, since a new database gets its tables
+# from the models as they are now. Don't build indexes on existing tables in
+# a step: add them to the model, and migrate() builds any that are missing.
+MIGRATIONS = [
+    (1, "tables and columns from before schema versioning", _baseline),
+    (2, "print history full-text search", _print_history_search),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def _user_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def _row_count(conn, table, limit):
+    """Rows in table, counting no further than limit + 1"""
+    return conn.execute(f'SELECT count(*) FROM (SELECT 1 FROM "{table}" LIMIT ?)', (limit + 1,)).fetchone()[0]
+
+def migrate(conn, inline_rows=INDEX_INLINE_ROWS):
+    """
+    Bring the schema up to SCHEMA_VERSION and find the indexes it is missing
+
+    A database already at SCHEMA_VERSION costs two queries: PRAGMA
+    user_version and one read of sqlite_master. Otherwise every step past
+    the stored version runs in a single IMMEDIATE transaction, which also
+    keeps instances sharing the database from migrating it at once.
+
+    Args:
+        conn (sqlite3.Connection): Connection in autocommit mode (isolation_level None)
+        inline_rows (int): Missing indexes on tables up to this size are built now
+
+    Returns:
+        list: (index name, table, CREATE INDEX statement) for indexes left to build in the background
+    """
+    version = _user_version(conn)
+    migrated = False
+    if version > SCHEMA_VERSION:
+        logger.warning(f"Database schema version {version} is newer than this version of telegramtastic "
+                       f"({SCHEMA_VERSION}), leaving it as it is")
+    elif version < SCHEMA_VERSION:
+        started = time.monotonic()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another instance may have migrated while we waited for the lock
+            version = _user_version(conn)
+            for step_version, description, step in MIGRATIONS:
+                if step_version > version:
+                    logger.info(f"Migrating database to version {step_version}: {description}")
+                    step(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        migrated = True
+        logger.info(f"Database migrated from version {version} to {SCHEMA_VERSION} "
+                    f"in {(time.monotonic() - started) * 1000:.0f} ms")
+    else:
+        logger.debug(f"Database schema is up to date (version {version})")
+
+    existing = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'index')")}
+    if "print_history_fts" not in existing and not migrated:
+        # Left out by a SQLite without FTS5; try again in case it has it now
+        create_history_index(conn)
+
+    deferred = []
+    for table in Base.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in existing:
+                continue
+            statement = str(CreateIndex(index, if_not_exists=True).compile(dialect=_dialect))
+            if _row_count(conn, table.name, inline_rows) <= inline_rows:
+                conn.execute(statement)
+            else:
+                deferred.append((index.name, table.name, statement))
+    return deferred
+
+class IndexBuilder:
+    """
+    Builds indexes missing from large tables after startup.
+
+    SQLite builds an index in a single statement that holds the write lock
+    throughout, so the work can't be split below one index. Indexes are
+    built one at a time, each in its own transaction on a separate
+    connection, with a pause between them so packet processing gets the
+    lock back. Queries run without the index, just slower, until it is
+    built. If the process stops first, the next startup finds the index
+    still missing and builds it then.
+    """
+
+    def __init__(self, db_path, indexes, pause=1.0, busy_timeout=30.0):
+        self.db_path = db_path
+        self.pending = list(indexes)
+        self.pause = pause
+        self.busy_timeout = busy_timeout
+
+        self._thread = None
+        self.built = []
+        self.failed = []
+        self.building = None
+
+    def run(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+        try:
+            while self.pending:
+                name, table, statement = self.pending[0]
+                self.building = name
+                started = time.monotonic()
+                try:
+                    conn.execute(statement)
+                    elapsed_ms = round((time.monotonic() - started) * 1000, 1)
+                    self.built.append({"index": name, "table": table, "ms": elapsed_ms})
+                    logger.info(f"Built index {name} on {table} in {elapsed_ms} ms")
+                except sqlite3.Error as e:
+                    self.failed.append({"index": name, "table": table, "error": str(e)})
+                    logger.error(f"Error building index {name} on {table}: {e}")
+                self.pending.pop(0)
+                self.building = None
+                time.sleep(self.pause)
+        finally:
+            conn.close()
+
+    def stats(self):
+        return {
+            "pending": [name for name, _, _ in self.pending],
+            "building": self.building,
+            "built": self.built,
+            "failed": self.failed,
+        }
+
+    def start(self):
+        """Start building in a background thread"""
+        if self._thread is None and self.pending:
+            logger.info(f"Building {len(self.pending)} index(es) on large tables in the background: "
+                        f"{', '.join(name for name, _, _ in self.pending)}")
+            self._thread = threading.Thread(target=self.run, name="index-builder", daemon=True)
+            self._thread.start()
+        return self
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Float, BigInteger, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Float, BigInteger, Boolean, Index, UniqueConstraint, LargeBinary, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from datetime import datetime, timezone
@@ -12,7 +12,13 @@ class NodeInfo(Base):
     """
     __tablename__ = 'nodes'
     
-    # Removed MySQL-specific table_args as they're not needed for SQLite
+    # NOCASE indexes let case-insensitive LIKE 'prefix%' searches use an index range scan
+    __table_args__ = (
+        Index('ix_nodes_short_name', text('short_name COLLATE NOCASE')),
+        Index('ix_nodes_long_name', text('long_name COLLATE NOCASE')),
+        Index('ix_nodes_last_seen', 'last_seen'),
+        Index('ix_nodes_hw_model_name', 'hw_model_name'),
+    )
 
     # Primary key - node_id will be unique
     node_id = Column(BigInteger, primary_key=True, nullable=False)
@@ -30,3 +36,205 @@ class NodeInfo(Base):
 
     def __repr__(self):
         return f"<NodeInfo(node_id={self.node_id}, short_name='{self.short_name}')>"
+
+
+class RxStat(Base):
+    """
+    Reception statistics for one gateway, node or channel over one flush period.
+    Written in batches by RxStatsAggregator.
+    """
+    __tablename__ = 'rx_stats'
+
+    __table_args__ = (
+        Index('ix_rx_stats_kind_period', 'kind', 'period_end'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(8), nullable=False)  # "gateway", "node" or "channel"
+    key = Column(Text, nullable=False)  # Gateway ID, node ID or channel name
+    period_start = Column(DateTime, nullable=False)
+    period_end = Column(DateTime, nullable=False)
+
+    packets = Column(Integer, nullable=False, default=0)
+    first_arrivals = Column(Integer, nullable=True)  # Packets this gateway delivered before any other
+    duplicates = Column(Integer, nullable=True)
+    dup_delay_ms = Column(Float, nullable=True)  # Mean delay of duplicates behind the first copy
+    snr_p50 = Column(Float, nullable=True)
+    snr_p10 = Column(Float, nullable=True)
+    rssi_p50 = Column(Integer, nullable=True)
+    rssi_p10 = Column(Integer, nullable=True)
+    hops_avg = Column(Float, nullable=True)
+
+    def __repr__(self):
+        return f"<RxStat(kind='{self.kind}', key='{self.key}', packets={self.packets})>"
+
+
+class PrinterLease(Base):
+    """
+    Which app.py instance currently drives a printer.
+    The owner renews the lease well before expires_at; once it lapses any
+    other instance sharing the database may take it over.
+    """
+    __tablename__ = 'printer_leases'
+
+    printer = Column(String(64), primary_key=True)
+    owner = Column(String(128), nullable=False)  # Instance ID, the MQTT client ID
+    # Unix time, since it is compared across processes
+    acquired_at = Column(Float, nullable=False)
+    expires_at = Column(Float, nullable=False)
+
+    def __repr__(self):
+        return f"<PrinterLease(printer='{self.printer}', owner='{self.owner}')>"
+
+
+class SharedPrintJob(Base):
+    """
+    A telegram handed off by any instance to the one that owns the printer.
+    The unique constraint means a packet delivered to several instances is
+    only queued, and printed, once.
+    """
+    __tablename__ = 'print_jobs'
+
+    __table_args__ = (
+        UniqueConstraint('printer', 'from_node', 'packet_id', name='uq_print_jobs_packet'),
+        Index('ix_print_jobs_pending', 'printer', 'claimed_by', 'id'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    printer = Column(String(64), nullable=False)
+    from_node = Column(BigInteger, nullable=False)
+    packet_id = Column(BigInteger, nullable=False)
+    priority = Column(String(16), nullable=True)
+    payload = Column(Text, nullable=False)  # JSON: sender and recipient names, text, received time
+    instance = Column(String(128), nullable=False)  # Instance that decoded the packet
+    created_at = Column(Float, nullable=False)
+    claimed_by = Column(String(128), nullable=True)  # Printer owner that queued it for printing
+    claimed_at = Column(Float, nullable=True)
+    printed_at = Column(Float, nullable=True)
+
+    def __repr__(self):
+        return f"<SharedPrintJob(id={self.id}, from_node={self.from_node}, packet_id={self.packet_id})>"
+
+
+class InstanceHeartbeat(Base):
+    """Latest throughput counters reported by each running app.py instance"""
+    __tablename__ = 'instances'
+
+    instance_id = Column(String(128), primary_key=True)
+    role = Column(String(16), nullable=False)  # "owner" or "standby"
+    last_seen = Column(Float, nullable=False)
+    received = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    handed_off = Column(Integer, nullable=False, default=0)
+    printed = Column(Integer, nullable=False, default=0)
+    rate = Column(Float, nullable=True)  # Messages per second since the previous heartbeat
+
+    def __repr__(self):
+        return f"<InstanceHeartbeat(instance_id='{self.instance_id}', role='{self.role}')>"
+
+
+class PrintLedgerEntry(Base):
+    """
+    Durable state of one telegram queued for printing on this instance.
+    Written in batches by PrintLedger; unfinished entries are printed again
+    at startup.
+    """
+    __tablename__ = 'print_ledger'
+
+    __table_args__ = (
+        Index('ix_print_ledger_state', 'state', 'updated_at'),
+    )
+
+    from_node = Column(BigInteger, primary_key=True)
+    packet_id = Column(BigInteger, primary_key=True)
+    state = Column(String(8), nullable=False)  # "queued", "printing", "printed" or "failed"
+    priority = Column(String(16), nullable=True)
+    payload = Column(Text, nullable=True)  # JSON: sender and recipient names, text, received time
+    error = Column(Text, nullable=True)
+    # Unix time, like the handoff tables
+    created_at = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)
+
+    def __repr__(self):
+        return f"<PrintLedgerEntry(from_node={self.from_node}, packet_id={self.packet_id}, state='{self.state}')>"
+
+class PrintHistoryEntry(Base):
+    """
+    One printed telegram, kept as a record of what was printed. The text and
+    sender names are indexed for full-text search by the print_history_fts
+    FTS5 table, which triggers keep in step with this one.
+    """
+    __tablename__ = 'print_history'
+
+    __table_args__ = (
+        Index('ix_print_history_printed_at', 'printed_at'),
+        Index('ix_print_history_from_node', 'from_node', 'printed_at'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # Unix time
+    printed_at = Column(Float, nullable=False)
+    received_at = Column(Float, nullable=True)
+    from_node = Column(BigInteger, nullable=True)
+    packet_id = Column(BigInteger, nullable=True)
+    # Names as printed on the receipt
+    short_name = Column(String(10), nullable=True)
+    long_name = Column(String(40), nullable=True)
+    to_name = Column(String(40), nullable=True)
+    priority = Column(String(16), nullable=True)
+    source = Column(String(8), nullable=False)  # "mqtt" (app.py) or "dm" (app-dm.py)
+    text = Column(Text, nullable=False)
+
+    def __repr__(self):
+        return f"<PrintHistoryEntry(id={self.id}, from_node={self.from_node}, printed_at={self.printed_at})>"
+
+class ReceiptHeader(Base):
+    """ESC/POS bytes shared by the start of many stored receipts, kept once"""
+    __tablename__ = 'receipt_headers'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    digest = Column(String(40), nullable=False, unique=True)  # SHA-1 of data
+    data = Column(LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f"<ReceiptHeader(id={self.id}, bytes={len(self.data)})>"
+
+class StoredReceipt(Base):
+    """
+    The ESC/POS byte stream of one printed receipt, kept for reprints.
+    body is the stream after its header, zlib-compressed with the header as
+    preset dictionary. Rows are evicted least recently used first.
+    """
+    __tablename__ = 'receipts'
+
+    __table_args__ = (
+        Index('ix_receipts_used_at', 'used_at'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    header_id = Column(Integer, ForeignKey('receipt_headers.id'), nullable=True)
+    body = Column(LargeBinary, nullable=False)
+    size = Column(Integer, nullable=False)  # Uncompressed length of the whole stream
+    # Unix time
+    printed_at = Column(Float, nullable=False)
+    used_at = Column(Float, nullable=False)  # Printed or last reprinted
+    reprints = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<StoredReceipt(id={self.id}, size={self.size}, printed_at={self.printed_at})>"
+
+class ReceiptKey(Base):
+    """The stored receipt each telegram was printed on; a digest receipt has one key per telegram"""
+    __tablename__ = 'receipt_keys'
+
+    __table_args__ = (
+        Index('ix_receipt_keys_packet_id', 'packet_id'),
+        Index('ix_receipt_keys_receipt_id', 'receipt_id'),
+    )
+
+    from_node = Column(BigInteger, primary_key=True)
+    packet_id = Column(BigInteger, primary_key=True)
+    receipt_id = Column(Integer, ForeignKey('receipts.id', ondelete='CASCADE'), nullable=False)
+
+    def __repr__(self):
+        return f"<ReceiptKey(from_node={self.from_node}, packet_id={self.packet_id}, receipt_id={self.receipt_id})>"
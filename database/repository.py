@@ -1,7 +1,15 @@
+import csv
+import json
 import logging
+import re
+import time
+import unicodedata
+from sqlalchemy import select, insert, update, delete, func, or_, case, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime, timezone
-from .models import NodeInfo
+from .models import (NodeInfo, RxStat, PrinterLease, SharedPrintJob, InstanceHeartbeat, PrintLedgerEntry, PrintHistoryEntry,
+                     ReceiptHeader, StoredReceipt, ReceiptKey)
 
 logger = logging.getLogger('telegramtastic.repository')
 
@@ -80,6 +88,45 @@ class NodeRepository:
         finally:
             session.close()
     
+    def save_nodes(self, nodes):
+        """
+        Save or update many nodes in a single transaction
+
+        Like save_or_update_node, names and hardware model are only changed
+        where a new value is given, and last_seen is set for every node.
+
+        Args:
+            nodes (list): Dicts with node_id and any of short_name, long_name, hw_model_name and hw_model_id
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if not nodes:
+            return True
+        fields = ('short_name', 'long_name', 'hw_model_name', 'hw_model_id')
+        now = datetime.now(timezone.utc)
+        rows = [{'node_id': node['node_id'], **{field: node.get(field) for field in fields},
+                 'first_seen': now, 'last_seen': now} for node in nodes]
+        statement = sqlite_insert(NodeInfo)
+        statement = statement.on_conflict_do_update(
+            index_elements=[NodeInfo.node_id],
+            set_={
+                **{field: func.coalesce(getattr(statement.excluded, field), getattr(NodeInfo, field)) for field in fields},
+                'last_seen': statement.excluded.last_seen,
+            }
+        )
+        session = self.session_factory()
+        try:
+            session.execute(statement, rows)
+            session.commit()
+            return True
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"SQLite database error while saving {len(rows)} nodes: {e}")
+            return False
+        finally:
+            session.close()
+
     def get_node_by_id(self, node_id):
         """Get a node by its ID"""
         session = self.session_factory()
@@ -141,24 +188,19 @@ class NodeRepository:
         Returns:
             bool: True if successful, False otherwise
         """
+        now = datetime.now(timezone.utc)
+        # A single upsert, so instances sharing the database can't both try to
+        # create the same node. Creates the node if it doesn't exist yet.
+        statement = sqlite_insert(NodeInfo).values(node_id=node_id, last_print=now)
+        statement = statement.on_conflict_do_update(
+            index_elements=[NodeInfo.node_id],
+            set_={"last_print": now, "last_seen": now}
+        )
         session = self.session_factory()
         try:
-            node = session.query(NodeInfo).filter_by(node_id=node_id).first()
-            
-            if not node:
-                # Node doesn't exist, create it with current timestamp
-                new_node = NodeInfo(
-                    node_id=node_id,
-                    last_print=datetime.now(timezone.utc)
-                )
-                session.add(new_node)
-                logger.info(f"Created new node {node_id} with last_print timestamp")
-            else:
-                # Update existing node
-                node.last_print = datetime.now(timezone.utc)
-                logger.debug(f"Updated last_print for node {node_id}")
-            
+            session.execute(statement)
             session.commit()
+            logger.debug(f"Updated last_print for node {node_id}")
             return True
             
         except SQLAlchemyError as e:
@@ -167,3 +209,946 @@ class NodeRepository:
             return False
         finally:
             session.close()
+
+    # Node directory queries
+    #
+    # These select plain column tuples instead of ORM objects, so results are
+    # cheap to build and safe to use after the session is closed.
+
+    EXPORT_COLUMNS = ('node_id', 'short_name', 'long_name', 'hw_model_name', 'hw_model_id',
+                      'first_seen', 'last_seen', 'last_print')
+
+    @classmethod
+    def _columns(cls):
+        return [getattr(NodeInfo, name) for name in cls.EXPORT_COLUMNS]
+
+    def _fetch(self, statement, description):
+        session = self.session_factory()
+        try:
+            return [row._asdict() for row in session.execute(statement)]
+        except SQLAlchemyError as e:
+            logger.error(f"Database error while {description}: {e}")
+            return []
+        finally:
+            session.close()
+
+    def search_nodes(self, prefix, limit=50):
+        """
+        Find nodes whose short or long name starts with a prefix (case-insensitive)
+
+        Args:
+            prefix (str): Name prefix to match
+            limit (int): Maximum number of nodes to return
+
+        Returns:
+            list: Node dicts ordered by short name
+        """
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        statement = (
+            select(*self._columns())
+            .where(or_(NodeInfo.short_name.like(escaped, escape='\\'),
+                       NodeInfo.long_name.like(escaped, escape='\\')))
+            .order_by(NodeInfo.short_name, NodeInfo.node_id)
+            .limit(limit)
+        )
+        return self._fetch(statement, f"searching nodes for {prefix!r}")
+
+    def nodes_seen_since(self, since, until=None, limit=None):
+        """
+        List nodes last seen within a time window
+
+        Args:
+            since (datetime): Start of the window (UTC)
+            until (datetime, optional): End of the window (UTC), defaults to now
+            limit (int, optional): Maximum number of nodes to return
+
+        Returns:
+            list: Node dicts, most recently seen first
+        """
+        statement = select(*self._columns()).where(NodeInfo.last_seen >= _naive_utc(since))
+        if until is not None:
+            statement = statement.where(NodeInfo.last_seen < _naive_utc(until))
+        statement = statement.order_by(NodeInfo.last_seen.desc())
+        if limit is not None:
+            statement = statement.limit(limit)
+        return self._fetch(statement, "listing recently seen nodes")
+
+    def count_by_hw_model(self):
+        """
+        Count nodes per hardware model
+
+        Returns:
+            dict: Node count keyed by hw_model_name, largest first
+        """
+        statement = (
+            select(NodeInfo.hw_model_name, func.count().label('nodes'))
+            .group_by(NodeInfo.hw_model_name)
+            .order_by(func.count().desc())
+        )
+        return {row['hw_model_name']: row['nodes'] for row in self._fetch(statement, "counting nodes by hardware model")}
+
+    def list_nodes(self, after_node_id=None, limit=100):
+        """
+        List nodes in node_id order, one page at a time
+
+        Pass the node_id of the last node on the previous page as after_node_id
+        to fetch the next page. Unlike OFFSET, this costs the same for every page.
+
+        Args:
+            after_node_id (int, optional): Only return nodes with a larger node_id
+            limit (int): Page size
+
+        Returns:
+            list: Node dicts ordered by node_id
+        """
+        statement = select(*self._columns()).order_by(NodeInfo.node_id).limit(limit)
+        if after_node_id is not None:
+            statement = statement.where(NodeInfo.node_id > after_node_id)
+        return self._fetch(statement, "listing nodes")
+
+    def node_names(self, batch_size=5000):
+        """
+        Yield (node_id, short_name, long_name) for every node in node_id order
+
+        Rows are fetched batch_size at a time, so memory use does not grow
+        with the size of the table.
+        """
+        statement = (
+            select(NodeInfo.node_id, NodeInfo.short_name, NodeInfo.long_name)
+            .order_by(NodeInfo.node_id)
+            .execution_options(yield_per=batch_size)
+        )
+        session = self.session_factory()
+        try:
+            for row in session.execute(statement):
+                yield tuple(row)
+        finally:
+            session.close()
+
+    def export_nodes(self, fp, fmt='csv', batch_size=1000):
+        """
+        Stream every node to a file object as CSV or NDJSON
+
+        Rows are fetched from the cursor batch_size at a time and written
+        immediately, so memory use does not grow with the size of the table.
+
+        Args:
+            fp: Text file object to write to
+            fmt (str): 'csv' or 'ndjson'
+            batch_size (int): Rows fetched per batch
+
+        Returns:
+            int: Number of nodes written, or None on database error
+        """
+        if fmt not in ('csv', 'ndjson'):
+            raise ValueError(f"Unsupported export format: {fmt}")
+        statement = select(*self._columns()).order_by(NodeInfo.node_id).execution_options(yield_per=batch_size)
+        writer = csv.writer(fp) if fmt == 'csv' else None
+        if writer:
+            writer.writerow(self.EXPORT_COLUMNS)
+        session = self.session_factory()
+        count = 0
+        try:
+            for row in session.execute(statement):
+                if writer:
+                    writer.writerow(['' if value is None else _format_value(value) for value in row])
+                else:
+                    fp.write(json.dumps(dict(zip(self.EXPORT_COLUMNS, row)), default=_format_value) + '\n')
+                count += 1
+            return count
+        except SQLAlchemyError as e:
+            logger.error(f"Database error while exporting nodes: {e}")
+            return None
+        finally:
+            session.close()
+
+
+class RxStatRepository:
+    """Repository for batched reception statistics"""
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+
+    def save_rows(self, rows):
+        """
+        Insert one flush period of reception statistics in a single transaction
+
+        Args:
+            rows (list): Row dicts from RxStatsAggregator.flush(), with period
+                start and end as Unix timestamps
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        rows = [
+            {**row,
+             "period_start": datetime.fromtimestamp(row["period_start"], timezone.utc),
+             "period_end": datetime.fromtimestamp(row["period_end"], timezone.utc)}
+            for row in rows
+        ]
+        session = self.session_factory()
+        try:
+            session.execute(insert(RxStat), rows)
+            session.commit()
+            return True
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Database error while saving {len(rows)} reception stats rows: {e}")
+            return False
+        finally:
+            session.close()
+
+    def summary(self, kind, since, limit=20):
+        """
+        Total reception statistics per gateway, node or channel since a given time
+
+        Gateways are ranked by how many packets they delivered first, which is
+        what matters when choosing which ones to subscribe to.
+
+        Args:
+            kind (str): 'gateway', 'node' or 'channel'
+            since (datetime): Start of the window (UTC)
+            limit (int): Maximum number of rows to return
+
+        Returns:
+            list: Dicts with summed counters and packet-weighted signal averages
+        """
+        def weighted(column):
+            return func.sum(column * RxStat.packets * 1.0) / func.sum(case((column.is_(None), 0), else_=RxStat.packets))
+
+        statement = (
+            select(
+                RxStat.key,
+                func.sum(RxStat.packets).label('packets'),
+                func.sum(RxStat.first_arrivals).label('first_arrivals'),
+                func.sum(RxStat.duplicates).label('duplicates'),
+                weighted(RxStat.dup_delay_ms).label('dup_delay_ms'),
+                weighted(RxStat.snr_p50).label('snr_p50'),
+                weighted(RxStat.rssi_p50).label('rssi_p50'),
+                weighted(RxStat.hops_avg).label('hops_avg'),
+                func.max(RxStat.period_end).label('last_period'),
+            )
+            .where(RxStat.kind == kind, RxStat.period_end >= _naive_utc(since))
+            .group_by(RxStat.key)
+            .order_by(func.sum(RxStat.first_arrivals if kind == 'gateway' else RxStat.packets).desc())
+            .limit(limit)
+        )
+        session = self.session_factory()
+        try:
+            return [row._asdict() for row in session.execute(statement)]
+        except SQLAlchemyError as e:
+            logger.error(f"Database error while summarizing {kind} reception stats: {e}")
+            return []
+        finally:
+            session.close()
+
+
+class PrintHandoffRepository:
+    """Repository for printer leases, handed-off print jobs and instance heartbeats"""
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+
+    def acquire_lease(self, printer, owner, ttl):
+        """
+        Take or renew the lease on a printer
+
+        The lease is only written if it is free, already ours, or has expired,
+        in a single statement so two instances can never both win it.
+
+        Args:
+            printer (str): Printer name
+            owner (str): Instance ID asking for the lease
+            ttl (float): Seconds the lease is valid for
+
+        Returns:
+            tuple: (owner, expires_at) of the lease after the attempt, or None on database error
+        """
+        now = time.time()
+        statement = sqlite_insert(PrinterLease).values(printer=printer, owner=owner, acquired_at=now, expires_at=now + ttl)
+        statement = statement.on_conflict_do_update(
+            index_elements=[PrinterLease.printer],
+            set_={
+                "owner": statement.excluded.owner,
+                "expires_at": statement.excluded.expires_at,
+                # Keep the original acquisition time when renewing
+                "acquired_at": case((PrinterLease.owner == statement.excluded.owner, PrinterLease.acquired_at),
+                                    else_=statement.excluded.acquired_at),
+            },
+            where=or_(PrinterLease.owner == statement.excluded.owner, PrinterLease.expires_at < now)
+        )
+        session = self.session_factory()
+        try:
+            session.execute(statement)
+            session.commit()
+            row = session.execute(
+                select(PrinterLease.owner, PrinterLease.expires_at).where(PrinterLease.printer == printer)
+            ).first()
+            return tuple(row) if row else None
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Database error while acquiring the lease on printer {printer}: {e}")
+            return None
+        finally:
+            session.close()
+
+    def release_lease(self, printer, owner):
+        """Give up the lease on a printer if we hold it, so another instance can take over at once"""
+        session = self.session_factory()
+        try:
+            session.execute(delete(PrinterLease).where(PrinterLease.printer == printer, PrinterLease.owner == owner))
+            session.commit()
+            return True
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Database error while releasing the lease on printer {printer}: {e}")
+            return False
+        finally:
+            session.close()
+
+    def add_job(self, printer, instance, from_node, packet_id, priority, payload):
+        """
+        Hand a telegram to the printer owner
+
+        Args:
+            printer (str): Printer name
+            instance (str): Instance ID that decoded the packet
+            from_node (int): Sender node ID
+            packet_id (int): Meshtastic packet ID
+            priority (str): PrintScheduler class name
+            payload (dict): Everything needed to print the telegram, stored as JSON
+
+        Returns:
+            bool: True if queued, False if the packet was already queued or on database error
+        """
+        statement = sqlite_insert(SharedPrintJob).values(
+            printer=printer, instance=instance, from_node=from_node, packet_id=packet_id, priority=priority,
+            payload=json.dumps(payload), created_at=time.time()
+        ).on_conflict_do_nothing()
+        session = self.session_factory()
+        try:
+            added = session.execute(statement).rowcount
+            session.commit()
+            return added == 1
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Database error while handing off packet {packet_id} from node {from_node}: {e}")
+            return False
+        finally:
+            session.close()
+
+    def claim_jobs(self, printer, owner, limit=20):
+        """
+        Claim the oldest unclaimed telegrams for a printer
+
+        Returns:
+            list: Dicts with id, from_node, priority and the decoded payload, oldest first
+        """
+        pending = (
+            select(SharedPrintJob.id)
+            .where(SharedPrintJob.printer == printer, SharedPrintJob.claimed_by.is_(None))
+            .order_by(SharedPrintJob.id)
+            .limit(limit)
+            .scalar_subquery()
+        )
+        statement = (
+            update(SharedPrintJob)
+            .where(SharedPrintJob.id.in_(pending), SharedPrintJob.claimed_by.is_(None))
+            .values(claimed_by=owner, claimed_at=time.time())
+            .returning(SharedPrintJob.id, SharedPrintJob.from_node, SharedPrintJob.priority, SharedPrintJob.payload)
+        )
+        session = self.session_factory()
+        try:
+            rows = session.execute(statement).all()
+            session.commit()
+            return sorted(({"id": row.id, "from_node": row.from_node, "priority": row.priority,
+                            "payload": json.loads(row.payload)} for row in rows), key=lambda job: job["id"])
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Database error while claiming print jobs for printer {printer}: {e}")
+            return []
+        finally:
+            session.close()
+
+    def release_claims(self, printer):
+        """
+        Return claimed but unprinted telegrams to the pending pool
+
+        Called by a new printer owner, since whoever claimed them no longer
+        holds the lease.
+
+        Returns:
+            int: Number of telegrams released, or 0 on database error
+        """
+        session = self.session_factory()
+        try:
+            released = session.execute(
+                update(SharedPrintJob)
+                .where(SharedPrintJob.printer == printer, SharedPrintJob.claimed_by.is_not(None),
+                       SharedPrintJob.printed_at.is_(None))
+                .values(claimed_by=None, claimed_at=None)
+            ).rowcount
+            session.commit()
+            return released
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Database error while releasing print jobs for printer {printer}: {e}")
+            return 0
+        finally:
+            session.close()
+
+    def release_job(self, job_id):
+        """
+        Return one claimed telegram to the pending pool, e.g. after its print failed
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        session = self.session_factory()
+        try:
+            session.execute(
+                update(SharedPrintJob)
+                .where(SharedPrintJob.id == job_id, SharedPrintJob.printed_at.is_(None))
+                .values(claimed_by=None, claimed_at=None)
+            )
+            session.commit()
+            return True
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Database error while releasing print job {job_id}: {e}")
+            return False
+        finally:
+            session.close()
+
+    def mark_printed(self, job_id):
+        """Record that a handed-off telegram has been printed"""
+        session = self.session_factory()
+        try:
+            session.execute(update(SharedPrintJob).where(SharedPrintJob.id == job_id).values(printed_at=time.time()))
+            session.commit()
+            return True
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Database error while marking print job {job_id} printed: {e}")
+            return False
+        finally:
+            session.close()
+
+    def heartbeat(self, instance_id, role, **counters):
+        """Upsert this instance's role and throughput counters"""
+        values = {"instance_id": instance_id, "role": role, "last_seen": time.time(), **counters}
+        statement = sqlite_insert(InstanceHeartbeat).values(**values)
+        statement = statement.on_conflict_do_update(
+            index_elements=[InstanceHeartbeat.instance_id],
+            set_={key: value for key, value in values.items() if key != "instance_id"}
+        )
+        session = self.session_factory()
+        try:
+            session.execute(statement)
+            session.commit()
+            return True
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Database error while recording heartbeat for {instance_id}: {e}")
+            return False
+        finally:
+            session.close()
+
+    def instances(self, since):
+        """
+        Instances that sent a heartbeat since a given Unix time
+
+        Returns:
+            list: Heartbeat dicts, busiest instance first
+        """
+        statement = (
+            select(InstanceHeartbeat.__table__)
+            .where(InstanceHeartbeat.last_seen >= since)
+            .order_by(InstanceHeartbeat.rate.desc())
+        )
+        session = self.session_factory()
+        try:
+            return [row._asdict() for row in session.execute(statement)]
+        except SQLAlchemyError as e:
+            logger.error(f"Database error while listing instances: {e}")
+            return []
+        finally:
+            session.close()
+
+    def pending_count(self, printer):
+        """Number of telegrams waiting to be claimed for a printer"""
+        session = self.session_factory()
+        try:
+            return session.execute(
+                select(func.count()).select_from(SharedPrintJob)
+                .where(SharedPrintJob.printer == printer, SharedPrintJob.claimed_by.is_(None))
+            ).scalar()
+        except SQLAlchemyError as e:
+            logger.error(f"Database error while counting print jobs for printer {printer}: {e}")
+            return None
+        finally:
+            session.close()
+
+
+class PrintLedgerRepository:
+    """Repository for the durable print ledger"""
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+
+    def save_batch(self, rows):
+        """
+        Write a batch of ledger changes in a single transaction
+
+        New entries are inserted; for existing ones only the state, error and
+        update time change, so later rows need not repeat the payload.
+
+        Args:
+            rows (list): Dicts with every PrintLedgerEntry column, at most one per (from_node, packet_id),
+                with the payload as a dict
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        rows = [{**row, "payload": json.dumps(row["payload"]) if row["payload"] is not None else None} for row in rows]
+        statement = sqlite_insert(PrintLedgerEntry)
+        statement = statement.on_conflict_do_update(
+            index_elements=[PrintLedgerEntry.from_node, PrintLedgerEntry.packet_id],
+            set_={
+                "state": statement.excluded.state,
+                "error": statement.excluded.error,
+                "updated_at": statement.excluded.updated_at,
+            }
+        )
+        session = self.session_factory()
+        try:
+            session.execute(statement, rows)
+            session.commit()
+            return True
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Database error while writing {len(rows)} print ledger rows: {e}")
+            return False
+        finally:
+            session.close()
+
+    def recent(self, limit):
+        """
+        The most recently created ledger entries
+
+        Returns:
+            list: (from_node, packet_id, state) tuples, oldest first
+        """
+        statement = (
+            select(PrintLedgerEntry.from_node, PrintLedgerEntry.packet_id, PrintLedgerEntry.state)
+            .order_by(PrintLedgerEntry.created_at.desc())
+            .limit(limit)
+        )
+        session = self.session_factory()
+        try:
+            return [tuple(row) for row in session.execute(statement)][::-1]
+        except SQLAlchemyError as e:
+            logger.error(f"Database error while loading the print ledger: {e}")
+            return []
+        finally:
+            session.close()
+
+    def unfinished(self):
+        """
+        Telegrams that were queued or printing when the app last stopped
+
+        Returns:
+            list: Dicts with from_node, packet_id, state, priority and the decoded payload, oldest first
+        """
+        statement = (
+            select(PrintLedgerEntry.from_node, PrintLedgerEntry.packet_id, PrintLedgerEntry.state,
+                   PrintLedgerEntry.priority, PrintLedgerEntry.payload)
+            .where(PrintLedgerEntry.state.in_(("queued", "printing")))
+            .order_by(PrintLedgerEntry.created_at)
+        )
+        session = self.session_factory()
+        try:
+            return [{**row._asdict(), "payload": json.loads(row.payload)}
+                    for row in session.execute(statement) if row.payload]
+        except SQLAlchemyError as e:
+            logger.error(f"Database error while loading unfinished print ledger entries: {e}")
+            return []
+        finally:
+            session.close()
+
+
+def match_expression(query):
+    """
+    Turn free text into an FTS5 query matching every word, the last one as a prefix
+
+    Quoting each word means punctuation and FTS5 operators in what the user
+    typed are searched for as text rather than raising a syntax error.
+    """
+    words = ['"' + word.replace('"', '""') + '"' for word in query.split()]
+    if words:
+        words[-1] += "*"
+    return " ".join(words)
+
+WORD = re.compile(r"\w+")
+FTS_OPERATORS = {"AND", "OR", "NOT", "NEAR"}
+
+def _fold(word):
+    """Lower-case a word and strip its accents, as the unicode61 tokenizer does"""
+    return "".join(c for c in unicodedata.normalize("NFKD", word.casefold()) if not unicodedata.combining(c))
+
+def search_terms(query):
+    """The words of a search, folded for highlighting; FTS5 operators in raw queries are left out"""
+    return [_fold(word) for word in WORD.findall(query) if word not in FTS_OPERATORS]
+
+def snippet(text, terms, words=16):
+    """
+    Cut the part of a telegram around its first matching word, marking matches [like this]
+
+    Words match a term they start with, so prefix searches are highlighted too.
+    """
+    tokens = list(WORD.finditer(text))
+    matches = [any(_fold(token.group()).startswith(term) for term in terms) for token in tokens]
+    first = matches.index(True) if True in matches else 0
+    start = max(0, min(first - words // 4, len(tokens) - words))
+    shown = range(start, min(len(tokens), start + words))
+    if not shown:
+        return text
+    parts = ["..." if start > 0 else ""]
+    position = tokens[start].start()
+    for i in shown:
+        token = tokens[i]
+        parts.append(text[position:token.start()])
+        parts.append(f"[{token.group()}]" if matches[i] else token.group())
+        position = token.end()
+    parts.append("..." if shown.stop < len(tokens) else text[position:])
+    return "".join(parts)
+
+
+class PrintHistoryRepository:
+    """Repository for the printed telegram history and its full-text index"""
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+
+    def save_batch(self, rows):
+        """
+        Insert a batch of printed telegrams in a single transaction
+
+        Args:
+            rows (list): Dicts with every PrintHistoryEntry column except id
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        session = self.session_factory()
+        try:
+            session.execute(insert(PrintHistoryEntry), rows)
+            session.commit()
+            return True
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Database error while saving {len(rows)} print history rows: {e}")
+            return False
+        finally:
+            session.close()
+
+    def search(self, query, limit=20, node_id=None, since=None, raw=False):
+        """
+        Find printed telegrams by text or sender name, best matches first
+
+        Hits are ranked with BM25, a match in the text counting for more than
+        one in the sender's names. Names that were unknown when the telegram
+        was printed are filled in from the node table.
+
+        Args:
+            query (str): Words to find; with raw=True, an FTS5 query such as 'hello NEAR(world)'
+            limit (int): Maximum number of hits
+            node_id (int, optional): Only telegrams from this node
+            since (float, optional): Only telegrams printed after this Unix time
+
+        Returns:
+            list: Dicts with the history columns, resolved names, a highlighted snippet and the rank,
+                or None if the query is invalid or the index is missing
+        """
+        expression = query if raw else match_expression(query)
+        if not expression:
+            return []
+        # Rank inside the full-text table and join only the best hits to their rows. History
+        # ids only grow with printed_at, so "since" becomes a rowid range FTS5 seeks to.
+        # Snippets are cut from the text here: snippet() would run the match again per hit.
+        joins = filters = ""
+        params = {"query": expression, "limit": limit}
+        if node_id is not None:
+            joins = " JOIN print_history h ON h.id = print_history_fts.rowid"
+            filters += " AND h.from_node = :node_id"
+            params["node_id"] = node_id
+        if since is not None:
+            filters += (" AND print_history_fts.rowid >= (SELECT id FROM print_history WHERE printed_at >= :since"
+                        " ORDER BY printed_at LIMIT 1)")
+            params["since"] = since
+        statement = text(f"""
+            WITH hit AS (
+                SELECT print_history_fts.rowid AS id, bm25(print_history_fts, 4.0, 1.0, 1.0) AS rank
+                FROM print_history_fts{joins}
+                WHERE print_history_fts MATCH :query{filters}
+                ORDER BY rank
+                LIMIT :limit
+            )
+            SELECT h.id, h.printed_at, h.received_at, h.from_node, h.packet_id,
+                   COALESCE(NULLIF(h.short_name, 'UNK'), n.short_name, h.short_name) AS short_name,
+                   COALESCE(NULLIF(h.long_name, 'UNKNOWN'), n.long_name, h.long_name) AS long_name,
+                   h.to_name, h.priority, h.source, h.text, hit.rank
+            FROM hit
+            JOIN print_history h ON h.id = hit.id
+            LEFT JOIN nodes n ON n.node_id = h.from_node
+            ORDER BY hit.rank
+        """)
+        terms = search_terms(query)
+        session = self.session_factory()
+        try:
+            hits = [row._asdict() for row in session.execute(statement, params)]
+        except SQLAlchemyError as e:
+            logger.error(f"Database error while searching print history for {query!r}: {getattr(e, 'orig', e)}")
+            return None
+        finally:
+            session.close()
+        for hit in hits:
+            hit["snippet"] = snippet(hit["text"], terms)
+        return hits
+
+    def count(self):
+        """Number of telegrams in the history"""
+        session = self.session_factory()
+        try:
+            return session.execute(select(func.count()).select_from(PrintHistoryEntry)).scalar()
+        except SQLAlchemyError as e:
+            logger.error(f"Database error while counting print history: {e}")
+            return None
+        finally:
+            session.close()
+
+class ReceiptRepository:
+    """Repository for stored receipt byte streams, kept for reprints"""
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+
+    def headers(self):
+        """
+        Every stored header
+
+        Returns:
+            dict: (id, data) by SHA-1 digest
+        """
+        session = self.session_factory()
+        try:
+            return {row.digest: (row.id, row.data) for row in session.execute(select(ReceiptHeader))
+                    .scalars()}
+        except SQLAlchemyError as e:
+            logger.error(f"Database error while loading receipt headers: {e}")
+            return {}
+        finally:
+            session.close()
+
+    def save_header(self, digest, data):
+        """
+        Store a header unless it is already stored
+
+        Returns:
+            int: The header's id, or None on error
+        """
+        session = self.session_factory()
+        try:
+            session.execute(sqlite_insert(ReceiptHeader).values(digest=digest, data=data)
+                            .on_conflict_do_nothing(index_elements=[ReceiptHeader.digest]))
+            session.commit()
+            return session.execute(select(ReceiptHeader.id).where(ReceiptHeader.digest == digest)).scalar()
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Database error while saving a receipt header: {e}")
+            return None
+        finally:
+            session.close()
+
+    def save_batch(self, receipts):
+        """
+        Store a batch of receipts in a single transaction
+
+        A telegram that is already stored is pointed at its newest receipt.
+
+        Args:
+            receipts (list): Dicts with header_id, body, size, printed_at and keys,
+                a list of (from_node, packet_id) tuples
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        session = self.session_factory()
+        try:
+            for receipt in receipts:
+                receipt_id = session.execute(
+                    insert(StoredReceipt).returning(StoredReceipt.id),
+                    {"header_id": receipt["header_id"], "body": receipt["body"], "size": receipt["size"],
+                     "printed_at": receipt["printed_at"], "used_at": receipt["printed_at"], "reprints": 0}
+                ).scalar()
+                statement = sqlite_insert(ReceiptKey)
+                session.execute(
+                    statement.on_conflict_do_update(
+                        index_elements=[ReceiptKey.from_node, ReceiptKey.packet_id],
+                        set_={"receipt_id": statement.excluded.receipt_id}
+                    ),
+                    [{"from_node": from_node, "packet_id": packet_id, "receipt_id": receipt_id}
+                     for from_node, packet_id in receipt["keys"]]
+                )
+            session.commit()
+            return True
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Database error while storing {len(receipts)} receipts: {e}")
+            return False
+        finally:
+            session.close()
+
+    def stored_bytes(self):
+        """Compressed bytes held by all stored receipts, or None on error"""
+        session = self.session_factory()
+        try:
+            return session.execute(select(func.coalesce(func.sum(func.length(StoredReceipt.body)), 0))).scalar()
+        except SQLAlchemyError as e:
+            logger.error(f"Database error while sizing the receipt store: {e}")
+            return None
+        finally:
+            session.close()
+
+    def evict(self, nbytes, chunk=500):
+        """
+        Delete least recently used receipts until at least nbytes of bodies are gone
+
+        Telegrams whose receipt is deleted lose their key with it.
+
+        Returns:
+            tuple: (receipts deleted, bytes freed)
+        """
+        session = self.session_factory()
+        try:
+            deleted = freed = 0
+            while freed < nbytes:
+                rows = session.execute(
+                    select(StoredReceipt.id, func.length(StoredReceipt.body))
+                    .order_by(StoredReceipt.used_at)
+                    .limit(chunk)
+                ).all()
+                if not rows:
+                    break
+                ids = []
+                for receipt_id, length in rows:
+                    ids.append(receipt_id)
+                    freed += length
+                    if freed >= nbytes:
+                        break
+                session.execute(delete(ReceiptKey).where(ReceiptKey.receipt_id.in_(ids)))
+                session.execute(delete(StoredReceipt).where(StoredReceipt.id.in_(ids)))
+                deleted += len(ids)
+            session.commit()
+            return deleted, freed
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Database error while evicting stored receipts: {e}")
+            return 0, 0
+        finally:
+            session.close()
+
+    def get(self, packet_id, from_node=None):
+        """
+        The newest stored receipt a telegram was printed on
+
+        Args:
+            packet_id (int): The telegram's packet ID
+            from_node (int, optional): Its sender, for when two senders used the same packet ID
+
+        Returns:
+            dict: id, header (bytes or None), body, size, printed_at, reprints and the telegrams on it,
+                or None if it is not stored
+        """
+        statement = (
+            select(StoredReceipt, ReceiptHeader.data)
+            .join(ReceiptKey, ReceiptKey.receipt_id == StoredReceipt.id)
+            .outerjoin(ReceiptHeader, ReceiptHeader.id == StoredReceipt.header_id)
+            .where(ReceiptKey.packet_id == packet_id)
+            .order_by(StoredReceipt.printed_at.desc())
+            .limit(1)
+        )
+        if from_node is not None:
+            statement = statement.where(ReceiptKey.from_node == from_node)
+        session = self.session_factory()
+        try:
+            row = session.execute(statement).first()
+            if row is None:
+                return None
+            receipt, header = row
+            keys = session.execute(
+                select(ReceiptKey.from_node, ReceiptKey.packet_id).where(ReceiptKey.receipt_id == receipt.id)
+            ).all()
+            return {
+                "id": receipt.id, "header": header, "body": receipt.body, "size": receipt.size,
+                "printed_at": receipt.printed_at, "reprints": receipt.reprints, "keys": [tuple(key) for key in keys],
+            }
+        except SQLAlchemyError as e:
+            logger.error(f"Database error while loading the receipt for packet {packet_id}: {e}")
+            return None
+        finally:
+            session.close()
+
+    def mark_reprinted(self, receipt_id):
+        """Count a reprint and make the receipt the most recently used"""
+        session = self.session_factory()
+        try:
+            session.execute(
+                update(StoredReceipt).where(StoredReceipt.id == receipt_id)
+                .values(used_at=time.time(), reprints=StoredReceipt.reprints + 1)
+            )
+            session.commit()
+            return True
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Database error while updating receipt {receipt_id}: {e}")
+            return False
+        finally:
+            session.close()
+
+    def recent(self, limit=20):
+        """
+        The most recently printed stored telegrams
+
+        Returns:
+            list: Dicts with from_node, packet_id, receipt_id, size, stored (compressed bytes),
+                printed_at and reprints, newest first
+        """
+        statement = (
+            select(ReceiptKey.from_node, ReceiptKey.packet_id, StoredReceipt.id.label("receipt_id"),
+                   StoredReceipt.size, func.length(StoredReceipt.body).label("stored"),
+                   StoredReceipt.printed_at, StoredReceipt.reprints)
+            .join(StoredReceipt, StoredReceipt.id == ReceiptKey.receipt_id)
+            .order_by(StoredReceipt.printed_at.desc(), ReceiptKey.packet_id)
+            .limit(limit)
+        )
+        session = self.session_factory()
+        try:
+            return [row._asdict() for row in session.execute(statement)]
+        except SQLAlchemyError as e:
+            logger.error(f"Database error while listing stored receipts: {e}")
+            return []
+        finally:
+            session.close()
+
+def _naive_utc(value):
+    """Convert an aware datetime to the naive UTC values stored by SQLite"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _format_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+"""
+Synthetic Meshtastic MQTT load generator.
+
+Publishes realistic, encrypted ServiceEnvelope traffic (text, nodeinfo,
+position and telemetry) to a local broker such as the mosquitto from
+example-all-in-one, either at a fixed rate or as a ramp of increasing rates.
+A share of packets is re-published by other fake gateways, like real
+duplicate uplinks.
+
+When app.py runs with MQTT_STATS_TOPIC set, the generator listens to its
+stats and reports the highest rate app.py sustained before receive lag grew
+or packets were lost. Never point this at a public broker.
+"""
+import argparse
+import base64
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.backends import default_backend
+from dotenv import load_dotenv
+from meshtastic import mqtt_pb2, mesh_pb2
+from meshtastic.protobuf import portnums_pb2, telemetry_pb2
+
+logger = logging.getLogger('telegramtastic.loadgen')
+
+BROADCAST_ID = 4294967295
+DEFAULT_KEY = "1PG7OiApB1nwvP+rz05pAQ=="
+WORDS = "hello mesh anyone copy test from the booth see you at the table great show signal is strong today".split()
+
+class TrafficBuilder:
+    """Builds encrypted ServiceEnvelopes from a fixed pool of fake nodes and gateways"""
+
+    def __init__(self, key, nodes, gateways, channel, mix):
+        self.key = base64.b64decode(key.encode('ascii'))
+        self.channel = channel
+        self.nodes = random.sample(range(0x10000000, 0xFFFFFFF0), nodes)
+        self.gateways = [f"!{random.randrange(0x10000000, 0xFFFFFFFF):08x}" for _ in range(gateways)]
+        self.ports = list(mix.keys())
+        self.weights = list(mix.values())
+
+    def encrypt(self, packet_id, sender, data):
+        nonce = packet_id.to_bytes(8, "little") + sender.to_bytes(8, "little")
+        encryptor = Cipher(algorithms.AES(self.key), modes.CTR(nonce), backend=default_backend()).encryptor()
+        return encryptor.update(data.SerializeToString()) + encryptor.finalize()
+
+    def payload(self, kind, sender):
+        data = mesh_pb2.Data()
+        if kind == "text":
+            data.portnum = portnums_pb2.TEXT_MESSAGE_APP
+            data.payload = " ".join(random.choices(WORDS, k=random.randint(2, 12))).encode("utf-8")
+        elif kind == "nodeinfo":
+            user = mesh_pb2.User()
+            user.id = f"!{sender:08x}"
+            user.short_name = f"{sender & 0xFFFF:04x}"
+            user.long_name = f"Load Test {sender:08x}"
+            user.hw_model = random.choice([4, 9, 43, 50])
+            data.portnum = portnums_pb2.NODEINFO_APP
+            data.payload = user.SerializeToString()
+        elif kind == "position":
+            position = mesh_pb2.Position()
+            position.latitude_i = int(random.uniform(37.0, 38.0) * 1e7)
+            position.longitude_i = int(random.uniform(-122.5, -121.5) * 1e7)
+            position.altitude = random.randint(0, 400)
+            data.portnum = portnums_pb2.POSITION_APP
+            data.payload = position.SerializeToString()
+        else:
+            telemetry = telemetry_pb2.Telemetry()
+            telemetry.time = int(time.time())
+            telemetry.device_metrics.battery_level = random.randint(1, 100)
+            telemetry.device_metrics.voltage = random.uniform(3.3, 4.2)
+            telemetry.device_metrics.channel_utilization = random.uniform(0, 40)
+            data.portnum = portnums_pb2.TELEMETRY_APP
+            data.payload = telemetry.SerializeToString()
+        return data
+
+    def build(self):
+        """Return a new unique, encrypted MeshPacket"""
+        sender = random.choice(self.nodes)
+        kind = random.choices(self.ports, weights=self.weights)[0]
+        mp = mesh_pb2.MeshPacket()
+        setattr(mp, "from", sender)
+        mp.to = BROADCAST_ID
+        mp.id = random.getrandbits(32)
+        mp.channel = 8
+        mp.hop_start = 3
+        mp.encrypted = self.encrypt(mp.id, sender, self.payload(kind, sender))
+        return mp
+
+    def envelope(self, mp, gateway):
+        """Wrap a packet as heard by one gateway"""
+        copy = mesh_pb2.MeshPacket()
+        copy.CopyFrom(mp)
+        copy.rx_time = int(time.time())
+        copy.rx_snr = random.uniform(-15, 10)
+        copy.rx_rssi = random.randint(-125, -60)
+        copy.hop_limit = random.randint(0, mp.hop_start)
+        se = mqtt_pb2.ServiceEnvelope()
+        se.packet.CopyFrom(copy)
+        se.channel_id = self.channel
+        se.gateway_id = gateway
+        return se.SerializeToString()
+
+class StatsListener:
+    """Keeps the latest ingest stats published by app.py"""
+
+    def __init__(self):
+        self.latest = None
+        self.updated = threading.Event()
+
+    def on_message(self, client, userdata, msg):
+        try:
+            self.latest = json.loads(msg.payload)
+            self.updated.set()
+        except ValueError:
+            logger.warning("Ignoring malformed stats message")
+
+    def wait_fresh(self, timeout):
+        """Wait for the next stats message, returning it or None on timeout"""
+        self.updated.clear()
+        return self.latest if self.updated.wait(timeout) else None
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        kind, weight = item.split("=")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+def run_step(client, builder, args, rate, duration):
+    """Publish at a target rate for duration seconds and return (unique, total, achieved rate)"""
+    interval = 1.0 / rate
+    unique = total = 0
+    started = time.perf_counter()
+    next_send = started
+    while time.perf_counter() - started < duration:
+        mp = builder.build()
+        gateways = [random.choice(builder.gateways)]
+        if len(builder.gateways) > 1 and random.random() < args.dup_ratio:
+            # Heard by more than one gateway: same packet, different uplinks
+            extra = random.randint(1, min(3, len(builder.gateways) - 1))
+            gateways += random.sample([g for g in builder.gateways if g != gateways[0]], extra)
+        for gateway in gateways:
+            client.publish(f"{args.topic_root}/{gateway}", builder.envelope(mp, gateway), qos=args.qos)
+            total += 1
+        unique += 1
+        next_send += interval
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    elapsed = time.perf_counter() - started
+    return unique, total, total / elapsed
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Publish synthetic Meshtastic traffic to a local MQTT broker")
+    parser.add_argument("--host", default="localhost", help="MQTT broker (default: localhost)")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--user", default=os.getenv("MQTT_USER"))
+    parser.add_argument("--password", default=os.getenv("MQTT_PASS"))
+    parser.add_argument("--topic-root", default="msh/US/2/e/LongFast", help="Topic prefix; the gateway ID is appended")
+    parser.add_argument("--channel", default="LongFast", help="ServiceEnvelope channel_id")
+    parser.add_argument("--key", default=os.getenv("CHANNEL_KEY") or DEFAULT_KEY, help="Base64 channel key (default: CHANNEL_KEY)")
+    parser.add_argument("--nodes", type=int, default=200, help="Number of fake sender nodes")
+    parser.add_argument("--gateways", type=int, default=5, help="Number of fake gateways")
+    parser.add_argument("--dup-ratio", type=float, default=0.3, help="Share of packets also uplinked by other gateways")
+    parser.add_argument("--mix", type=parse_mix, default="text=0.1,nodeinfo=0.15,position=0.35,telemetry=0.4",
+                        help="Packet type weights (default: text=0.1,nodeinfo=0.15,position=0.35,telemetry=0.4)")
+    parser.add_argument("--qos", type=int, default=0, choices=(0, 1))
+    parser.add_argument("--rate", type=float, default=20, help="Unique packets per second for a fixed-rate run")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds per run or ramp step")
+    parser.add_argument("--ramp", help="start:stop:step unique packets per second, e.g. 10:500:10")
+    parser.add_argument("--stats-topic", default=os.getenv("MQTT_STATS_TOPIC", "telegramtastic/stats"),
+                        help="Topic app.py publishes MQTT_STATS_TOPIC stats on")
+    parser.add_argument("--stats-wait", type=float, default=12, help="Seconds to wait for app.py stats before starting")
+    parser.add_argument("--max-lag", type=float, default=2.0, help="p95 receive lag in seconds that counts as falling behind")
+    parser.add_argument("--min-delivery", type=float, default=0.99, help="Share of unique packets app.py must process")
+    args = parser.parse_args()
+
+    if args.ramp:
+        try:
+            start, stop, step = (float(v) for v in args.ramp.split(":"))
+        except ValueError:
+            parser.error(f"--ramp must be start:stop:step, not {args.ramp}")
+        if start <= 0 or step <= 0:
+            parser.error("--ramp start and step must be above 0")
+        rates = []
+        while start <= stop:
+            rates.append(start)
+            start += step
+    else:
+        if args.rate <= 0:
+            parser.error("--rate must be above 0")
+        rates = [args.rate]
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    builder = TrafficBuilder(args.key, args.nodes, args.gateways, args.channel, args.mix)
+    listener = StatsListener()
+    client = mqtt.Client()
+    if args.user:
+        client.username_pw_set(args.user, args.password)
+    client.on_message = listener.on_message
+    client.connect(args.host, args.port, keepalive=60)
+    client.subscribe(args.stats_topic)
+    client.loop_start()
+
+    sustained = None
+    sustained_msgs = None
+    baseline = listener.wait_fresh(args.stats_wait)
+    if baseline is None:
+        logger.warning(f"No stats from app.py on {args.stats_topic}; only publish rates will be reported")
+    try:
+        for rate in rates:
+            unique, total, achieved = run_step(client, builder, args, rate, args.duration)
+            logger.info(f"Step {rate:g}/s: published {unique} unique / {total} total messages ({achieved:.1f} msg/s)")
+            if baseline is None:
+                continue
+
+            # Give app.py a moment to drain, then compare what it processed against what we sent
+            time.sleep(2)
+            stats = listener.wait_fresh(15)
+            if stats is None:
+                logger.warning("app.py stopped publishing stats; stopping")
+                break
+            processed = stats["processed"] - baseline["processed"]
+            delivery = processed / unique if unique else 1
+            lag = stats.get("lag_p95") or 0
+            logger.info(f"  app.py processed {processed} ({delivery:.1%}), p95 lag {lag:.2f}s, print queue {stats.get('print_queue')}")
+            baseline = stats
+            if delivery < args.min_delivery or lag > args.max_lag:
+                logger.info(f"  app.py fell behind at {rate:g} unique packets/s")
+                break
+            sustained, sustained_msgs = rate, achieved
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+    if sustained is not None:
+        logger.info(f"Sustained rate: {sustained:g} unique packets/s ({sustained_msgs:.1f} msg/s including duplicates)")
+
+if __name__ == "__main__":
+    main()
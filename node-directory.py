@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""
+Query and export the node directory in the telegramtastic database.
+
+Uses the same SQLITE_DATABASE_PATH as app.py and can run while app.py is
+running. Examples:
+
+    python node-directory.py search ab
+    python node-directory.py seen --hours 24
+    python node-directory.py models
+    python node-directory.py list --after 305419896 --limit 50
+    python node-directory.py export --format ndjson -o nodes.ndjson
+    python node-directory.py reception --kind gateway --hours 24
+    python node-directory.py history "booth coffee" --hours 48
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+
+from database.connection import setup_database
+from database.repository import NodeRepository, RxStatRepository, PrintHistoryRepository
+
+logger = logging.getLogger('telegramtastic.nodedirectory')
+
+def print_nodes(nodes):
+    for node in nodes:
+        print(f"{node['node_id']:>10}  !{node['node_id']:08x}  {node['short_name'] or '':<6} "
+              f"{node['long_name'] or '':<40} {node['hw_model_name'] or '':<20} {node['last_seen']}")
+
+def print_reception(rows):
+    def fmt(value, width, spec=""):
+        return (format(value, spec) if value is not None else "-").rjust(width)
+    print(f"{'key':<14} {'packets':>8} {'first':>7} {'dups':>7} {'dup ms':>7} {'snr':>6} {'rssi':>6} {'hops':>5}")
+    for row in rows:
+        print(f"{row['key']:<14} {row['packets']:>8} {fmt(row['first_arrivals'], 7)} {fmt(row['duplicates'], 7)} "
+              f"{fmt(row['dup_delay_ms'], 7, '.0f')} {fmt(row['snr_p50'], 6, '.1f')} {fmt(row['rssi_p50'], 6, '.0f')} "
+              f"{fmt(row['hops_avg'], 5, '.1f')}")
+
+def print_history(hits):
+    for hit in hits:
+        sender = f"!{hit['from_node']:08x}" if hit['from_node'] is not None else "-"
+        printed = datetime.fromtimestamp(hit['printed_at']).isoformat(sep=" ", timespec="seconds")
+        print(f"{printed}  {sender:<10} {hit['short_name'] or '':<6} {hit['long_name'] or '':<30} "
+              f"{hit['packet_id'] if hit['packet_id'] is not None else '-':>10}  {hit['snippet']}")
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Query and export the telegramtastic node directory")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    search = sub.add_parser("search", help="Find nodes by short or long name prefix")
+    search.add_argument("prefix")
+    search.add_argument("--limit", type=int, default=50)
+
+    seen = sub.add_parser("seen", help="List nodes seen in the last N hours")
+    seen.add_argument("--hours", type=float, default=24)
+    seen.add_argument("--limit", type=int)
+
+    sub.add_parser("models", help="Count nodes by hardware model")
+
+    listing = sub.add_parser("list", help="List nodes one page at a time")
+    listing.add_argument("--after", type=int, help="node_id of the last node on the previous page")
+    listing.add_argument("--limit", type=int, default=100)
+
+    reception = sub.add_parser("reception", help="Reception statistics per gateway, node or channel")
+    reception.add_argument("--kind", choices=("gateway", "node", "channel"), default="gateway")
+    reception.add_argument("--hours", type=float, default=24)
+    reception.add_argument("--limit", type=int, default=20)
+
+    history = sub.add_parser("history", help="Search the text and senders of printed telegrams")
+    history.add_argument("query", help="Words to find; the last may be the start of a word")
+    history.add_argument("--node", type=lambda value: int(value[1:], 16) if value.startswith("!") else int(value),
+                         help="Only telegrams from this node, decimal or !hex")
+    history.add_argument("--hours", type=float, help="Only telegrams printed in the last N hours")
+    history.add_argument("--limit", type=int, default=20)
+    history.add_argument("--raw", action="store_true", help="Pass the query to FTS5 as is, e.g. 'coffee NOT tea'")
+
+    export = sub.add_parser("export", help="Stream every node as CSV or NDJSON")
+    export.add_argument("--format", choices=("csv", "ndjson"), default="csv")
+    export.add_argument("-o", "--output", help="Output file (default: stdout)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    session_factory = setup_database()
+    if not session_factory:
+        sys.exit("Unable to open the database")
+    repo = NodeRepository(session_factory)
+
+    started = time.perf_counter()
+    if args.command == "export":
+        fp = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+        try:
+            count = repo.export_nodes(fp, args.format)
+        finally:
+            if args.output:
+                fp.close()
+        if count is None:
+            sys.exit("Export failed")
+        print(f"Exported {count} nodes in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+        return
+
+    if args.command == "search":
+        result = repo.search_nodes(args.prefix, args.limit)
+    elif args.command == "seen":
+        result = repo.nodes_seen_since(datetime.now(timezone.utc) - timedelta(hours=args.hours), limit=args.limit)
+    elif args.command == "models":
+        result = repo.count_by_hw_model()
+    elif args.command == "reception":
+        since = datetime.now(timezone.utc) - timedelta(hours=args.hours)
+        result = RxStatRepository(session_factory).summary(args.kind, since, args.limit)
+    elif args.command == "history":
+        since = time.time() - args.hours * 3600 if args.hours is not None else None
+        result = PrintHistoryRepository(session_factory).search(args.query, args.limit, node_id=args.node,
+                                                                since=since, raw=args.raw)
+        if result is None:
+            sys.exit("Search failed; check the query syntax")
+    else:
+        result = repo.list_nodes(args.after, args.limit)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    if args.json:
+        print(json.dumps(result, default=str, indent=2))
+    elif args.command == "models":
+        for model, count in result.items():
+            print(f"{count:>8}  {model or 'unknown'}")
+    elif args.command == "reception":
+        print_reception(result)
+    elif args.command == "history":
+        print_history(result)
+    else:
+        print_nodes(result)
+        if args.command == "list" and result:
+            print(f"Next page: --after {result[-1]['node_id']}", file=sys.stderr)
+    print(f"{len(result)} result(s) in {elapsed_ms:.1f} ms", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
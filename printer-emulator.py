@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""
+ESC/POS network printer emulator.
+
+Listens on raw TCP port 9100 like a networked thermal printer, so app.py,
+app-dm.py and test-printer.py can run without hardware. Point PRINTER_IP at
+the emulator host. Every job (everything up to a cut) is logged with its byte
+count and estimated paper length, and decoded into a readable transcript.
+
+Print speed, paper-out and disconnects can be simulated to test throughput,
+queueing and failover.
+"""
+import argparse
+import logging
+import os
+import random
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+
+from common.escpos_decode import EscposDecoder
+
+logger = logging.getLogger('telegramtastic.emulator')
+
+# Bytes of received jobs held while out of paper before the emulator stops
+# reading, like a printer's receive buffer filling up
+RECEIVE_BUFFER = 64 * 1024
+
+class EmulatedPrinter:
+    """Shared emulator state: configuration, fault injection and counters"""
+
+    def __init__(self, args):
+        self.speed = args.speed
+        self.cut_time = args.cut_time
+        self.paper_out_every = args.paper_out_every
+        self.paper_out_time = args.paper_out_time
+        self.disconnect_every = args.disconnect_every
+        self.disconnect_prob = args.disconnect_prob
+        self.transcript_dir = args.transcript_dir
+        self.quiet = args.quiet
+
+        self.lock = threading.Lock()
+        self.paper_loaded = threading.Event()
+        self.paper_loaded.set()
+        self.started = time.monotonic()
+        self.jobs = 0
+        self.bytes = 0
+        self.paper_mm = 0.0
+        self.busy_seconds = 0.0
+        self.disconnects = 0
+
+        if self.transcript_dir:
+            os.makedirs(self.transcript_dir, exist_ok=True)
+
+    def status_byte(self, n):
+        """Answer a DLE EOT n real-time status request"""
+        paper_out = not self.paper_loaded.is_set()
+        if n == 1:
+            return 0x12 | (0x08 if paper_out else 0)  # offline while out of paper
+        if n == 2:
+            return 0x12 | (0x20 if paper_out else 0)  # stopped by paper end
+        if n == 4:
+            return 0x12 | (0x60 if paper_out else 0)  # roll paper end sensor
+        return 0x12
+
+    def should_disconnect(self):
+        return self.disconnect_prob and random.random() < self.disconnect_prob
+
+    def job_done(self, receipt, peer, raw):
+        """Record a finished job and simulate the time it takes to print"""
+        print_time = self.cut_time + (receipt.paper_mm / self.speed if self.speed else 0)
+        time.sleep(print_time)
+
+        with self.lock:
+            self.jobs += 1
+            self.bytes += receipt.bytes
+            self.paper_mm += receipt.paper_mm
+            self.busy_seconds += print_time
+            job = self.jobs
+
+        logger.info(f"Job {job} from {peer}: {receipt.bytes} bytes, {receipt.paper_mm:.0f} mm, printed in {print_time:.2f}s")
+        if not self.quiet:
+            logger.info(f"Job {job} transcript:\n{receipt.transcript()}")
+        if self.transcript_dir:
+            base = os.path.join(self.transcript_dir, f"job-{job:05d}")
+            with open(base + ".txt", "w") as f:
+                f.write(receipt.transcript() + "\n")
+            with open(base + ".bin", "wb") as f:
+                f.write(raw)
+
+        if self.paper_out_every and job % self.paper_out_every == 0:
+            logger.warning(f"Simulating paper out for {self.paper_out_time}s")
+            self.paper_loaded.clear()
+            threading.Timer(self.paper_out_time, self._reload_paper).start()
+        return job
+
+    def _reload_paper(self):
+        logger.info("Paper reloaded")
+        self.paper_loaded.set()
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return (
+            f"{self.jobs} jobs, {self.bytes} bytes, {self.paper_mm / 1000:.2f} m paper, "
+            f"{self.jobs / elapsed * 60:.1f} jobs/min, {self.busy_seconds / elapsed:.0%} busy, "
+            f"{self.disconnects} simulated disconnects"
+        )
+
+class PrinterHandler(socketserver.BaseRequestHandler):
+    """Handle one client connection, which may carry any number of jobs"""
+
+    def handle(self):
+        printer = self.server.printer
+        sock = self.request
+        peer = f"{self.client_address[0]}:{self.client_address[1]}"
+        logger.info(f"Client connected: {peer}")
+
+        raw = bytearray()
+        decoder = EscposDecoder(on_status=lambda n: sock.sendall(bytes([printer.status_byte(n)])))
+        # Decoded jobs waiting for paper, as (receipt, raw bytes)
+        held = deque()
+        jobs_on_connection = 0
+        try:
+            while True:
+                while held and printer.paper_loaded.is_set():
+                    receipt, job_raw = held.popleft()
+                    printer.job_done(receipt, peer, job_raw)
+                    jobs_on_connection += 1
+                    if printer.disconnect_every and jobs_on_connection % printer.disconnect_every == 0:
+                        printer.disconnects += 1
+                        logger.warning(f"Simulating disconnect from {peer} after {jobs_on_connection} jobs")
+                        return
+                if sum(receipt.bytes for receipt, _ in held) >= RECEIVE_BUFFER:
+                    # Buffer full: stop reading so the sender backs up like on a real printer
+                    printer.paper_loaded.wait()
+                    continue
+                # Out of paper, status requests are still answered; only printing waits.
+                # Wake up now and then to see if the paper is back
+                sock.settimeout(0.2 if held else None)
+                try:
+                    data = sock.recv(4096)
+                except socket.timeout:
+                    continue
+                if not data:
+                    break
+                if printer.should_disconnect():
+                    printer.disconnects += 1
+                    logger.warning(f"Simulating disconnect from {peer} after {len(raw)} bytes of the current job")
+                    return
+                raw += data
+                for receipt in decoder.feed(data):
+                    # Receipts consume bytes in order, so the job's bytes are at the front of raw
+                    job_raw = bytes(raw[:receipt.bytes])
+                    del raw[:receipt.bytes]
+                    held.append((receipt, job_raw))
+            # The sender is done; print what it left in the buffer
+            while held:
+                printer.paper_loaded.wait()
+                receipt, job_raw = held.popleft()
+                printer.job_done(receipt, peer, job_raw)
+        except OSError as e:
+            logger.warning(f"Connection error from {peer}: {e}")
+        finally:
+            for receipt in decoder.flush():
+                logger.info(f"Unterminated job from {peer} ({receipt.bytes} bytes, no cut):\n{receipt.transcript()}")
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            logger.info(f"Client disconnected: {peer}")
+
+class EmulatorServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, printer):
+        super().__init__(address, PrinterHandler)
+        self.printer = printer
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate an ESC/POS network printer for offline testing")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=9100, help="TCP port to listen on (default: 9100)")
+    parser.add_argument("--speed", type=float, default=150, help="Simulated print speed in mm/s, 0 for instant (default: 150)")
+    parser.add_argument("--cut-time", type=float, default=0.3, help="Simulated seconds per cut and feed (default: 0.3)")
+    parser.add_argument("--paper-out-every", type=int, default=0, help="Run out of paper after every N jobs")
+    parser.add_argument("--paper-out-time", type=float, default=10, help="Seconds until paper is reloaded (default: 10)")
+    parser.add_argument("--disconnect-every", type=int, default=0, help="Drop the connection after every N jobs on it")
+    parser.add_argument("--disconnect-prob", type=float, default=0, help="Probability of dropping the connection on each read")
+    parser.add_argument("--transcript-dir", help="Write each job's transcript and raw bytes to this directory")
+    parser.add_argument("--quiet", action="store_true", help="Log job summaries only, not transcripts")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    printer = EmulatedPrinter(args)
+    server = EmulatorServer((args.host, args.port), printer)
+    logger.info(f"ESC/POS emulator listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f"Summary: {printer.summary()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Reprint a telegram from the receipts app.py and app-dm.py stored when they
+printed it.
+
+The stored ESC/POS bytes are sent to the printer unchanged, so the copy
+matches the original, timestamp included, and nothing is rendered or looked
+up. Find a telegram's packet ID with "node-directory.py history". Examples:
+
+    python reprint.py list
+    python reprint.py send 3735928559
+    python reprint.py send 3735928559 --from !a1b2c3d4 --printer 192.168.1.50:9100 --copies 2
+    python reprint.py send 3735928559 --out /dev/usb/lp0
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from common.printers import PrinterTarget
+from common.receipts import load_receipt
+from database.connection import setup_database
+from database.repository import ReceiptRepository
+
+logger = logging.getLogger('telegramtastic.reprint')
+
+def parse_node(value):
+    return int(value[1:], 16) if value.startswith("!") else int(value)
+
+def iso(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat(sep=" ", timespec="seconds")
+
+def send(data, printer, copies):
+    """Send the bytes to a printer given as host[:port], usb:DEVICE or usb:VID:PID"""
+    # No reset: the stored bytes go out exactly as they were first sent
+    connection = PrinterTarget.parse(printer).open(reset=False)
+    try:
+        for _ in range(copies):
+            connection._raw(data)
+    finally:
+        connection.close()
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Reprint stored telegram receipts")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    listing = sub.add_parser("list", help="List the most recently printed stored telegrams")
+    listing.add_argument("--limit", type=int, default=20)
+    listing.add_argument("--json", action="store_true", help="Print results as JSON")
+
+    reprint = sub.add_parser("send", help="Send a telegram's stored receipt to a printer")
+    reprint.add_argument("packet_id", type=int)
+    reprint.add_argument("--from", dest="from_node", type=parse_node,
+                         help="Sender, decimal or !hex, if two senders used the packet ID")
+    default_printer = f"{os.getenv('PRINTER_IP')}:{os.getenv('PRINTER_PORT', 9100)}" if os.getenv("PRINTER_IP") else None
+    reprint.add_argument("--printer", default=default_printer,
+                         help="Printer as host[:port], usb:DEVICE or usb:VID:PID (default: PRINTER_IP and PRINTER_PORT)")
+    reprint.add_argument("--out", help="Write the bytes to this file or device instead, e.g. /dev/usb/lp0")
+    reprint.add_argument("--copies", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    session_factory = setup_database()
+    if not session_factory:
+        sys.exit("Unable to open the database")
+    repo = ReceiptRepository(session_factory)
+
+    if args.command == "list":
+        result = repo.recent(args.limit)
+        if args.json:
+            print(json.dumps(result, indent=2))
+            return
+        print(f"{'packet_id':>10}  {'from':<10} {'printed':<19} {'bytes':>6} {'stored':>6} {'reprints':>8}")
+        for row in result:
+            print(f"{row['packet_id']:>10}  !{row['from_node']:08x} {iso(row['printed_at']):<19} {row['size']:>6} "
+                  f"{row['stored']:>6} {row['reprints']:>8}")
+        return
+
+    started = time.perf_counter()
+    receipt, data = load_receipt(repo, args.packet_id, args.from_node)
+    if receipt is None:
+        sys.exit(f"No stored receipt for packet {args.packet_id}; it may have been evicted")
+    if args.out:
+        with open(args.out, "ab" if args.out.startswith("/dev/") else "wb") as fp:
+            for _ in range(args.copies):
+                fp.write(data)
+    elif args.printer:
+        send(data, args.printer, args.copies)
+    else:
+        sys.exit("No printer given; set PRINTER_IP or pass --printer or --out")
+    repo.mark_reprinted(receipt["id"])
+    others = len(receipt["keys"]) - 1
+    print(f"Reprinted {len(data)} bytes printed {iso(receipt['printed_at'])}"
+          + (f", a digest with {others} other telegram(s)" if others else "")
+          + f" in {(time.perf_counter() - started) * 1000:.0f} ms", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""
+Soak test app.py for hours against the printer emulator and report drift.
+
+"run" starts printer-emulator.py and app.py in soak mode (SOAK_INTERVAL),
+with their own database and spool under --dir, and feeds them through the
+broker for --hours: synthetic traffic from load-generator.py, or a feed
+captured with "record" and replayed in a loop. Replayed loops get new packet
+IDs, re-encrypted with the channel key, so they aren't taken for duplicates.
+app.py samples RSS, its largest allocation sites, queue depths and
+per-stage latency to an NDJSON file, and "report" shows which of them kept
+rising. Never point this at a public broker; "record" only subscribes.
+
+    python soak-test.py record --host mqtt.example.org --topic 'msh/US/2/e/LongFast/#' --minutes 30 --out feed.ndjson
+    python soak-test.py run --hours 8 --rate 5
+    python soak-test.py run --hours 24 --replay feed.ndjson --interval 300
+    python soak-test.py report data/soak/soak-20250809-100000.ndjson
+"""
+import argparse
+import base64
+import glob
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import paho.mqtt.client as mqtt
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from dotenv import load_dotenv
+from meshtastic import mqtt_pb2
+
+from common.soak import drift_report, format_report, load_samples
+
+logger = logging.getLogger('telegramtastic.soak-test')
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_KEY = "1PG7OiApB1nwvP+rz05pAQ=="
+
+def connect(args):
+    client = mqtt.Client()
+    if args.user:
+        client.username_pw_set(args.user, args.password)
+    client.connect(args.host, args.port, keepalive=60)
+    client.loop_start()
+    return client
+
+def record(args):
+    """Write every message on the topic to an NDJSON file with its offset in seconds"""
+    started = time.monotonic()
+    count = 0
+    with open(args.out, "w") as out:
+        def on_message(client, userdata, msg):
+            nonlocal count
+            out.write(json.dumps({
+                "t": round(time.monotonic() - started, 3),
+                "topic": msg.topic,
+                "payload": base64.b64encode(msg.payload).decode("ascii"),
+            }) + "\n")
+            count += 1
+
+        client = mqtt.Client()
+        if args.user:
+            client.username_pw_set(args.user, args.password)
+        client.on_message = on_message
+        client.connect(args.host, args.port, keepalive=60)
+        client.subscribe(args.topic)
+        try:
+            while not args.minutes or time.monotonic() - started < args.minutes * 60:
+                client.loop(timeout=1.0)
+        except KeyboardInterrupt:
+            pass
+        client.disconnect()
+    print(f"Recorded {count} messages in {time.monotonic() - started:.0f}s to {args.out}", file=sys.stderr)
+
+def renumber(payload, loop, key):
+    """A recorded envelope with a packet ID unique to this loop, re-encrypted to match"""
+    if not loop:
+        return payload
+    envelope = mqtt_pb2.ServiceEnvelope()
+    envelope.ParseFromString(payload)
+    packet = envelope.packet
+    old_id = packet.id
+    packet.id = (old_id + loop * 0x9E3779B1) & 0xFFFFFFFF
+    if packet.HasField("encrypted") and key is not None:
+        def ctr(packet_id, data):
+            nonce = packet_id.to_bytes(8, "little") + getattr(packet, "from").to_bytes(8, "little")
+            encryptor = Cipher(key, modes.CTR(nonce)).encryptor()
+            return encryptor.update(data) + encryptor.finalize()
+        # CTR decrypts and encrypts alike
+        packet.encrypted = ctr(packet.id, ctr(old_id, packet.encrypted))
+    return envelope.SerializeToString()
+
+def replay(client, path, seconds, key):
+    """Publish a recording with its original timing, looping until seconds have passed"""
+    with open(path) as f:
+        messages = [json.loads(line) for line in f if line.strip()]
+    if not messages:
+        sys.exit(f"{path} has no messages")
+    length = messages[-1]["t"] + 1
+    started = time.monotonic()
+    loop = 0
+    while time.monotonic() - started < seconds:
+        base = started + loop * length
+        for message in messages:
+            delay = base + message["t"] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if time.monotonic() - started >= seconds:
+                break
+            client.publish(message["topic"], renumber(base64.b64decode(message["payload"]), loop, key))
+        loop += 1
+        logger.info(f"Replayed {path} {loop} time(s)")
+
+def newest_samples(directory):
+    files = sorted(glob.glob(os.path.join(directory, "soak-*.ndjson")), key=os.path.getmtime)
+    return files[-1] if files else None
+
+def run(args):
+    directory = os.path.abspath(args.dir)
+    os.makedirs(directory, exist_ok=True)
+    procs = []
+    emulator = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "printer-emulator.py"), "--quiet",
+         "--port", str(args.printer_port), "--speed", str(args.speed)],
+        stdout=subprocess.DEVNULL, stderr=open(os.path.join(directory, "emulator.log"), "w")
+    )
+    procs.append(emulator)
+    env = dict(
+        os.environ,
+        PRINTER_TYPE="network",
+        PRINTER_IP="127.0.0.1",
+        PRINTER_PORT=str(args.printer_port),
+        MQTT_SRV=args.host,
+        MQTT_PORT=str(args.port),
+        MQTT_TOPICS=args.topics,
+        MQTT_CLIENT_ID=f"telegramtastic-soak-{os.getpid()}",
+        SQLITE_DATABASE_PATH=os.path.join(directory, "soak.db"),
+        PRINT_SPOOL_PATH=os.path.join(directory, "print-spool.ndjson"),
+        TRACE_DIR=directory,
+        CONFIG_FILE=os.path.join(directory, "none"),
+        SOAK_INTERVAL=str(args.interval),
+        STATUS_PORT=str(args.status_port),
+        CHANNEL_KEY=args.key or DEFAULT_KEY,
+    )
+    app_log = open(os.path.join(directory, "app.log"), "w")
+    time.sleep(1)
+    app = subprocess.Popen([sys.executable, os.path.join(HERE, "app.py")], env=env,
+                           stdout=app_log, stderr=subprocess.STDOUT, cwd=directory)
+    procs.append(app)
+    seconds = args.hours * 3600
+    started = time.monotonic()
+    try:
+        # Give the app time to connect before traffic starts
+        time.sleep(5)
+        if app.poll() is not None:
+            sys.exit(f"app.py exited with {app.returncode}, see {app_log.name}")
+        if args.replay:
+            client = connect(args)
+            try:
+                replay(client, args.replay, seconds, algorithms.AES(base64.b64decode(args.key or DEFAULT_KEY)))
+            finally:
+                client.loop_stop()
+                client.disconnect()
+        else:
+            generator = subprocess.Popen(
+                [sys.executable, os.path.join(HERE, "load-generator.py"), "--host", args.host, "--port", str(args.port),
+                 "--rate", str(args.rate), "--duration", str(seconds), "--nodes", str(args.nodes),
+                 "--stats-wait", "0", "--key", args.key or DEFAULT_KEY]
+                + (["--mix", args.mix] if args.mix else []),
+                stdout=subprocess.DEVNULL, stderr=open(os.path.join(directory, "load-generator.log"), "w")
+            )
+            procs.append(generator)
+            generator.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # SIGTERM lets app.py take a last sample and log its own report
+        for proc in reversed(procs):
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGTERM)
+        for proc in procs:
+            try:
+                proc.wait(30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    print(f"Soak ran {(time.monotonic() - started) / 3600:.2f} h; logs in {directory}", file=sys.stderr)
+    path = newest_samples(directory)
+    if path is None:
+        sys.exit("No soak samples were written")
+    return report(argparse.Namespace(path=path, json=False, warmup=args.warmup))
+
+def report(args):
+    samples = load_samples(args.path)
+    result = drift_report(samples, warmup=args.warmup)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        hours = (samples[-1]["t"] - samples[0]["t"]) / 3600 if samples else 0
+        print(f"{args.path}: {len(samples)} samples over {hours:.2f} h")
+        print(format_report(result))
+    return 1 if any(row["drift"] for row in result) else 0
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Soak test app.py and report memory and latency drift")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def broker(p):
+        p.add_argument("--host", default="localhost", help="MQTT broker (default: localhost)")
+        p.add_argument("--port", type=int, default=1883)
+        p.add_argument("--user", default=os.getenv("MQTT_USER"))
+        p.add_argument("--password", default=os.getenv("MQTT_PASS"))
+
+    soak = sub.add_parser("run", help="Run app.py against the emulator under load and report drift")
+    broker(soak)
+    soak.add_argument("--hours", type=float, default=8)
+    soak.add_argument("--rate", type=float, default=5, help="Synthetic unique packets per second (default: 5)")
+    soak.add_argument("--mix", help="Synthetic traffic mix, as for load-generator.py")
+    soak.add_argument("--nodes", type=int, default=200, help="Synthetic sender nodes")
+    soak.add_argument("--replay", help="Replay a feed captured with 'record' instead of synthetic traffic")
+    soak.add_argument("--key", default=os.getenv("CHANNEL_KEY"), help="Channel key (default: CHANNEL_KEY)")
+    soak.add_argument("--topics", default="msh/US/2/e/#", help="MQTT_TOPICS for app.py")
+    soak.add_argument("--interval", type=int, default=60, help="Seconds between samples (default: 60)")
+    soak.add_argument("--speed", type=float, default=150, help="Emulated print speed in mm/s (default: 150)")
+    soak.add_argument("--printer-port", type=int, default=9190)
+    soak.add_argument("--status-port", type=int, default=8190)
+    soak.add_argument("--dir", default="data/soak", help="Database, spool, logs and samples (default: data/soak)")
+    soak.add_argument("--warmup", type=float, default=0.1, help="Share of the run left out of the report")
+
+    capture = sub.add_parser("record", help="Capture a broker feed to replay later")
+    broker(capture)
+    capture.add_argument("--topic", required=True)
+    capture.add_argument("--minutes", type=float, default=0, help="Stop after this long (default: until Ctrl-C)")
+    capture.add_argument("--out", required=True)
+
+    show = sub.add_parser("report", help="Drift report for a samples file written in soak mode")
+    show.add_argument("path")
+    show.add_argument("--warmup", type=float, default=0.1)
+    show.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command == "record":
+        record(args)
+    elif args.command == "run":
+        sys.exit(run(args))
+    else:
+        sys.exit(report(args))
+
+if __name__ == "__main__":
+    main()
@@ -16,9 +16,10 @@ def setup_printer():
         if not printer_ip:
             print("Error: PRINTER_IP not set in .env file")
             sys.exit(1)
+        printer_port = int(os.getenv("PRINTER_PORT", 9100))
         try:
-            print(f"Connecting to network printer at {printer_ip}...")
-            return Network(printer_ip)
+            print(f"Connecting to network printer at {printer_ip}:{printer_port}...")
+            return Network(printer_ip, port=printer_port)
         except Exception as e:
             print(f"Error connecting to network printer: {e}")
             sys.exit(1)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Query the decoded traffic archive written by app.py when ARCHIVE_DIR is set.
+
+Segments whose index shows they can't hold a match are skipped without
+being decompressed, so narrowing by node, time or port keeps scans of
+multi-day captures fast. Matching packets are printed as NDJSON, one per
+line. Examples:
+
+    python traffic-archive.py segments
+    python traffic-archive.py query --node !a1b2c3d4 --hours 6
+    python traffic-archive.py query --port TEXT_MESSAGE_APP --since 2024-08-09T10:00 --until 2024-08-09T12:00
+    python traffic-archive.py query --node 305419896 --count
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+import meshtastic.protobuf.portnums_pb2 as portnums_pb2
+
+from common.archive import list_segments, scan
+
+logger = logging.getLogger('telegramtastic.trafficarchive')
+
+def parse_node(value):
+    return int(value[1:], 16) if value.startswith("!") else int(value)
+
+def parse_port(value):
+    return int(value) if value.isdigit() else portnums_pb2.PortNum.Value(value.upper())
+
+def parse_time(value):
+    """An ISO date and time, in local time unless it carries an offset"""
+    return datetime.fromisoformat(value).timestamp()
+
+def iso(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat(timespec="seconds") if timestamp is not None else "-"
+
+def print_segments(segments):
+    print(f"{'segment':<40} {'start':<19} {'end':<19} {'packets':>8} {'nodes':>6} {'KiB':>8}")
+    for path, index in segments:
+        name = os.path.basename(path)
+        if index is None:
+            print(f"{name:<40} {'(open or unindexed)':<39} {'':>8} {'':>6} {os.path.getsize(path) // 1024:>8}")
+        else:
+            print(f"{name:<40} {iso(index['start']):<19} {iso(index['end']):<19} {index['records']:>8} "
+                  f"{len(index['nodes']):>6} {index['bytes'] // 1024:>8}")
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Query the telegramtastic traffic archive")
+    parser.add_argument("--dir", default=os.getenv("ARCHIVE_DIR") or "data/archive",
+                        help="Archive directory (default: ARCHIVE_DIR)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    segments = sub.add_parser("segments", help="List segments and their indexes")
+    segments.add_argument("--json", action="store_true", help="Print the indexes as JSON")
+
+    query = sub.add_parser("query", help="Print archived packets matching every filter given, as NDJSON")
+    query.add_argument("--node", type=parse_node, help="Packets from or to this node, decimal or !hex")
+    query.add_argument("--port", type=parse_port, action="append",
+                       help="Port name or number, e.g. TEXT_MESSAGE_APP; may be repeated")
+    query.add_argument("--since", type=parse_time, help="ISO date/time, e.g. 2024-08-09T10:00")
+    query.add_argument("--until", type=parse_time, help="ISO date/time")
+    query.add_argument("--hours", type=float, help="Only the last N hours (instead of --since)")
+    query.add_argument("--limit", type=int, help="Stop after this many packets")
+    query.add_argument("--count", action="store_true", help="Only print the number of matching packets")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if not os.path.isdir(args.dir):
+        sys.exit(f"No archive directory at {args.dir}")
+
+    if args.command == "segments":
+        result = list_segments(args.dir)
+        if args.json:
+            print(json.dumps([index or {"segment": os.path.basename(path)} for path, index in result], indent=2))
+        else:
+            print_segments(result)
+        return
+
+    since = time.time() - args.hours * 3600 if args.hours is not None else args.since
+    stats = {}
+    started = time.perf_counter()
+    count = 0
+    try:
+        for record in scan(args.dir, node=args.node, since=since, until=args.until,
+                           portnums=set(args.port) if args.port else None, stats=stats):
+            count += 1
+            if not args.count:
+                print(json.dumps(record, separators=(",", ":")))
+            if args.limit is not None and count >= args.limit:
+                break
+    except BrokenPipeError:
+        # Piped into head or similar
+        sys.stderr.close()
+        return
+    if args.count:
+        print(count)
+    print(f"{count} packet(s) in {(time.perf_counter() - started) * 1000:.0f} ms; read {stats['scanned']} of "
+          f"{stats['segments']} segment(s), {stats['skipped']} skipped by index", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()